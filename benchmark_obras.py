@@ -0,0 +1,696 @@
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from peewee import CharField, OperationalError
+import modelo_orm
+import gestionar_obras
+from gestionar_obras import GestionarObra, ARCHIVO_CSV, ATRASOS_EN_CACHE, COLUMNAS_DATASET, DIMENSIONES, LIMITES_COORDENADAS, sqlite_db
+
+# Filas del CSV sintetico que se arman y se escriben por vez, asi generar 10 millones de filas no necesita tenerlas todas en memoria
+BLOQUE_GENERACION = 100000
+# En el dataset real hay una empresa distinta cada tres obras aproximadamente; en los archivos grandes se limita la cantidad de empresas
+EMPRESAS_POR_FILA = 1 / 3
+EMPRESAS_MAXIMAS = 20000
+
+# La carga original fila por fila hace varias consultas por obra: se mide solo sobre las primeras filas del dataset limpio
+FILAS_CARGA_POR_FILA = 5000
+# Filas del CSV sintetico que la suite lee, limpia y carga por vez: la memoria usada no depende del tamaño del dataset
+FILAS_BLOQUE_SUITE = 100000
+# Cada indicador se calcula varias veces y se toma el menor tiempo, las consultas de milisegundos varian mucho entre una ejecucion y otra
+REPETICIONES_INDICADORES = 5
+# Obras nuevas que recorren todas las operaciones del ciclo de vida
+OBRAS_CICLO_VIDA = 1000
+
+# Filas que se retienen en una lista para medir la memoria por obra de las instancias de Obra y de RegistroObra
+MUESTRA_MEMORIA = 100000
+
+# Filas del CSV de prueba con el que se verifica que los indicadores den lo mismo por SQL, con las tablas de resumen y en memoria
+FILAS_PARIDAD = 2000
+OBRAS_PARIDAD_CICLO_VIDA = 50
+
+# Un paso es una regresion si tarda mas que la referencia en esta proporcion y en al menos estos segundos (los pasos de milisegundos varian mucho)
+TOLERANCIA_REGRESION = 0.2
+DIFERENCIA_MINIMA_REGRESION = 0.005
+
+
+def generar_copia_sintetica(destino, veces=100, origen=ARCHIVO_CSV):
+    # Repite el dataset original 'veces' veces, desplazando el id y numerando el nombre para que cada fila siga siendo unica
+    df = pd.read_csv(origen, sep=';', encoding='latin1', dtype=str)
+    desplazamiento = int(df['id'].astype(int).max())
+    copias = []
+
+    for copia in range(veces):
+        parte = df.copy()
+        parte['id'] = (parte['id'].astype(int) + copia * desplazamiento).astype(str)
+        if copia:
+            parte['nombre'] = parte['nombre'] + f' ({copia})'
+        copias.append(parte)
+
+    pd.concat(copias).to_csv(destino, sep=';', encoding='latin1', index=False)
+    return destino
+
+
+def limpiar_datos_original(df):
+    # Implementacion anterior de GestionarObra.limpiar_datos, se conserva solo como referencia para comparar tiempos.
+    # Usa sus propias columnas (las 18 de entonces) para que la comparacion no cambie al ampliar COLUMNAS_DATASET
+    columnas = ('nombre', 'etapa', 'tipo', 'area_responsable', 'monto_contrato', 'comuna', 'barrio', 'fecha_inicio', 'fecha_fin_inicial', 'plazo_meses', 'porcentaje_avance', 'licitacion_oferta_empresa', 'contratacion_tipo', 'nro_contratacion', 'mano_obra', 'destacada', 'expediente-numero', 'financiamiento')
+    for column in df.columns:
+        # Elimina todas las columnas no necesarias del dataframe
+        if columnas.count(column) == 0:
+            df = df.drop(columns=[column])
+        # Elimina los valores nulos en todas las columnas consideradas importantes para el trabajo
+        elif column == 'comuna' or column == 'barrio' or column == 'destacada':
+            df = df.dropna(subset=[column])
+            # Reindexa las columnas
+            df = df.reset_index(drop=True)
+        elif column == 'monto_contrato':
+            df[column] = pd.to_numeric(df[column],errors='coerce')
+            df = df.dropna(subset=[column])
+            df = df.reset_index(drop=True)
+
+    return df
+
+
+def medir(funcion, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcion(*args, **kwargs)
+    return resultado, time.perf_counter() - inicio
+
+
+def comparar_limpieza(veces=100):
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = generar_copia_sintetica(os.path.join(directorio, 'obras.csv'), veces)
+
+        df_completo, lectura_original = medir(pd.read_csv, archivo, sep=';', decimal=',', encoding='latin1')
+        df_original, limpieza_original = medir(limpiar_datos_original, df_completo)
+        del df_completo
+
+        df_leido, lectura_vectorizada = medir(GestionarObra.extraer_datos, archivo=archivo)
+        informe = {}
+        df_vectorizada, limpieza_vectorizada = medir(GestionarObra.limpiar_datos, df_leido, informe)
+
+    print(f'Lectura y limpieza de {veces} copias del dataset:')
+    print(f'-Implementacion original: lectura {lectura_original:.2f} s, limpieza {limpieza_original:.2f} s ({len(df_original)} filas validas)')
+    print(f'-Implementacion vectorizada: lectura {lectura_vectorizada:.2f} s, limpieza {limpieza_vectorizada:.2f} s ({len(df_vectorizada)} filas validas)')
+    print(f'-Limpieza por fila conservada: {limpieza_original / len(df_original) * 1e6:.1f} us vs {limpieza_vectorizada / len(df_vectorizada) * 1e6:.1f} us')
+    GestionarObra._mostrar_informe_limpieza(informe)
+
+    return {
+        'original': {'lectura': lectura_original, 'limpieza': limpieza_original, 'filas': len(df_original)},
+        'vectorizada': {'lectura': lectura_vectorizada, 'limpieza': limpieza_vectorizada, 'filas': len(df_vectorizada)},
+    }
+
+
+def generar_csv_sintetico(destino, filas=100000, semilla=0, origen=ARCHIVO_CSV):
+    # Archivo con el formato del observatorio armado con filas del dataset real elegidas al azar: etapas, tipos, barrios, montos y fechas
+    # (incluidos los valores sucios que corrige la limpieza) siguen la distribucion real. Cada fila tiene un id y un nombre unicos y las empresas
+    # se reparten entre tantas como corresponde a la cantidad de filas, pocas con muchas obras y muchas con pocas
+    rng = np.random.default_rng(semilla)
+    real = pd.read_csv(origen, sep=';', encoding='latin1', dtype=str, usecols=COLUMNAS_DATASET)
+    empresas_reales = real['licitacion_oferta_empresa'].dropna().unique()
+    cantidad_empresas = max(len(empresas_reales), min(int(filas * EMPRESAS_POR_FILA), EMPRESAS_MAXIMAS))
+    empresas = np.concatenate([empresas_reales, [f'Empresa Sintetica {numero}' for numero in range(len(empresas_reales), cantidad_empresas)]])
+    pesos = 1 / np.arange(1, cantidad_empresas + 1)
+    pesos /= pesos.sum()
+
+    for desde in range(0, filas, BLOQUE_GENERACION):
+        cantidad = min(BLOQUE_GENERACION, filas - desde)
+        parte = real.iloc[rng.integers(0, len(real), cantidad)].reset_index(drop=True)
+        parte['id'] = np.arange(desde + 1, desde + cantidad + 1).astype(str)
+        parte['nombre'] = parte['nombre'].fillna('Obra') + ' #' + parte['id']
+        empresa = parte['licitacion_oferta_empresa']
+        parte['licitacion_oferta_empresa'] = empresa.where(empresa.isna(), empresas[rng.choice(cantidad_empresas, cantidad, p=pesos)])
+        parte.to_csv(destino, sep=';', encoding='latin1', index=False, header=desde == 0, mode='w' if desde == 0 else 'a')
+
+    return destino
+
+
+def memoria_maxima():
+    # Maximo de memoria residente del proceso hasta el momento, en MB (Linux informa ru_maxrss en KiB)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def tamanio_base(ruta):
+    return sum(os.path.getsize(archivo) for archivo in (ruta, f'{ruta}-wal') if os.path.exists(archivo)) / 1024 / 1024
+
+
+def _operaciones_ciclo_vida(cantidad):
+    # Lotes de cada operacion del ciclo de vida sobre 'cantidad' obras nuevas, con valores de dimension que ya estan en la base
+    barrio = modelo_orm.Barrio.select().first()
+    nombres = [f'Obra de medicion {numero}' for numero in range(cantidad)]
+    dimensiones = {
+        'tipo_obra': modelo_orm.TipoObra.select().first().tipo,
+        'area_responsable': modelo_orm.AreaResponsable.select().first().area,
+        'barrio': barrio.nombre,
+        'comuna': barrio.comuna.numero,
+    }
+
+    return [
+        ('nuevo_proyecto', [{'nombre': nombre, **dimensiones} for nombre in nombres]),
+        ('iniciar_contratacion', [{'nombre': nombre, 'tipo_contratacion': modelo_orm.TipoContratacion.select().first().tipo, 'nro_contratacion': f'{numero}/2024', 'monto_contrato': 1000000 + numero} for numero, nombre in enumerate(nombres)]),
+        ('adjudicar_obra', [{'nombre': nombre, 'empresa': modelo_orm.Empresa.select().first().nombre, 'nro_expediente': f'EX-{numero}'} for numero, nombre in enumerate(nombres)]),
+        ('iniciar_obra', [{'nombre': nombre, 'destacada': 'NO', 'fecha_inicio': '2024-01-01', 'fecha_fin_inicial': '2025-01-01', 'fuente_financiamiento': modelo_orm.FuenteFinanciamiento.select().first().fuente, 'mano_obra': 10} for nombre in nombres]),
+        ('actualizar_porcentaje_avance', [{'nombre': nombre, 'porcentaje_avance': 50} for nombre in nombres]),
+        ('incrementar_plazo', [{'nombre': nombre, 'plazo_meses': 14} for nombre in nombres]),
+        ('finalizar_obra', [{'nombre': nombre} for nombre in nombres]),
+    ]
+
+
+def ejecutar_suite(filas=100000, semilla=0):
+    # Mide cada paso de la carga, cada indicador y las operaciones del ciclo de vida sobre un dataset sintetico de 'filas' filas.
+    # De cada paso se guarda el tiempo, las filas por segundo y la memoria maxima del proceso al terminarlo. El CSV se lee, limpia y carga
+    # de a FILAS_BLOQUE_SUITE filas; la lectura, la limpieza y la carga masiva suman los tiempos de todos los bloques y cada bloque de la
+    # carga masiva se guarda tambien por separado
+    ruta_original = sqlite_db.database
+    pasos = {}
+    bloques = []
+
+    def registrar(nombre, segundos, cantidad):
+        pasos[nombre] = {'segundos': segundos, 'filas_por_segundo': cantidad / segundos if segundos > 0 else 0, 'memoria_maxima_mb': memoria_maxima()}
+
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo, generacion = medir(generar_csv_sintetico, os.path.join(directorio, 'obras.csv'), filas, semilla)
+        base = os.path.join(directorio, 'obras.db')
+        tiempos = {'extraer_datos': 0.0, 'limpiar_datos': 0.0, 'cargar_datos_masivo': 0.0}
+        leidas = cargadas = 0
+        # Nombres de los bloques anteriores, para descartar los repetidos entre bloques como limpiar_datos_en_bloques
+        nombres = set()
+
+        lector = GestionarObra.extraer_datos(FILAS_BLOQUE_SUITE, archivo)
+        while True:
+            df, segundos = medir(next, lector, None)
+            tiempos['extraer_datos'] += segundos
+            if df is None:
+                break
+            limpio, segundos = medir(GestionarObra.limpiar_datos, df, {}, nombres)
+            tiempos['limpiar_datos'] += segundos
+            leidas += len(df)
+            del df
+
+            if not bloques:
+                # La carga fila por fila se mide con las primeras filas del primer bloque, en una base aparte para que la carga masiva
+                # empiece tambien con la base vacia
+                modelo_orm.configurar_db(os.path.join(directorio, 'por_fila.db'))
+                GestionarObra.mapear_orm()
+                por_fila = limpio.head(FILAS_CARGA_POR_FILA)
+                with modelo_orm.sesion():
+                    _, por_fila_segundos = medir(GestionarObra.cargar_datos, por_fila)
+                modelo_orm.configurar_db(base)
+                GestionarObra.mapear_orm()
+
+            with modelo_orm.sesion():
+                _, segundos = medir(GestionarObra.cargar_datos_masivo, limpio)
+            tiempos['cargar_datos_masivo'] += segundos
+            cargadas += len(limpio)
+            bloques.append({'filas': len(limpio), 'segundos': segundos, 'filas_por_segundo': len(limpio) / segundos if segundos > 0 else 0, 'memoria_maxima_mb': memoria_maxima()})
+
+        registrar('extraer_datos', tiempos['extraer_datos'], leidas)
+        registrar('limpiar_datos', tiempos['limpiar_datos'], leidas)
+        registrar('cargar_datos', por_fila_segundos, len(por_fila))
+        registrar('cargar_datos_masivo', tiempos['cargar_datos_masivo'], cargadas)
+
+        with modelo_orm.sesion():
+            obras = modelo_orm.Obra.select().count()
+
+            for materializado, prefijo in ((False, 'indicadores'), (True, 'indicadores_resumen')):
+                for nombre, consulta in GestionarObra._consultas_indicadores(materializado).items():
+                    segundos = min(medir(lambda: list(consulta.tuples()))[1] for _ in range(REPETICIONES_INDICADORES))
+                    registrar(f'{prefijo}.{nombre}', segundos, obras)
+
+            # La base es nueva: el primer calculo de los atrasos no sale de la cache
+            _, segundos = medir(GestionarObra.calcular_atrasos)
+            registrar('atrasos', segundos, obras)
+
+            for operacion, elementos in _operaciones_ciclo_vida(OBRAS_CICLO_VIDA):
+                resultados, segundos = medir(GestionarObra.aplicar_transiciones, operacion, elementos, 'nombre')
+                if not all(resultado['ok'] for resultado in resultados):
+                    raise AssertionError(f'La operacion {operacion} no se aplico a todas las obras de la medicion')
+                registrar(f'ciclo_vida.{operacion}', segundos, len(elementos))
+
+        tamanio = tamanio_base(base)
+        modelo_orm.configurar_db(ruta_original)
+
+    return {
+        'filas': filas,
+        'semilla': semilla,
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'generacion_segundos': generacion,
+        'tamanio_base_mb': tamanio,
+        'memoria_maxima_mb': memoria_maxima(),
+        'pasos': pasos,
+        'bloques': bloques,
+    }
+
+
+def mostrar_suite(resultados):
+    print(f"\nMedicion sobre {resultados['filas']} filas sinteticas (semilla {resultados['semilla']}, CSV generado en {resultados['generacion_segundos']:.2f} s):")
+    for nombre, paso in resultados['pasos'].items():
+        print(f"-{nombre}: {paso['segundos'] * 1000:.1f} ms, {paso['filas_por_segundo']:.0f} filas/s, memoria maxima {paso['memoria_maxima_mb']:.0f} MB")
+    print(f"Carga masiva por bloque ({len(resultados['bloques'])} bloques):")
+    for numero, bloque in enumerate(resultados['bloques'], 1):
+        print(f"-bloque {numero}: {bloque['filas']} filas en {bloque['segundos'] * 1000:.1f} ms, {bloque['filas_por_segundo']:.0f} filas/s, memoria maxima {bloque['memoria_maxima_mb']:.0f} MB")
+    print(f"Base de datos: {resultados['tamanio_base_mb']:.1f} MB. Memoria maxima del proceso: {resultados['memoria_maxima_mb']:.0f} MB")
+
+
+def comparar_con_referencia(resultados, referencia, tolerancia=TOLERANCIA_REGRESION):
+    # Devuelve los pasos que tardaron mas que en la referencia por encima de la tolerancia; solo se comparan mediciones con la misma cantidad de filas
+    if referencia['filas'] != resultados['filas']:
+        print(f"La referencia se midio con {referencia['filas']} filas y esta medicion con {resultados['filas']}: no se comparan")
+        return None
+
+    regresiones = {}
+    print(f"\nComparacion con la referencia del {referencia['fecha']} (tolerancia {tolerancia:.0%}):")
+    for nombre, paso in resultados['pasos'].items():
+        anterior = referencia['pasos'].get(nombre)
+        if anterior is None:
+            print(f'-{nombre}: sin referencia')
+            continue
+        cociente = paso['segundos'] / anterior['segundos'] if anterior['segundos'] > 0 else float('inf')
+        regresion = cociente > 1 + tolerancia and paso['segundos'] - anterior['segundos'] > DIFERENCIA_MINIMA_REGRESION
+        if regresion:
+            regresiones[nombre] = cociente
+        print(f"-{nombre}: {anterior['segundos'] * 1000:.1f} ms -> {paso['segundos'] * 1000:.1f} ms ({cociente:.2f}x){'  <-- REGRESION' if regresion else ''}")
+
+    print(f'Pasos con regresiones: {len(regresiones)} de {len(resultados["pasos"])}')
+    return regresiones
+
+
+def generar_base_sintetica(ruta, obras=100000):
+    # Crea una base con 'obras' obras repartidas al azar dentro de la ciudad, todas con las mismas dimensiones
+    modelo_orm.configurar_db(ruta)
+    GestionarObra.mapear_orm()
+    random.seed(0)
+    (lat_min, lat_max), (lng_min, lng_max) = LIMITES_COORDENADAS['lat'], LIMITES_COORDENADAS['lng']
+
+    with modelo_orm.sesion(), sqlite_db.atomic():
+        Obra = modelo_orm.Obra
+        dimensiones = {
+            Obra.etapa: modelo_orm.Etapa.create(estado='En ejecución'),
+            Obra.tipo_obra: modelo_orm.TipoObra.create(tipo='Espacio Público'),
+            Obra.area_responsable: modelo_orm.AreaResponsable.create(area='Ministerio de Espacio Público'),
+            Obra.comuna: modelo_orm.Comuna.create(numero=1),
+        }
+        filas = [{Obra.nombre: f'Obra {numero}', Obra.latitud: random.uniform(lat_min, lat_max), Obra.longitud: random.uniform(lng_min, lng_max), **dimensiones} for numero in range(obras)]
+        GestionarObra._insertar_filas(Obra, filas)
+
+
+def comparar_busqueda_espacial(obras=100000, consultas=50, metros=1000, cantidad=10):
+    ruta_original = sqlite_db.database
+    with tempfile.TemporaryDirectory() as directorio:
+        generar_base_sintetica(os.path.join(directorio, 'obras.db'), obras)
+        (lat_min, lat_max), (lng_min, lng_max) = LIMITES_COORDENADAS['lat'], LIMITES_COORDENADAS['lng']
+        puntos = [(random.uniform(lat_min, lat_max), random.uniform(lng_min, lng_max)) for _ in range(consultas)]
+        busquedas = {
+            f'radio de {metros} m': lambda lat, lng, indice: GestionarObra.obras_en_radio(lat, lng, metros, indice),
+            'rectangulo de 0.01 grados': lambda lat, lng, indice: GestionarObra.obras_en_rectangulo(lat, lng, lat + 0.01, lng + 0.01, indice),
+            f'{cantidad} mas cercanas': lambda lat, lng, indice: GestionarObra.obras_cercanas(lat, lng, cantidad, indice),
+        }
+        tiempos = {}
+
+        with modelo_orm.sesion():
+            for nombre, busqueda in busquedas.items():
+                con_indice, segundos_indice = medir(lambda: [busqueda(lat, lng, True) for lat, lng in puntos])
+                sin_indice, segundos_recorrido = medir(lambda: [busqueda(lat, lng, False) for lat, lng in puntos])
+                if con_indice != sin_indice:
+                    raise AssertionError(f'La busqueda por {nombre} con el indice espacial no coincide con el recorrido completo')
+                tiempos[nombre] = {'indice': segundos_indice / consultas, 'recorrido': segundos_recorrido / consultas, 'resultados': sum(map(len, con_indice)) / consultas}
+
+        modelo_orm.configurar_db(ruta_original)
+
+    print(f'Busquedas por ubicacion sobre {obras} obras ({consultas} consultas de cada tipo):')
+    for nombre, tiempo in tiempos.items():
+        print(f"-{nombre}: {tiempo['indice'] * 1000:.2f} ms con el indice vs {tiempo['recorrido'] * 1000:.2f} ms recorriendo la tabla ({tiempo['resultados']:.1f} obras por consulta)")
+
+    return tiempos
+
+
+def generar_base_indicadores(ruta, obras=10000000):
+    # Base sintetica para medir los indicadores: las obras se generan dentro de SQLite con una consulta recursiva y sin los triggers,
+    # que despues se reemplazan reconstruyendo las tablas de resumen una sola vez
+    modelo_orm.configurar_db(ruta)
+    GestionarObra.mapear_orm()
+
+    with modelo_orm.sesion(), sqlite_db.atomic():
+        for nombre, in sqlite_db.execute_sql("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'obra'").fetchall():
+            sqlite_db.execute_sql(f'DROP TRIGGER {nombre}')
+
+        modelo_orm.Etapa.insert_many([{'estado': estado} for estado in ('Finalizada', 'En ejecución', 'En proyecto', 'En licitación', 'Rescindida', 'Neutralizada')]).execute()
+        modelo_orm.TipoObra.insert_many([{'tipo': f'Tipo {numero}'} for numero in range(12)]).execute()
+        modelo_orm.AreaResponsable.insert_many([{'area': f'Area {numero}'} for numero in range(10)]).execute()
+        modelo_orm.Comuna.insert_many([{'numero': numero} for numero in range(1, 16)]).execute()
+        modelo_orm.Barrio.insert_many([{'nombre': f'Barrio {numero}', 'comuna': numero % 15 + 1} for numero in range(48)]).execute()
+        GestionarObra._insertar_filas(modelo_orm.Empresa, [{modelo_orm.Empresa.nombre: f'Empresa {numero}'} for numero in range(1000)])
+
+        # Una de cada diez obras queda sin monto y una de cada siete sin mano de obra, como los nulos del dataset real
+        sqlite_db.execute_sql('''
+            INSERT INTO obra (nombre, monto_contrato, plazo_meses, mano_obra, etapa_id, tipo_obra_id, area_responsable_id, comuna_id, barrio_id, empresa_id)
+            WITH RECURSIVE numeros(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM numeros WHERE i < ?)
+            SELECT 'Obra ' || i, CASE WHEN i % 10 THEN abs(random() % 10000000000) / 100.0 END, abs(random() % 48), CASE WHEN i % 7 THEN abs(random() % 500) END,
+                1 + abs(random() % 6), 1 + abs(random() % 12), 1 + abs(random() % 10), 1 + abs(random() % 15), 1 + abs(random() % 48), 1 + abs(random() % 1000)
+            FROM numeros''', (obras,))
+
+    GestionarObra.reconstruir_resumenes()
+
+
+def comparar_indicadores(obras=10000000, repeticiones=5):
+    ruta_original = sqlite_db.database
+    with tempfile.TemporaryDirectory() as directorio:
+        _, generacion = medir(generar_base_indicadores, os.path.join(directorio, 'obras.db'), obras)
+
+        with modelo_orm.sesion():
+            sql, segundos_sql = medir(GestionarObra.calcular_indicadores, materializado=False)
+            _, segundos_resumen = medir(GestionarObra.calcular_indicadores)
+            datos, segundos_carga = medir(GestionarObra.cargar_en_memoria)
+            _, segundos_memoria = medir(lambda: [GestionarObra.calcular_indicadores_en_memoria(datos) for _ in range(repeticiones)])
+            diferencias = GestionarObra._diferencias_indicadores(sql, GestionarObra.calcular_indicadores_en_memoria(datos))
+
+        modelo_orm.configurar_db(ruta_original)
+
+    if diferencias:
+        raise AssertionError(f'Los indicadores calculados en memoria no coinciden con los de la base: {diferencias}')
+
+    print(f'Indicadores sobre {obras} obras (base generada en {generacion:.2f} s):')
+    print(f'-SQL sobre la tabla obra: {segundos_sql:.3f} s')
+    print(f'-tablas de resumen: {segundos_resumen:.3f} s')
+    print(f'-en memoria: {segundos_memoria / repeticiones:.3f} s por calculo, mas {segundos_carga:.2f} s para cargar la tabla una vez')
+
+    return {'sql': segundos_sql, 'resumen': segundos_resumen, 'carga': segundos_carga, 'memoria': segundos_memoria / repeticiones}
+
+
+def verificar_paridad(filas=FILAS_PARIDAD, semilla=0):
+    # Carga un CSV chico armado con filas del dataset real y compara los indicadores por SQL sobre la tabla obra con los de las tablas de
+    # resumen y los calculados en memoria, despues de la carga masiva y otra vez despues de que el ciclo de vida modifica obras (las tablas
+    # de resumen se mantienen por triggers). Devuelve la lista de diferencias, vacia si todo coincide
+    ruta_original = sqlite_db.database
+    diferencias = []
+
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = generar_csv_sintetico(os.path.join(directorio, 'obras.csv'), filas, semilla)
+        modelo_orm.configurar_db(os.path.join(directorio, 'obras.db'))
+        GestionarObra.mapear_orm()
+
+        with modelo_orm.sesion():
+            GestionarObra.cargar_datos_masivo(GestionarObra.limpiar_datos(GestionarObra.extraer_datos(archivo=archivo), {}))
+            for momento in ('carga', 'ciclo de vida'):
+                if momento == 'ciclo de vida':
+                    for operacion, elementos in _operaciones_ciclo_vida(OBRAS_PARIDAD_CICLO_VIDA):
+                        GestionarObra.aplicar_transiciones(operacion, elementos, 'nombre')
+
+                sql = GestionarObra.calcular_indicadores(materializado=False)
+                diferencias += [f'{momento}, resumen: {diferencia}' for diferencia in GestionarObra._diferencias_indicadores(sql, GestionarObra.calcular_indicadores())]
+                diferencias += [f'{momento}, memoria: {diferencia}' for diferencia in GestionarObra._diferencias_indicadores(sql, GestionarObra.calcular_indicadores_en_memoria())]
+                diferencias += [f'{momento}, tabla {tabla} {clave}: guardado {guardado}, esperado {esperado}' for tabla, clave, guardado, esperado in GestionarObra.verificar_resumenes()]
+
+        modelo_orm.configurar_db(ruta_original)
+
+    if diferencias:
+        print(f'Los indicadores tienen {len(diferencias)} diferencias:')
+        for diferencia in diferencias:
+            print(f'-{diferencia}')
+    else:
+        print(f'Los indicadores por SQL, con las tablas de resumen y en memoria coinciden sobre {filas} filas')
+
+    return diferencias
+
+
+def verificar_migracion(base=None, archivo=ARCHIVO_CSV):
+    # Migra una copia de la base (por defecto la de la aplicacion, creada por el cargador original) y le sincroniza el CSV. Despues no puede
+    # haber dos obras que sean la misma una vez reparado el texto, ni dos valores de una dimension de texto con la misma clave (sin distinguir
+    # mayusculas, acentos ni espacios), ni textos sin reparar, y las tablas de resumen tienen que coincidir con la tabla obra. Devuelve la lista de problemas, vacia si no hay ninguno
+    ruta_original = sqlite_db.database
+    problemas = []
+
+    with tempfile.TemporaryDirectory() as directorio:
+        copia = os.path.join(directorio, 'obras.db')
+        shutil.copy(base or ruta_original, copia)
+        modelo_orm.configurar_db(copia)
+        GestionarObra.mapear_orm()
+
+        with modelo_orm.sesion():
+            GestionarObra.sincronizar_en_bloques(cache=False)
+
+            campos = [(modelo_orm.Obra.nombre, 'obra', lambda valor: valor)] + [(campo, columna, GestionarObra._clave_dimension) for columna, campo, _ in DIMENSIONES if isinstance(campo, CharField)]
+            for campo, nombre, clave in campos:
+                reparados = {}
+                for valor, in campo.model.select(campo).where(campo.is_null(False)).tuples():
+                    reparado = GestionarObra._reparar_texto(valor)
+                    if reparado != valor:
+                        problemas.append(f'{nombre}: {valor!r} sin reparar')
+                    reparados.setdefault(clave(reparado), []).append(valor)
+                problemas += [f'{nombre}: {valores!r} repetidos' for valores in reparados.values() if len(valores) > 1]
+
+            problemas += [f'tabla {tabla} {clave}: guardado {guardado}, esperado {esperado}' for tabla, clave, guardado, esperado in GestionarObra.verificar_resumenes()]
+
+        modelo_orm.configurar_db(ruta_original)
+
+    if problemas:
+        print(f'La base migrada tiene {len(problemas)} problemas:')
+        for problema in problemas:
+            print(f'-{problema}')
+    else:
+        print('La base migrada no tiene obras ni valores de dimension repetidos')
+
+    return problemas
+
+
+def verificar_cache_atrasos(obras=1000):
+    # Calcula los atrasos a ATRASOS_EN_CACHE + 1 fechas distintas sobre una base sintetica: la cache tiene que conservar solo las ultimas,
+    # devolver el mismo analisis sin recalcularlo al repetir una de ellas y volver a calcular la primera, que se descarto. Se devuelven los
+    # problemas, vacio si no hay ninguno
+    ruta_original = sqlite_db.database
+    fechas = [datetime.date(2024, 1, 1) + datetime.timedelta(days=dia) for dia in range(ATRASOS_EN_CACHE + 1)]
+    problemas = []
+
+    with tempfile.TemporaryDirectory() as directorio:
+        generar_base_sintetica(os.path.join(directorio, 'obras.db'), obras)
+        base = sqlite_db.database
+        calculados = [GestionarObra.calcular_atrasos(fecha) for fecha in fechas]
+
+        guardadas = [fecha for ruta, fecha in gestionar_obras._cache_atrasos if ruta == base]
+        if guardadas != fechas[1:]:
+            problemas.append(f'la cache guarda las fechas {guardadas} en lugar de {fechas[1:]}')
+        if GestionarObra.calcular_atrasos(fechas[-1]) is not calculados[-1]:
+            problemas.append(f'los atrasos al {fechas[-1]} se volvieron a calcular estando en la cache')
+        if GestionarObra.calcular_atrasos(fechas[0]) is calculados[0]:
+            problemas.append(f'los atrasos al {fechas[0]} siguen en la cache')
+        if len(gestionar_obras._cache_atrasos) > ATRASOS_EN_CACHE:
+            problemas.append(f'la cache tiene {len(gestionar_obras._cache_atrasos)} analisis, el maximo es {ATRASOS_EN_CACHE}')
+
+        modelo_orm.configurar_db(ruta_original)
+
+    print(f'Cache de atrasos con {len(fechas)} fechas y lugar para {ATRASOS_EN_CACHE}: {"; ".join(problemas) if problemas else "se descarta la usada hace mas tiempo"}')
+    return problemas
+
+
+def verificar_etapas(archivo=ARCHIVO_CSV):
+    # Clasifica cada etapa escrita en el CSV como cerrada o abierta. Una etapa que habla de finalizar o rescindir y no se reconoce como cerrada
+    # es una variante nueva del dataset que falta en ETAPAS_CERRADAS; se devuelven esas etapas, vacio si no hay ninguna
+    etapas = pd.read_csv(archivo, sep=';', encoding='latin1', dtype=str, usecols=['etapa'])['etapa'].value_counts()
+    faltantes = []
+
+    print(f'Etapas del archivo {archivo}:')
+    for estado, cantidad in etapas.items():
+        cerrada = GestionarObra.etapa_cerrada(estado)
+        if not cerrada and any(palabra in estado.casefold() for palabra in ('finaliz', 'rescind')):
+            faltantes.append(estado)
+        print(f'-{estado!r}: {cantidad} obras, {"cerrada" if cerrada else "abierta"}')
+
+    if faltantes:
+        print(f'Etapas que parecen cerradas y no lo son para el analisis: {", ".join(map(repr, faltantes))}')
+    return faltantes
+
+
+def verificar_nombres_repetidos(origen=ARCHIVO_CSV):
+    # Arma un CSV con una obra de monto invalido seguida de dos validas con el mismo nombre y dos validas sin nombre, y lo limpia completo
+    # y de a una fila por bloque. En los dos casos se tiene que conservar la primera valida con nombre y las dos sin nombre; se devuelven
+    # las formas de limpiar que no lo hacen, vacio si ninguna
+    real = pd.read_csv(origen, sep=';', encoding='latin1', dtype=str, usecols=COLUMNAS_DATASET, nrows=FILAS_PARIDAD)
+    valida = real.loc[GestionarObra.limpiar_datos(GestionarObra.extraer_datos(archivo=origen).head(FILAS_PARIDAD), {}).index[:1]]
+    filas = pd.concat([valida] * 5, ignore_index=True)
+    filas['nombre'] = ['Obra repetida', 'Obra repetida', 'Obra repetida', None, None]
+    filas.loc[0, 'monto_contrato'] = 'sin monto'
+    filas['expediente-numero'] = [f'EX-{numero}' for numero in range(len(filas))]
+    fallas = []
+
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = os.path.join(directorio, 'obras.csv')
+        filas.to_csv(archivo, sep=';', encoding='latin1', index=False)
+        formas = {
+            'archivo completo': lambda: GestionarObra.limpiar_datos(GestionarObra.extraer_datos(archivo=archivo), {}),
+            'una fila por bloque': lambda: pd.concat(GestionarObra.limpiar_datos_en_bloques(1, {}, archivo), ignore_index=True),
+        }
+        for forma, limpiar in formas.items():
+            conservadas = list(limpiar()['expediente-numero'])
+            correcto = conservadas == ['EX-1', 'EX-3', 'EX-4']
+            print(f'-{forma}: se conservan {", ".join(conservadas) or "ninguna"} ({"correcto" if correcto else "se esperaba EX-1, EX-3, EX-4"})')
+            if not correcto:
+                fallas.append(forma)
+
+    return fallas
+
+
+def comparar_escritura_concurrente(obras=10000, clientes=(1, 4, 16), actualizaciones=200):
+    # Cada cliente es un hilo con su propia conexion que actualiza el avance de obras al azar, guardando cada una con save() (una transaccion
+    # por obra) en conexiones con synchronous normal y full. Las obras se leen antes de empezar a medir, asi se mide solo la escritura.
+    # Los errores son las actualizaciones que fallaron por la base bloqueada
+    ruta_original, sincronizacion = sqlite_db.database, modelo_orm.PRAGMAS['synchronous']
+    guardar = lambda obra: obra.save(only=obra.dirty_fields)
+    formas = {'save()': (guardar, sincronizacion), 'save() con synchronous=full': (guardar, 'full')}
+    resultados = {}
+
+    with tempfile.TemporaryDirectory() as directorio:
+        base = os.path.join(directorio, 'obras.db')
+        generar_base_sintetica(base, obras)
+
+        def cliente(guardar, inicio, errores):
+            with modelo_orm.sesion():
+                pendientes = list(modelo_orm.Obra.select().where(modelo_orm.Obra.id.in_([random.randint(1, obras) for _ in range(actualizaciones)])))
+                inicio.wait()
+                for obra in pendientes:
+                    obra.porcentaje_avance = random.randint(0, 100)
+                    try:
+                        guardar(obra)
+                    except OperationalError:
+                        errores.append(obra.id)
+                return len(pendientes)
+
+        for forma, (guardar, sincronizacion_forma) in formas.items():
+            modelo_orm.configurar_db(base, synchronous=sincronizacion_forma)
+            for cantidad in clientes:
+                errores = []
+                inicio = threading.Barrier(cantidad + 1)
+                with ThreadPoolExecutor(cantidad) as ejecutor:
+                    escrituras = [ejecutor.submit(cliente, guardar, inicio, errores) for _ in range(cantidad)]
+                    inicio.wait()
+                    comienzo = time.perf_counter()
+                    total = sum(escritura.result() for escritura in escrituras)
+                    segundos = time.perf_counter() - comienzo
+                resultados[(forma, cantidad)] = {'segundos': segundos, 'por_segundo': (total - len(errores)) / segundos, 'errores': len(errores)}
+
+        modelo_orm.configurar_db(ruta_original, synchronous=sincronizacion)
+
+    print(f'Actualizaciones concurrentes de obras (hasta {actualizaciones} por cliente, sobre {obras} obras):')
+    for (forma, cantidad), resultado in resultados.items():
+        print(f"-{forma} con {cantidad} clientes: {resultado['por_segundo']:.0f} actualizaciones/s, {resultado['errores']} errores por bloqueo")
+
+    return resultados
+
+def comparar_registros(obras=1000000, muestra=MUESTRA_MEMORIA):
+    # Recorre todas las obras como instancias de Obra y como RegistroObra, contando las obras por etapa (una dimension por fila) y sumando los
+    # montos. La memoria por obra se mide con tracemalloc reteniendo las primeras 'muestra' obras de cada forma en una lista
+    ruta_original = sqlite_db.database
+    Obra = modelo_orm.Obra
+    formas = {
+        'instancias de Obra': lambda *condiciones: (Obra.select().where(*condiciones) if condiciones else Obra.select()).iterator(),
+        'RegistroObra': modelo_orm.registros_obra,
+    }
+    resultados = {}
+
+    with tempfile.TemporaryDirectory() as directorio:
+        _, generacion = medir(generar_base_indicadores, os.path.join(directorio, 'obras.db'), obras)
+
+        with modelo_orm.sesion():
+            totales = {}
+            for forma, recorrer in formas.items():
+                def recorrido():
+                    etapas, monto = Counter(), 0
+                    for obra in recorrer():
+                        etapas[obra.etapa.estado] += 1
+                        monto += obra.monto_contrato or 0
+                    return etapas, monto
+                totales[forma], segundos = medir(recorrido)
+
+                tracemalloc.start()
+                retenidas = list(recorrer(Obra.id <= muestra))
+                memoria = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                resultados[forma] = {'segundos': segundos, 'obras_por_segundo': obras / segundos, 'bytes_por_obra': memoria / len(retenidas)}
+                del retenidas
+
+        modelo_orm.configurar_db(ruta_original)
+
+    if len({repr(total) for total in totales.values()}) > 1:
+        raise AssertionError('Los recorridos con instancias de Obra y con RegistroObra no dan los mismos totales')
+
+    print(f'Recorrido de {obras} obras contando por etapa y sumando montos (base generada en {generacion:.2f} s):')
+    for forma, resultado in resultados.items():
+        print(f"-{forma}: {resultado['segundos']:.2f} s ({resultado['obras_por_segundo']:.0f} obras/s), {resultado['bytes_por_obra']:.0f} bytes por obra retenida")
+
+    return resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mediciones de rendimiento de la gestión de obras urbanas')
+    parser.add_argument('--veces', type=int, default=100, help='cantidad de copias del dataset original que se usan en la medición')
+    parser.add_argument('--espacial', action='store_true', help='mide las búsquedas por ubicación con el índice espacial y recorriendo la tabla completa')
+    parser.add_argument('--indicadores', action='store_true', help='mide los indicadores por SQL, con las tablas de resumen y en memoria')
+    parser.add_argument('--escritura', action='store_true', help='mide las actualizaciones de obras desde varios hilos con save(), con synchronous normal y full')
+    parser.add_argument('--registros', action='store_true', help='mide el recorrido de la tabla obra y la memoria por obra con instancias de Obra y con RegistroObra')
+    parser.add_argument('--obras', type=int, help='cantidad de obras de la base sintética (por defecto 100000 en la medición espacial, 10000000 en la de indicadores, 10000 en la de escritura y 1000000 en la de registros)')
+    parser.add_argument('--paridad', action='store_true', help='verifica que los indicadores por SQL, con las tablas de resumen y en memoria coincidan sobre un CSV chico (termina con error si no)')
+    parser.add_argument('--migracion', action='store_true', help='migra una copia de la base y le sincroniza el CSV, verificando que no queden obras ni valores de dimension repetidos (termina con error si quedan)')
+    parser.add_argument('--etapas', action='store_true', help='verifica que las variantes de etapas cerradas del CSV real se reconozcan como cerradas (termina con error si no)')
+    parser.add_argument('--repetidos', action='store_true', help='verifica que una obra descartada no haga descartar como repetida a una valida posterior con el mismo nombre (termina con error si lo hace)')
+    parser.add_argument('--cache-atrasos', action='store_true', help='verifica que la cache de atrasos descarte los analisis usados hace mas tiempo (termina con error si no)')
+    parser.add_argument('--suite', action='store_true', help='mide la lectura, la limpieza, la carga, cada indicador y el ciclo de vida sobre un dataset sintético')
+    parser.add_argument('--filas', type=int, help='filas del dataset sintético (por defecto 100000 en la suite, de 10000 a 10000000, y 2000 en la verificación de paridad)')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla del generador del dataset sintético')
+    parser.add_argument('--guardar', metavar='ARCHIVO.json', help='guarda los resultados de la suite en un archivo JSON')
+    parser.add_argument('--referencia', metavar='ARCHIVO.json', help='resultados guardados de una medición anterior con los que se compara la suite')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_REGRESION, help='aumento relativo del tiempo a partir del cual un paso es una regresión')
+    args = parser.parse_args()
+
+    if args.suite:
+        resultados = ejecutar_suite(args.filas or 100000, args.semilla)
+        mostrar_suite(resultados)
+        if args.guardar:
+            with open(args.guardar, 'w') as f:
+                json.dump(resultados, f, indent=2)
+        if args.referencia:
+            with open(args.referencia) as f:
+                regresiones = comparar_con_referencia(resultados, json.load(f), args.tolerancia)
+            # Con regresiones el proceso termina con error, asi la suite se puede usar en integracion continua
+            if regresiones:
+                exit(1)
+    elif args.paridad:
+        # Con diferencias el proceso termina con error, igual que la suite con regresiones
+        if verificar_paridad(args.filas or FILAS_PARIDAD, args.semilla):
+            exit(1)
+    elif args.migracion:
+        if verificar_migracion():
+            exit(1)
+    elif args.etapas:
+        if verificar_etapas():
+            exit(1)
+    elif args.repetidos:
+        if verificar_nombres_repetidos():
+            exit(1)
+    elif args.cache_atrasos:
+        if verificar_cache_atrasos():
+            exit(1)
+    elif args.espacial:
+        comparar_busqueda_espacial(args.obras or 100000)
+    elif args.indicadores:
+        comparar_indicadores(args.obras or 10000000)
+    elif args.escritura:
+        comparar_escritura_concurrente(args.obras or 10000)
+    elif args.registros:
+        comparar_registros(args.obras or 1000000)
+    else:
+        comparar_limpieza(args.veces)
@@ -1,17 +1,207 @@
 from peewee import *
 import pandas as pd
 from abc import ABCMeta
+import argparse
+import calendar
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import datetime
+import hashlib
+import json
+import math
+import numpy as np
+import os
+import re
+from playhouse.migrate import SqliteMigrator, migrate
+import threading
+import time
 import modelo_orm
+import perfil_obras
 
-sqlite_db = SqliteDatabase('./obras_urbanas.db', pragmas={'journal_mode': 'wal'})
+# La base y sus pragmas se definen una sola vez en el modelo ORM
+sqlite_db = modelo_orm.sqlite_db
+
+ARCHIVO_CSV = './observatorio-de-obras-urbanas.csv'
+
+# Columnas del dataset que se usan; el resto (imagenes, links) no se llega a leer
+COLUMNAS_DATASET = ('id', 'nombre', 'etapa', 'tipo', 'area_responsable', 'monto_contrato', 'comuna', 'barrio', 'fecha_inicio', 'fecha_fin_inicial', 'plazo_meses', 'porcentaje_avance', 'licitacion_oferta_empresa', 'contratacion_tipo', 'nro_contratacion', 'mano_obra', 'destacada', 'expediente-numero', 'financiamiento', 'lat', 'lng', 'direccion', 'entorno', 'descripcion')
+
+# Tipos de las columnas leidas: fijarlos evita que cada bloque del archivo infiera un tipo distinto y las de pocos valores distintos se guardan como categorias
+TIPOS_COLUMNAS = {columna: str for columna in COLUMNAS_DATASET}
+TIPOS_COLUMNAS.update({columna: 'category' for columna in ('etapa', 'tipo', 'area_responsable', 'comuna', 'barrio', 'licitacion_oferta_empresa', 'contratacion_tipo', 'destacada', 'financiamiento')})
+TIPOS_COLUMNAS['id'] = 'int64'
+
+# Columnas de texto en las que se corrigen los caracteres mal decodificados
+COLUMNAS_TEXTO = ('nombre', 'etapa', 'tipo', 'area_responsable', 'barrio', 'licitacion_oferta_empresa', 'contratacion_tipo', 'financiamiento', 'direccion', 'entorno', 'descripcion')
+
+# Caracteres que delatan texto mal decodificado o espacios de mas; los valores que no los tienen no se reparan
+TEXTO_SOSPECHOSO = re.compile(r'[\x80-\x9f\xad\xc2\xc3\xe2\t\n\r]|  |^ | $')
+# "í" seguida de un byte de continuacion: resto de una secuencia UTF-8 de dos bytes que empezaba con 0xC3
+UTF8_TRUNCADO = re.compile('í([\x80-\x9f\xad])')
+ESPACIOS = re.compile(r'\s+')
+
+# Columnas numericas que en el dataset pueden venir con coma decimal
+COLUMNAS_NUMERICAS = ('plazo_meses', 'porcentaje_avance', 'mano_obra')
+
+# Rango de coordenadas validas (con margen) de la Ciudad de Buenos Aires; las que quedan afuera se descartan
+LIMITES_COORDENADAS = {'lat': (-34.75, -34.5), 'lng': (-58.56, -58.3)}
+# Primer numero de una celda de coordenadas, con o sin separadores ("-34.578.254", "\xa0-58,520904", "(')-34.614729 / -34.607188")
+COORDENADA = re.compile(r'\d[\d.,]*')
+
+# Obras que se leen por consulta al exportar o recorrer la tabla obra
+PAGINA_EXPORTACION = 1000
+FORMATOS_EXPORTACION = ('csv', 'jsonl')
+
+# Claves foraneas de la tabla obra que el modo en memoria carga como codigos (posicion del valor en su tabla de dimension)
+DIMENSIONES_MEMORIA = {
+    'etapa': modelo_orm.Etapa.estado,
+    'tipo_obra': modelo_orm.TipoObra.tipo,
+    'area_responsable': modelo_orm.AreaResponsable.area,
+    'comuna': modelo_orm.Comuna.numero,
+    'barrio': modelo_orm.Barrio.nombre,
+    'empresa': modelo_orm.Empresa.nombre,
+}
+# Columnas numericas de la tabla obra que usa el modo en memoria
+MEDIDAS_MEMORIA = ('monto_contrato', 'mano_obra', 'plazo_meses')
+
+# Busqueda de texto: peso de cada columna de obra_texto en el puntaje (nombre, descripcion, entorno, direccion, barrio), marcas que resaltan
+# las palabras encontradas en el fragmento, palabras del fragmento y cantidad de obras que se devuelven
+PESOS_BUSQUEDA = (10.0, 1.0, 3.0, 2.0, 3.0)
+MARCAS_FRAGMENTO = ('[', ']')
+PALABRAS_FRAGMENTO = 16
+RESULTADOS_BUSQUEDA = 20
+
+# Radio medio de la Tierra en metros, para las distancias entre coordenadas
+RADIO_TIERRA = 6371008.8
+# Radio en metros de la primera busqueda de las obras mas cercanas; se duplica hasta encontrar las pedidas
+RADIO_INICIAL_CERCANAS = 500
+
+# Valores de la columna destacada que indican que la obra es destacada; cualquier otro valor o la falta de valor es NO
+VALORES_DESTACADA = ('SI', 'SÍ', 'S', 'X', 'TRUE', '1')
+
+# Cantidad de filas del CSV que se leen, limpian y cargan por vez
+TAMANIO_BLOQUE = 10000
+# Una carga masiva de al menos estas filas, y con al menos tantas filas como obras ya hay, se hace sin los triggers de la tabla obra: las tablas
+# de resumen, los indices, el historial y la version se calculan una sola vez al final, en lugar de una vez por fila
+FILAS_CARGA_SIN_TRIGGERS = 1000
+
+# Directorio en el que se guarda el dataset ya limpio, un archivo .npy por bloque y columna, para no volver a leer el CSV en cada inicio
+DIRECTORIO_CACHE = './cache_limpieza'
+# Se incrementa cada vez que cambia limpiar_datos, asi las caches generadas con la version anterior dejan de usarse
+VERSION_CACHE = 5
+
+MODELOS = [modelo_orm.Etapa, modelo_orm.TipoObra, modelo_orm.AreaResponsable, modelo_orm.Comuna, modelo_orm.Barrio, modelo_orm.Empresa, modelo_orm.TipoContratacion, modelo_orm.FuenteFinanciamiento, modelo_orm.Obra] + modelo_orm.MODELOS_RESUMEN + modelo_orm.MODELOS_HISTORIAL + [modelo_orm.VersionObra]
+
+# Columna del dataset, campo de la tabla de dimension con el valor y campo de la tabla obra que la referencia
+DIMENSIONES = (
+    ('etapa', modelo_orm.Etapa.estado, modelo_orm.Obra.etapa),
+    ('tipo', modelo_orm.TipoObra.tipo, modelo_orm.Obra.tipo_obra),
+    ('area_responsable', modelo_orm.AreaResponsable.area, modelo_orm.Obra.area_responsable),
+    ('comuna', modelo_orm.Comuna.numero, modelo_orm.Obra.comuna),
+    ('barrio', modelo_orm.Barrio.nombre, modelo_orm.Obra.barrio),
+    ('licitacion_oferta_empresa', modelo_orm.Empresa.nombre, modelo_orm.Obra.empresa),
+    ('contratacion_tipo', modelo_orm.TipoContratacion.tipo, modelo_orm.Obra.tipo_contratacion),
+    ('financiamiento', modelo_orm.FuenteFinanciamiento.fuente, modelo_orm.Obra.fuente_financiamiento),
+)
+
+# Columna del dataset y campo de la tabla obra en el que se guarda tal cual
+COLUMNAS_OBRA = (
+    ('id', modelo_orm.Obra.id_dataset),
+    ('nombre', modelo_orm.Obra.nombre),
+    ('monto_contrato', modelo_orm.Obra.monto_contrato),
+    ('fecha_inicio', modelo_orm.Obra.fecha_inicio),
+    ('fecha_fin_inicial', modelo_orm.Obra.fecha_fin_inicial),
+    ('plazo_meses', modelo_orm.Obra.plazo_meses),
+    ('porcentaje_avance', modelo_orm.Obra.porcentaje_avance),
+    ('nro_contratacion', modelo_orm.Obra.nro_contratacion),
+    ('mano_obra', modelo_orm.Obra.mano_obra),
+    ('destacada', modelo_orm.Obra.destacada),
+    ('expediente-numero', modelo_orm.Obra.nro_expediente),
+    ('lat', modelo_orm.Obra.latitud),
+    ('lng', modelo_orm.Obra.longitud),
+    ('direccion', modelo_orm.Obra.direccion),
+    ('entorno', modelo_orm.Obra.entorno),
+    ('descripcion', modelo_orm.Obra.descripcion),
+)
+
+# Columnas del dataset que pueden cambiar entre recargas y que se actualizan en la sincronizacion incremental
+COLUMNAS_SINCRONIZADAS = ('etapa', 'porcentaje_avance', 'plazo_meses', 'mano_obra', 'lat', 'lng', 'direccion', 'entorno', 'descripcion')
+
+# Operaciones del ciclo de vida que se pueden aplicar en lote: parametro -> (campo de la obra, campo de la tabla de dimension en la que se busca el valor o None)
+TRANSICIONES = {
+    'nuevo_proyecto': {
+        'nombre': (modelo_orm.Obra.nombre, None),
+        'tipo_obra': (modelo_orm.Obra.tipo_obra, modelo_orm.TipoObra.tipo),
+        'area_responsable': (modelo_orm.Obra.area_responsable, modelo_orm.AreaResponsable.area),
+        'barrio': (modelo_orm.Obra.barrio, modelo_orm.Barrio.nombre),
+        'comuna': (modelo_orm.Obra.comuna, modelo_orm.Comuna.numero),
+    },
+    'iniciar_contratacion': {
+        'tipo_contratacion': (modelo_orm.Obra.tipo_contratacion, modelo_orm.TipoContratacion.tipo),
+        'nro_contratacion': (modelo_orm.Obra.nro_contratacion, None),
+        'monto_contrato': (modelo_orm.Obra.monto_contrato, None),
+    },
+    'adjudicar_obra': {
+        'empresa': (modelo_orm.Obra.empresa, modelo_orm.Empresa.nombre),
+        'nro_expediente': (modelo_orm.Obra.nro_expediente, None),
+    },
+    'iniciar_obra': {
+        'destacada': (modelo_orm.Obra.destacada, None),
+        'fecha_inicio': (modelo_orm.Obra.fecha_inicio, None),
+        'fecha_fin_inicial': (modelo_orm.Obra.fecha_fin_inicial, None),
+        'fuente_financiamiento': (modelo_orm.Obra.fuente_financiamiento, modelo_orm.FuenteFinanciamiento.fuente),
+        'mano_obra': (modelo_orm.Obra.mano_obra, None),
+    },
+    'actualizar_porcentaje_avance': {'porcentaje_avance': (modelo_orm.Obra.porcentaje_avance, None)},
+    'incrementar_plazo': {'plazo_meses': (modelo_orm.Obra.plazo_meses, None)},
+    'incrementar_mano_obra': {'mano_obra': (modelo_orm.Obra.mano_obra, None)},
+    'finalizar_obra': {},
+    'rescindir_obra': {},
+}
+
+# Etapa en la que queda la obra despues de la operacion; las demas operaciones no la cambian
+ETAPA_TRANSICION = {'nuevo_proyecto': 'Proyecto', 'finalizar_obra': 'Finalizada', 'rescindir_obra': 'Rescindida'}
+
+# Las obras en estas etapas ya no admiten operaciones del ciclo de vida ni cuentan como atrasadas o estancadas. El dataset trae la misma etapa
+# escrita de varias formas ('Finalizada', 'FInalizada', 'finalizada', 'Finalizado'): se comparan sin espacios alrededor y sin distinguir mayusculas
+ETAPAS_CERRADAS = ('finalizada', 'finalizado', 'finalizada/desestimada', 'proyecto finalizado', 'rescindida')
+
+# Campos de la obra por los que se puede identificar cada elemento de un lote
+CLAVES_OBRA = {'id': modelo_orm.Obra.id, 'id_dataset': modelo_orm.Obra.id_dataset, 'nombre': modelo_orm.Obra.nombre}
+
+# Cantidad de elementos rechazados de un lote que se muestran por consola
+ERRORES_MOSTRADOS = 20
+
+# Eventos del historial a partir de los cuales se toma una nueva foto del estado de las obras, asi las consultas por fecha no recorren mas que esos eventos
+EVENTOS_POR_FOTO = 50000
+
+# Analisis de atrasos: dias de un mes promedio, percentiles de cada medida por grupo, grupos (nombre -> campo de la obra y campo con el valor
+# de la dimension) y cantidad de grupos y de obras que se muestran por consola
+DIAS_POR_MES = 365.25 / 12
+PERCENTILES_ATRASOS = (50, 90)
+GRUPOS_ATRASOS = {
+    'comuna': (modelo_orm.Obra.comuna, modelo_orm.Comuna.numero),
+    'tipo_obra': (modelo_orm.Obra.tipo_obra, modelo_orm.TipoObra.tipo),
+    'empresa': (modelo_orm.Obra.empresa, modelo_orm.Empresa.nombre),
+}
+ATRASOS_MOSTRADOS = 10
+
+# Analisis de atrasos ya calculados por base y fecha de referencia, con la version de la tabla obra con la que se calculo cada uno. Cada
+# analisis guarda los arreglos de todas las obras: se conservan solo los ATRASOS_EN_CACHE usados mas recientemente
+ATRASOS_EN_CACHE = 2
+_cache_atrasos = OrderedDict()
+# El servicio HTTP calcula los atrasos desde varios hilos a la vez
+_bloqueo_atrasos = threading.Lock()
 
 class GestionarObra(metaclass=ABCMeta):
     @classmethod
-    def extraer_datos(cls):
-        obras_csv = './observatorio-de-obras-urbanas.csv'
+    def extraer_datos(cls, tamanio_bloque=None, archivo=ARCHIVO_CSV):
+        obras_csv = archivo
 
         try:
-            df = pd.read_csv(obras_csv, sep=';', decimal=',', encoding='latin1')
+            # Con tamanio_bloque se devuelve un iterador de DataFrames de esa cantidad de filas en lugar del dataset completo
+            df = pd.read_csv(obras_csv, sep=';', decimal=',', encoding='latin1', usecols=COLUMNAS_DATASET, dtype=TIPOS_COLUMNAS, chunksize=tamanio_bloque)
 
             return df
         except FileNotFoundError as e:
@@ -21,245 +211,1912 @@ class GestionarObra(metaclass=ABCMeta):
     @classmethod
     def conectar_db(cls):
         try:
-            db = sqlite_db.connect('obras_urbanas.db')
-            print('Se conectó correctamente a la base de datos')
-            return db
+            # Si el hilo ya tiene una conexion abierta se reutiliza en lugar de abrir otra
+            if sqlite_db.connect(reuse_if_open=True):
+                print('Se conectó correctamente a la base de datos')
+            return sqlite_db
         except OperationalError as e:
             print(f'Error al conectar con la base: {e}')
             exit()
 
     @classmethod
     def mapear_orm(cls):
-        db = cls.conectar_db()
-        try:
-            sqlite_db.create_tables([modelo_orm.Etapa, modelo_orm.TipoObra, modelo_orm.AreaResponsable, modelo_orm.Comuna, modelo_orm.Barrio, modelo_orm.Empresa, modelo_orm.TipoContratacion, modelo_orm.FuenteFinanciamiento, modelo_orm.Obra])
-            print('Se han creado correctamente las tablas')
-        except OperationalError as e:
-            print(f'Se ha generado un error al crear las tablas: {e}')
-            exit()
-        sqlite_db.close()
+        with modelo_orm.sesion():
+            try:
+                cls._migrar_esquema()
+                resumenes_nuevos = not sqlite_db.table_exists(modelo_orm.ResumenGeneral._meta.table_name)
+                indice_nuevo = not sqlite_db.table_exists(modelo_orm.UbicacionObra._meta.table_name)
+                texto_nuevo = not sqlite_db.table_exists(modelo_orm.TextoObra._meta.table_name)
+                historial_nuevo = not sqlite_db.table_exists(modelo_orm.FotoObra._meta.table_name)
+                sqlite_db.create_tables(MODELOS)
+                for sentencia in modelo_orm.sql_triggers_obra():
+                    sqlite_db.execute_sql(sentencia)
+                # Si las tablas de resumen o los indices se acaban de crear se calculan a partir de las obras que ya existian
+                if resumenes_nuevos:
+                    cls.reconstruir_resumenes()
+                if indice_nuevo:
+                    sqlite_db.execute_sql(modelo_orm.sql_cargar_indice_espacial())
+                if texto_nuevo:
+                    sqlite_db.execute_sql(modelo_orm.sql_cargar_indice_texto())
+                # Las obras que ya existian no tienen eventos: la primera foto es su estado inicial en el historial
+                if historial_nuevo and modelo_orm.Obra.select().exists():
+                    cls.tomar_foto()
+                print('Se han creado correctamente las tablas')
+            except OperationalError as e:
+                print(f'Se ha generado un error al crear las tablas: {e}')
+                exit()
+
+    @classmethod
+    def _migrar_esquema(cls):
+        # Agrega a las tablas creadas con una version anterior del modelo las columnas que les faltan
+        migrator = SqliteMigrator(sqlite_db)
+
+        for modelo in MODELOS:
+            tabla = modelo._meta.table_name
+            if not sqlite_db.table_exists(tabla):
+                continue
+            existentes = [columna.name for columna in sqlite_db.get_columns(tabla)]
+            operaciones = [migrator.add_column(tabla, campo.column_name, campo) for campo in modelo._meta.sorted_fields if campo.column_name not in existentes]
+
+            if operaciones:
+                migrate(*operaciones)
+                print(f'Se agregaron {len(operaciones)} columnas a la tabla {tabla}')
+
+        if sqlite_db.table_exists(modelo_orm.Obra._meta.table_name):
+            cls._reparar_textos_guardados()
+
+        # Los triggers del historial que guardan la fecha con otro formato se borran, mapear_orm los vuelve a crear
+        for nombre, sentencia in sqlite_db.execute_sql("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'obra_historial_%'").fetchall():
+            if modelo_orm.FECHA_ACTUAL not in sentencia:
+                sqlite_db.execute_sql(f'DROP TRIGGER {nombre}')
+
+        # Las fechas del historial de una version anterior tienen milisegundos en lugar de microsegundos. Las filas nuevas siempre
+        # son posteriores, asi que alcanza con mirar la ultima fecha (por el indice) para saber si queda alguna por convertir
+        for modelo in modelo_orm.MODELOS_HISTORIAL:
+            if sqlite_db.table_exists(modelo._meta.table_name) and len(modelo.select(fn.MAX(modelo.fecha).coerce(False)).scalar() or '') == 23:
+                sqlite_db.execute_sql(modelo_orm.sql_migrar_fechas_historial(modelo))
+                print(f'Se convirtieron las fechas de la tabla {modelo._meta.table_name} al formato con microsegundos')
     
     @classmethod
-    def limpiar_datos(cls):
-        df = cls.extraer_datos()
-        columnas = ('nombre', 'etapa', 'tipo', 'area_responsable', 'monto_contrato', 'comuna', 'barrio', 'fecha_inicio', 'fecha_fin_inicial', 'plazo_meses', 'porcentaje_avance', 'licitacion_oferta_empresa', 'contratacion_tipo', 'nro_contratacion', 'mano_obra', 'destacada', 'expediente-numero', 'financiamiento')
-
-        for column in df.columns:
-            # Elimina todas las columnas no necesarias del dataframe
-            if columnas.count(column) == 0:
-                df = df.drop(columns=[column])
-            # Elimina los valores nulos en todas las columnas consideradas importantes para el trabajo
-            elif column == 'comuna' or column == 'barrio' or column == 'destacada':
-                df = df.dropna(subset=[column])
-                # Reindexa las columnas
-                df = df.reset_index(drop=True)
-            elif column == 'monto_contrato':
-                df[column] = pd.to_numeric(df[column],errors='coerce')
-                df = df.dropna(subset=[column])
-                df = df.reset_index(drop=True)
+    def _reparar_textos_guardados(cls):
+        # Las obras y los valores de dimension que guardo el cargador original no pasaron por _reparar_texto ("Secretarí\xada"): se reparan
+        # igual que los del dataset, asi las obras anteriores se reconocen por su nombre al sincronizar y cada valor existe una sola vez.
+        # Si el valor reparado ya existe (o una variante con otras mayusculas, acentos o espacios, ver _clave_dimension), las filas que
+        # apuntaban al repetido pasan a apuntar al existente de menor id y el repetido se borra
+        reparar = lambda texto: cls._reparar_texto(texto) if isinstance(texto, str) and cls._texto_sospechoso(texto) else texto
+        reparados = fusionados = 0
+
+        with sqlite_db.atomic():
+            for _, campo, _ in DIMENSIONES:
+                modelo = campo.model
+                if not isinstance(campo, CharField) or not sqlite_db.table_exists(modelo._meta.table_name):
+                    continue
+                ids = {}
+                for id, valor in list(modelo.select(modelo.id, campo).order_by(modelo.id).tuples()):
+                    reparado = reparar(valor)
+                    destino = ids.setdefault(cls._clave_dimension(reparado), id)
+                    if destino == id:
+                        if reparado != valor:
+                            modelo.update({campo: reparado}).where(modelo.id == id).execute()
+                            reparados += 1
+                        continue
+                    # Las tablas de resumen se reconstruyen al final, cambiar sus claves podria repetirlas
+                    for referencia, campos in modelo._meta.model_backrefs.items():
+                        if referencia in modelo_orm.MODELOS_RESUMEN or not sqlite_db.table_exists(referencia._meta.table_name):
+                            continue
+                        for clave in campos:
+                            referencia.update({clave: destino}).where(clave == id).execute()
+                    modelo.delete_by_id(id)
+                    fusionados += 1
+
+            # Solo las obras sin id del dataset pueden venir del cargador original; las del dataset ya se guardaron reparadas
+            Obra = modelo_orm.Obra
+            for id, nombre in list(Obra.select(Obra.id, Obra.nombre).where(Obra.id_dataset.is_null()).tuples()):
+                reparado = reparar(nombre)
+                if reparado != nombre and not Obra.select().where(Obra.nombre == reparado).exists():
+                    Obra.update(nombre=reparado).where(Obra.id == id).execute()
+                    reparados += 1
+
+            if fusionados and sqlite_db.table_exists(modelo_orm.ResumenGeneral._meta.table_name):
+                cls.reconstruir_resumenes()
+
+        if reparados or fusionados:
+            modelo_orm.invalidar_dimensiones()
+            print(f'Se repararon {reparados} textos guardados y se unieron {fusionados} valores de dimension repetidos')
+
+    @classmethod
+    def _reparar_texto(cls, texto):
+        # Algunas filas del dataset tienen texto UTF-8 leido como latin1 ("NuÃ±ez") o con el primer byte reemplazado por "í" ("Agronomí\xada")
+        texto = UTF8_TRUNCADO.sub(lambda m: bytes([0xc3, ord(m.group(1))]).decode('utf-8'), texto)
+        try:
+            texto = texto.encode('latin1').decode('utf-8')
+        except UnicodeError:
+            pass
+        # Guiones de Windows-1252 y espacios sobrantes
+        return ESPACIOS.sub(' ', texto.replace('\x96', '-')).strip()
+
+    @classmethod
+    def _texto_sospechoso(cls, texto):
+        return TEXTO_SOSPECHOSO.search(texto) is not None or texto != texto.strip()
+
+    @classmethod
+    def _entero(cls, texto):
+        try:
+            return int(texto.strip())
+        except ValueError:
+            return float('nan')
+
+    @classmethod
+    def _aplicar_por_valor(cls, serie, funcion, filtro=None):
+        # Aplica la funcion una sola vez por cada valor distinto de la serie y reemplaza con un map; con un filtro solo se procesan los valores que lo cumplen
+        valores = {valor: funcion(valor) if filtro is None or filtro(valor) else valor for valor in serie.dropna().unique()}
+        return serie.map(valores)
+
+    @classmethod
+    def _convertir_numero(cls, serie):
+        # La mayoria de los valores ya son numeros validos: solo los que no lo son se reintentan cambiando la coma decimal por punto
+        numero = pd.to_numeric(serie, errors='coerce').astype('float64')
+        pendientes = numero.isna() & serie.notna()
+        numero[pendientes] = pd.to_numeric(serie[pendientes].str.replace(',', '.', regex=False), errors='coerce')
+        return numero, pendientes
+
+    @classmethod
+    def _convertir_monto(cls, serie):
+        # Acepta "67065700", "205800503,6" y "53,160,000.00": el ultimo separador seguido de 1 o 2 digitos es el decimal, los demas son de miles
+        monto = pd.to_numeric(serie, errors='coerce').astype('float64')
+        pendientes = monto.isna() & serie.notna()
+
+        texto = serie[pendientes].str.replace(r'[\xa0$]', '', regex=True).str.strip()
+        # Celdas con texto o con mas de un monto ("$39.988.126,29\n $9.330.084,51") se consideran invalidas
+        texto = texto.where(texto.str.fullmatch(r'\d[\d.,]*').fillna(False))
+        decimales = texto.str.extract(r'[.,](\d{1,2})$', expand=False)
+        enteros = texto.str.replace(r'[.,]\d{1,2}$', '', regex=True).str.replace(r'[.,]', '', regex=True)
+        monto[pendientes] = pd.to_numeric(enteros + ('.' + decimales).fillna(''), errors='coerce')
+
+        return monto, pendientes
+
+    @classmethod
+    def _convertir_fecha(cls, serie):
+        # Las fechas ISO ("2016-05-31") se dejan como estan; las de solo mes y año ("10/21") se toman como el primer dia del mes
+        iso = pd.to_datetime(serie, format='%Y-%m-%d', errors='coerce').notna() & (serie.str.len() == 10)
+        fecha = serie.where(iso)
+        pendientes = serie.notna() & ~iso
+        fecha[pendientes] = pd.to_datetime(serie[pendientes], format='%m/%y', errors='coerce').dt.strftime('%Y-%m-%d')
+        return fecha
+
+    @classmethod
+    def _coordenada(cls, texto, minimo, maximo):
+        # Coordenadas escritas sin separador decimal o con puntos de miles ("-34658478", "-34.578.254", "-3,45832E+15"): en la ciudad los grados
+        # son siempre los dos primeros digitos y el signo es negativo (hemisferios sur y oeste)
+        numero = COORDENADA.search(texto)
+        if numero is None:
+            return float('nan')
+        digitos = re.sub(r'\D', '', numero.group())
+        valor = -float(f'{digitos[:2]}.{digitos[2:] or 0}')
+        return valor if minimo <= valor <= maximo else float('nan')
+
+    @classmethod
+    def _convertir_coordenada(cls, serie, minimo, maximo):
+        # Se aceptan directamente las coordenadas que ya estan dentro de la ciudad; solo las demas se reinterpretan valor por valor
+        coordenada = pd.to_numeric(serie.str.replace(',', '.', regex=False), errors='coerce').astype('float64')
+        pendientes = serie.notna() & ~coordenada.between(minimo, maximo)
+        coordenada[pendientes] = cls._aplicar_por_valor(serie[pendientes], lambda texto: cls._coordenada(texto, minimo, maximo)).astype('float64')
+        return coordenada, pendientes
+
+    @classmethod
+    @perfil_obras.etapa('limpieza')
+    def limpiar_datos(cls, df=None, informe=None, nombres=None):
+        # nombres es el conjunto de nombres vistos en los bloques anteriores (se completa con los de este bloque); sin el,
+        # los nombres repetidos solo se detectan dentro del mismo DataFrame
+        if df is None:
+            df = cls.extraer_datos()
+        # Elimina todas las columnas no necesarias del dataframe
+        df = df[[column for column in COLUMNAS_DATASET if column in df.columns]]
+        conteo = {}
+
+        # Reglas que descartan filas: cada una es una mascara y la fila se cuenta en la primera regla que la descarta
+        comuna = cls._aplicar_por_valor(df['comuna'], cls._entero).astype('float64')
+        monto, monto_pendiente = cls._convertir_monto(df['monto_contrato'])
+        descartes = {
+            'sin comuna o barrio': df['comuna'].isna() | df['barrio'].isna(),
+            'comuna no numerica': comuna.isna(),
+            'monto_contrato invalido': monto.isna(),
+        }
+        descartar = pd.Series(False, index=df.index)
+        for regla, mascara in descartes.items():
+            conteo[f'descartadas: {regla}'] = int((mascara & ~descartar).sum())
+            descartar |= mascara
+
+        # Los nombres repetidos se buscan solo entre las filas que pasan las demas reglas: una fila descartada no ocupa su nombre
+        # y no le quita el lugar a una valida posterior. Las obras sin nombre no se consideran repetidas entre si
+        nombre = df['nombre']
+        validas = ~descartar & nombre.notna()
+        repetido = validas & (nombre.where(validas).duplicated() | (nombre.isin(nombres) if nombres else False))
+        conteo['descartadas: nombre repetido'] = int(repetido.sum())
+        descartar |= repetido
+        if nombres is not None:
+            nombres.update(nombre[validas])
+
+        # Reglas que corrigen valores: se cuentan solo las filas que se conservan
+        conteo['corregidas: monto_contrato con separadores'] = int((monto_pendiente & monto.notna() & ~descartar).sum())
+
+        destacada = cls._aplicar_por_valor(df['destacada'], lambda valor: 'SI' if valor.strip().upper() in VALORES_DESTACADA else 'NO').astype('object').fillna('NO')
+        conteo['corregidas: destacada normalizada'] = int(((destacada != df['destacada'].astype('object')) & ~descartar).sum())
+
+        cambios = {'comuna': comuna, 'monto_contrato': monto, 'destacada': destacada}
+
+        for column in COLUMNAS_TEXTO:
+            cambios[column] = cls._aplicar_por_valor(df[column], cls._reparar_texto, cls._texto_sospechoso)
+            conteo[f'corregidas: texto de {column}'] = int(((cambios[column].astype('object') != df[column].astype('object')) & df[column].notna() & ~descartar).sum())
+
+        for column in COLUMNAS_NUMERICAS:
+            cambios[column], pendientes = cls._convertir_numero(df[column])
+            conteo[f'corregidas: {column} con coma decimal'] = int((pendientes & cambios[column].notna() & ~descartar).sum())
+            conteo[f'vaciadas: {column} no numerico'] = int((df[column].notna() & cambios[column].isna() & ~descartar).sum())
+
+        for column in ('fecha_inicio', 'fecha_fin_inicial'):
+            cambios[column] = cls._convertir_fecha(df[column])
+            conteo[f'corregidas: {column} sin formato ISO'] = int((cambios[column].notna() & (cambios[column] != df[column]) & ~descartar).sum())
+            conteo[f'vaciadas: {column} invalida'] = int((df[column].notna() & cambios[column].isna() & ~descartar).sum())
+
+        for column, (minimo, maximo) in LIMITES_COORDENADAS.items():
+            cambios[column], pendientes = cls._convertir_coordenada(df[column], minimo, maximo)
+            conteo[f'corregidas: {column} sin separador decimal'] = int((pendientes & cambios[column].notna() & ~descartar).sum())
+            conteo[f'vaciadas: {column} fuera de la ciudad'] = int((pendientes & cambios[column].isna() & ~descartar).sum())
+
+        # Un unico filtrado y reindexado al final en lugar de uno por cada columna
+        df = df.assign(**cambios)[~descartar].reset_index(drop=True)
+        df['comuna'] = df['comuna'].astype('int64')
+
+        if informe is None:
+            cls._mostrar_informe_limpieza(conteo)
+        else:
+            for regla, cantidad in conteo.items():
+                informe[regla] = informe.get(regla, 0) + cantidad
 
         return df
+
+    @classmethod
+    def _mostrar_informe_limpieza(cls, informe):
+        print('Limpieza del dataset:')
+        for regla, cantidad in informe.items():
+            if cantidad:
+                print(f'-{regla}: {cantidad} filas')
+
+    @classmethod
+    def limpiar_datos_en_bloques(cls, tamanio_bloque=TAMANIO_BLOQUE, informe=None, archivo=ARCHIVO_CSV):
+        # Lee y limpia el dataset de a un bloque por vez, la memoria usada no depende del tamaño del archivo
+        bloques = cls.extraer_datos(tamanio_bloque, archivo)
+        if bloques is False:
+            return
+
+        # Nombres de los bloques ya leidos, para descartar tambien los repetidos entre bloques distintos
+        nombres = set()
+        while True:
+            with perfil_obras.etapa('extraccion'):
+                bloque = next(bloques, None)
+            if bloque is None:
+                break
+            yield cls.limpiar_datos(bloque, {} if informe is None else informe, nombres)
     
     @classmethod
-    def cargar_datos(cls):
-        df = cls.limpiar_datos()
-        db = cls.conectar_db()
-
-        # Guarda valores unicos en listas para poder cargarlos en las tablas que se relacionan con la tabla obra
-        etapaUnique = list(df['etapa'].unique())
-        tipoObraUnique = list(df['tipo'].unique())
-        areaUnique = list(df['area_responsable'].unique())
-        comunaUnique = list(df['comuna'].unique())
-        barrioUnique = list(df['barrio'].unique())
-        empresaUnique = list(df['licitacion_oferta_empresa'].unique())
-        contratacionUnique = list(df['contratacion_tipo'].unique())
-        financiamientoUnique = list(df['financiamiento'].unique())
+    def _hash_archivo(cls, archivo):
+        resumen = hashlib.sha256()
+        with open(archivo, 'rb') as f:
+            for parte in iter(lambda: f.read(1 << 20), b''):
+                resumen.update(parte)
+        return resumen.hexdigest()
+
+    @classmethod
+    def _directorio_cache(cls, archivo, directorio):
+        return os.path.join(directorio, os.path.splitext(os.path.basename(archivo))[0])
+
+    @classmethod
+    def _guardar_bloque(cls, directorio, numero, bloque):
+        # Cada columna numerica se guarda tal cual; las de texto como codigos enteros mas la lista de sus valores distintos en JSON
+        # (un arreglo de numpy de texto reserva para cada valor el largo del mas largo, y las descripciones ocupan asi diez veces mas). Devuelve el tipo de cada columna, que se guarda en los metadatos
+        columnas = {}
+        for columna in bloque.columns:
+            serie = bloque[columna]
+            ruta = os.path.join(directorio, f'{numero}.{columna}')
+            if serie.dtype.kind in 'biuf':
+                np.save(f'{ruta}.npy', serie.to_numpy())
+                columnas[columna] = str(serie.dtype)
+            else:
+                categorias = serie.astype('category').cat
+                np.save(f'{ruta}.npy', categorias.codes.to_numpy())
+                with open(f'{ruta}.valores.json', 'w', encoding='utf-8') as f:
+                    json.dump([str(valor) for valor in categorias.categories], f, ensure_ascii=False)
+                columnas[columna] = 'category' if isinstance(serie.dtype, pd.CategoricalDtype) else 'object'
+        return columnas
+
+    @classmethod
+    def _leer_bloque(cls, directorio, numero, columnas):
+        # Las columnas numericas se abren con memory-map: solo se leen del disco las paginas que se usan
+        bloque = {}
+        for columna, tipo in columnas.items():
+            ruta = os.path.join(directorio, f'{numero}.{columna}')
+            if tipo in ('category', 'object'):
+                with open(f'{ruta}.valores.json', encoding='utf-8') as f:
+                    serie = pd.Series(pd.Categorical.from_codes(np.load(f'{ruta}.npy'), categories=json.load(f)))
+                bloque[columna] = serie if tipo == 'category' else serie.astype('object')
+            else:
+                bloque[columna] = pd.Series(np.load(f'{ruta}.npy', mmap_mode='r'))
+        return pd.DataFrame(bloque)
+
+    @classmethod
+    def _guardar_cache(cls, archivo, bloques, informe, tamanio_bloque, directorio):
+        # Guarda cada bloque limpio en la cache y lo devuelve apenas se escribio, asi la memoria usada no depende del tamaño del
+        # dataset; los metadatos (que validan la cache) se escriben recien despues del ultimo bloque
+        directorio = cls._directorio_cache(archivo, directorio)
+        os.makedirs(directorio, exist_ok=True)
+        metadatos = os.path.join(directorio, 'metadatos.json')
+        # Sin metadatos la cache no es valida: se borran primero para que una escritura interrumpida no deje una cache a medias
+        if os.path.exists(metadatos):
+            os.remove(metadatos)
+        # Los archivos de una cache anterior (de otra version o con mas bloques) no se reutilizan y solo ocuparian lugar
+        for nombre in os.listdir(directorio):
+            os.remove(os.path.join(directorio, nombre))
+        # El estado del CSV se toma antes de leerlo, si cambia mientras se limpia la cache deja de coincidir con el
+        estado = os.stat(archivo)
+        resumen = cls._hash_archivo(archivo)
+
+        guardados = []
+        for numero, bloque in enumerate(bloques):
+            guardados.append({'filas': len(bloque), 'columnas': cls._guardar_bloque(directorio, numero, bloque)})
+            yield bloque
+
+        with open(metadatos, 'w') as f:
+            json.dump({
+                'version': VERSION_CACHE,
+                'archivo': os.path.abspath(archivo),
+                'tamanio': estado.st_size,
+                'modificado': estado.st_mtime_ns,
+                'hash': resumen,
+                'tamanio_bloque': tamanio_bloque,
+                'bloques': guardados,
+                'informe': informe,
+            }, f)
+
+    @classmethod
+    @perfil_obras.etapa('cache')
+    def _leer_cache(cls, archivo, tamanio_bloque, directorio):
+        # Devuelve los metadatos de la cache, o None si no hay cache o si el CSV cambio desde que se genero
+        directorio = cls._directorio_cache(archivo, directorio)
+        ruta = os.path.join(directorio, 'metadatos.json')
+        try:
+            with open(ruta) as f:
+                metadatos = json.load(f)
+            estado = os.stat(archivo)
+        except (OSError, ValueError):
+            return None
+
+        if (metadatos['version'], metadatos['archivo'], metadatos['tamanio_bloque']) != (VERSION_CACHE, os.path.abspath(archivo), tamanio_bloque):
+            return None
+        if (metadatos['tamanio'], metadatos['modificado']) != (estado.st_size, estado.st_mtime_ns):
+            # Con el mismo tamaño pero otra fecha (el archivo se volvio a descargar o se copio) decide el contenido
+            if metadatos['tamanio'] != estado.st_size or metadatos['hash'] != cls._hash_archivo(archivo):
+                return None
+            metadatos['modificado'] = estado.st_mtime_ns
+            with open(ruta, 'w') as f:
+                json.dump(metadatos, f)
+
+        return metadatos
+
+    @classmethod
+    def limpiar_datos_con_cache(cls, tamanio_bloque=TAMANIO_BLOQUE, informe=None, archivo=ARCHIVO_CSV, directorio=DIRECTORIO_CACHE):
+        # Mismos bloques que limpiar_datos_en_bloques, pero si el CSV no cambio desde la ultima vez se leen de la cache en lugar de volver a limpiarlo.
+        # Devuelve un generador de bloques (nunca se tiene el dataset completo en memoria) y si se uso la cache; el informe se completa
+        # cuando se termina de recorrer el generador
+        metadatos = cls._leer_cache(archivo, tamanio_bloque, directorio)
+        return cls._bloques_con_cache(tamanio_bloque, informe, archivo, directorio, metadatos), metadatos is not None
+
+    @classmethod
+    def _bloques_con_cache(cls, tamanio_bloque, informe, archivo, directorio, metadatos):
+        if metadatos is None:
+            informe_archivo = {}
+            bloques = cls.limpiar_datos_en_bloques(tamanio_bloque, informe_archivo, archivo)
+            if os.path.exists(archivo):
+                bloques = cls._guardar_cache(archivo, bloques, informe_archivo, tamanio_bloque, directorio)
+            yield from bloques
+        else:
+            # Los bloques de la cache se leen de a uno, a medida que se piden
+            informe_archivo = metadatos['informe']
+            for numero, bloque in enumerate(metadatos['bloques']):
+                with perfil_obras.etapa('cache'):
+                    df = cls._leer_bloque(cls._directorio_cache(archivo, directorio), numero, bloque['columnas'])
+                yield df
+
+        if informe is not None:
+            for regla, cantidad in informe_archivo.items():
+                informe[regla] = informe.get(regla, 0) + cantidad
+
+    @classmethod
+    @perfil_obras.etapa('carga_por_fila')
+    def cargar_datos(cls, df=None):
+        if df is None:
+            df = cls.limpiar_datos()
+        with modelo_orm.sesion():
+            # Guarda valores unicos en listas para poder cargarlos en las tablas que se relacionan con la tabla obra
+            etapaUnique = list(df['etapa'].unique())
+            tipoObraUnique = list(df['tipo'].unique())
+            areaUnique = list(df['area_responsable'].unique())
+            comunaUnique = list(df['comuna'].unique())
+            barrioUnique = list(df['barrio'].unique())
+            empresaUnique = list(df['licitacion_oferta_empresa'].unique())
+            contratacionUnique = list(df['contratacion_tipo'].unique())
+            financiamientoUnique = list(df['financiamiento'].unique())
         
-        # Cargamos los datos unicos en sus respectivas tablas y los persistimos en el modelo ORM
-        for elem in etapaUnique:
-            try:
-                modelo_orm.Etapa.create(estado=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla etapa: {e}')
+            # Cargamos los datos unicos en sus respectivas tablas y los persistimos en el modelo ORM
+            for elem in etapaUnique:
+                try:
+                    modelo_orm.Etapa.create(estado=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla etapa: {e}')
 
-        for elem in tipoObraUnique:
-            try:
-                modelo_orm.TipoObra.create(tipo=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla tipo_obra: {e}')
+            for elem in tipoObraUnique:
+                try:
+                    modelo_orm.TipoObra.create(tipo=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla tipo_obra: {e}')
 
-        for elem in areaUnique:
-            try:
-                modelo_orm.AreaResponsable.create(area=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla area_responsable: {e}')
+            for elem in areaUnique:
+                try:
+                    modelo_orm.AreaResponsable.create(area=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla area_responsable: {e}')
 
-        for elem in comunaUnique:
-            try:
-                modelo_orm.Comuna.create(numero=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla comuna: {e}')
+            for elem in comunaUnique:
+                try:
+                    modelo_orm.Comuna.create(numero=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla comuna: {e}')
         
-        for elem in barrioUnique:
-            fila = df[df['barrio'] == elem]
-            comuna = fila['comuna'].iloc[0]
-            comuna_id = modelo_orm.Comuna.get(modelo_orm.Comuna.numero == comuna)
+            for elem in barrioUnique:
+                fila = df[df['barrio'] == elem]
+                comuna = fila['comuna'].iloc[0]
+                comuna_id = modelo_orm.dimension(modelo_orm.Comuna.numero, comuna)
 
-            try:
-                modelo_orm.Barrio.create(nombre=elem, comuna_id=comuna_id.id)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla barrio: {e}')
+                try:
+                    modelo_orm.Barrio.create(nombre=elem, comuna_id=comuna_id.id)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla barrio: {e}')
           
-        for elem in empresaUnique:
-            try:
-                modelo_orm.Empresa.create(nombre=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla empresa: {e}')
+            for elem in empresaUnique:
+                try:
+                    modelo_orm.Empresa.create(nombre=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla empresa: {e}')
 
-        for elem in contratacionUnique:
-            try:
-                modelo_orm.TipoContratacion.create(tipo=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla tipo_contratacion: {e}')
+            for elem in contratacionUnique:
+                try:
+                    modelo_orm.TipoContratacion.create(tipo=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla tipo_contratacion: {e}')
 
-        for elem in financiamientoUnique:
-            try:
-                modelo_orm.FuenteFinanciamiento.create(fuente=elem)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla fuente_financiamiento: {e}')
-
-        for elem in df.values:
-            etapa = modelo_orm.Etapa.get(modelo_orm.Etapa.estado == elem[1])
-            tipoObra = modelo_orm.TipoObra.get(modelo_orm.TipoObra.tipo == elem[2])
-            areaResp = modelo_orm.AreaResponsable.get(modelo_orm.AreaResponsable.area == elem[3])
-            comuna = modelo_orm.Comuna.get(modelo_orm.Comuna.numero == elem[5])
-            barrio = modelo_orm.Barrio.get(modelo_orm.Barrio.nombre == elem[6])
-            empresa = modelo_orm.Empresa.get(modelo_orm.Empresa.nombre == elem[11])
-            tipoContr = modelo_orm.TipoContratacion.get(modelo_orm.TipoContratacion.tipo == elem[12])
-            financiamiento = modelo_orm.FuenteFinanciamiento.get(modelo_orm.FuenteFinanciamiento.fuente == elem[17])
+            for elem in financiamientoUnique:
+                try:
+                    modelo_orm.FuenteFinanciamiento.create(fuente=elem)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla fuente_financiamiento: {e}')
+
+            # La columna id del dataset solo se usa en la carga masiva y la sincronizacion incremental
+            for elem in df.drop(columns=['id']).values:
+                etapa = modelo_orm.dimension(modelo_orm.Etapa.estado, elem[1])
+                tipoObra = modelo_orm.dimension(modelo_orm.TipoObra.tipo, elem[2])
+                areaResp = modelo_orm.dimension(modelo_orm.AreaResponsable.area, elem[3])
+                comuna = modelo_orm.dimension(modelo_orm.Comuna.numero, elem[5])
+                barrio = modelo_orm.dimension(modelo_orm.Barrio.nombre, elem[6])
+                empresa = modelo_orm.dimension(modelo_orm.Empresa.nombre, elem[11])
+                tipoContr = modelo_orm.dimension(modelo_orm.TipoContratacion.tipo, elem[12])
+                financiamiento = modelo_orm.dimension(modelo_orm.FuenteFinanciamiento.fuente, elem[17])
             
-            try:
-                modelo_orm.Obra.create(nombre=elem[0], monto_contrato=elem[4], fecha_inicio=elem[7], fecha_fin_inicial=elem[8], plazo_meses=elem[9], porcentaje_avance=elem[10], nro_contratacion=elem[13], mano_obra=elem[14], destacada=elem[15], nro_expediente=elem[16], etapa_id=etapa, tipo_obra_id=tipoObra, area_responsable_id=areaResp, comuna_id=comuna, barrio_id=barrio, empresa_id=empresa, tipo_contratacion_id=tipoContr, fuente_financiamiento_id=financiamiento)
-            except IntegrityError as e:
-                print(f'Error al insertar un nuevo registro en la tabla obra: {e}')
-        
-        sqlite_db.close()
+                try:
+                    modelo_orm.Obra.create(nombre=elem[0], monto_contrato=elem[4], fecha_inicio=elem[7], fecha_fin_inicial=elem[8], plazo_meses=elem[9], porcentaje_avance=elem[10], nro_contratacion=elem[13], mano_obra=elem[14], destacada=elem[15], nro_expediente=elem[16], etapa_id=etapa, tipo_obra_id=tipoObra, area_responsable_id=areaResp, comuna_id=comuna, barrio_id=barrio, empresa_id=empresa, tipo_contratacion_id=tipoContr, fuente_financiamiento_id=financiamiento)
+                except IntegrityError as e:
+                    print(f'Error al insertar un nuevo registro en la tabla obra: {e}')
 
     @classmethod
-    def nueva_obra(cls):
-        db = cls.conectar_db()
+    def _mapa_dimension(cls, campo):
+        # Devuelve un diccionario valor -> id con todos los registros de la tabla de dimension
+        modelo = campo.model
+        return {valor: id for id, valor in modelo.select(modelo.id, campo).tuples()}
 
-        modelo_orm.Obra.nuevo_proyecto()
-        modelo_orm.Obra.iniciar_contratacion()
-        modelo_orm.Obra.adjudicar_obra()
-        modelo_orm.Obra.iniciar_obra()
-        modelo_orm.Obra.actualizar_porcentaje_avance()
+    @classmethod
+    def _clave_dimension(cls, valor):
+        # Clave con la que se comparan los valores de texto de las dimensiones: "En Ejecución " y "en ejecucion" son el mismo valor.
+        # Un valor sin letras ni numeros se compara tal cual
+        return modelo_orm.normalizar_texto(valor) or valor
 
-        while True:
-            respuesta = input('Desea incrementar el plazo de meses que lleva la obra en ejecución? (SI/NO): ')
-            if respuesta == 'SI':
-                modelo_orm.Obra.incrementar_plazo()
-                break
-            elif respuesta == 'NO':
-                break
-            else:
-                print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+    @classmethod
+    def _cargar_dimension(cls, df, columna, campo, comunas=None):
+        # Inserta en lotes los valores de la columna que todavia no estan en la tabla y devuelve el mapa valor -> id. En las dimensiones
+        # de texto, un valor con la misma clave que uno de la tabla (o que otro anterior del lote) no se inserta: el mapa lo resuelve al id de ese
+        mapa = cls._mapa_dimension(campo)
+        texto = isinstance(campo, CharField)
+        canonicos = {}
+        if texto:
+            for valor, _ in sorted(mapa.items(), key=lambda item: item[1]):
+                canonicos.setdefault(cls._clave_dimension(valor), valor)
+        variantes = {}
+        filas = []
+
+        for valor, comuna in df.drop_duplicates(subset=[columna])[[columna, 'comuna']].values:
+            valor = campo.db_value(valor)
+            if valor in mapa:
+                continue
+            if texto:
+                canonico = canonicos.setdefault(cls._clave_dimension(valor), valor)
+                if canonico != valor:
+                    variantes[valor] = canonico
+                    continue
+            fila = {campo: valor}
+            # Cada barrio queda asociado a la comuna de la primera obra en la que aparece
+            if comunas is not None:
+                fila[modelo_orm.Barrio.comuna] = comunas[modelo_orm.Comuna.numero.db_value(comuna)]
+            filas.append(fila)
+
+        if filas:
+            cls._insertar_filas(campo.model, filas, ignorar=True)
+            modelo_orm.invalidar_dimensiones(campo.model)
+            mapa = cls._mapa_dimension(campo)
+
+        for variante, canonico in variantes.items():
+            mapa[variante] = mapa[canonico]
+        return mapa
+
+    @classmethod
+    @perfil_obras.etapa('dimensiones')
+    def _cargar_dimensiones(cls, df):
+        # Devuelve para cada columna de dimension su mapa valor -> id, insertando antes los valores nuevos
+        mapas = {}
+        for columna, campo, _ in DIMENSIONES:
+            comunas = mapas['comuna'] if campo is modelo_orm.Barrio.nombre else None
+            mapas[columna] = cls._cargar_dimension(df, columna, campo, comunas)
+
+        return mapas
+
+    @classmethod
+    def _hash_filas(cls, df):
+        # Hash de las columnas sincronizadas de cada fila, calculado de forma vectorizada por pandas
+        hashes = pd.util.hash_pandas_object(df[list(COLUMNAS_SINCRONIZADAS)], index=False)
+        return hashes.map('{:016x}'.format)
+
+    @classmethod
+    def _filas_obra(cls, df, mapas):
+        # Arma las filas de la tabla obra reemplazando los valores de las dimensiones por sus ids
+        filas = []
+        for registro, hash_contenido in zip(df.to_dict('records'), cls._hash_filas(df)):
+            fila = {campo: registro[columna] for columna, campo in COLUMNAS_OBRA}
+            for columna, campo, campo_obra in DIMENSIONES:
+                fila[campo_obra] = mapas[columna][campo.db_value(registro[columna])]
+            fila[modelo_orm.Obra.hash_contenido] = hash_contenido
+            filas.append(fila)
+
+        return filas
+
+    @classmethod
+    def _insertar_filas(cls, modelo, filas, ignorar=False):
+        # Inserta las filas (diccionarios campo -> valor, todas con los mismos campos) con una sola sentencia preparada y executemany: SQLite
+        # compila el INSERT una vez y peewee no arma el SQL de cada lote, que con insert_many era la mayor parte del tiempo de la carga.
+        # Con ignorar, las filas que violan una restriccion UNIQUE se saltean. Devuelve cuantas filas se insertaron
+        if not filas:
+            return 0
+        campos = list(filas[0])
+        columnas = ', '.join(f'"{campo.column_name}"' for campo in campos)
+        sql = f'INSERT {"OR IGNORE " if ignorar else ""}INTO "{modelo._meta.table_name}" ({columnas}) VALUES ({", ".join("?" * len(campos))})'
+
+        cursor = sqlite_db.cursor()
+        with perfil_obras.consulta(sql):
+            cursor.executemany(sql, ([campo.db_value(fila[campo]) for campo in campos] for fila in filas))
+        return cursor.rowcount
+
+    @classmethod
+    @perfil_obras.etapa('obras')
+    def _insertar_obras(cls, filas):
+        # Las obras que ya existen (mismo nombre o id del dataset) se ignoran; devuelve cuantas se insertaron
+        return cls._insertar_filas(modelo_orm.Obra, filas, ignorar=True)
+
+    @classmethod
+    def _suspender_triggers_obra(cls):
+        # Se llama dentro de la transaccion de la carga: si falla, el rollback vuelve a dejar los triggers, y mientras dura ninguna otra
+        # conexion puede escribir obras sin ellos
+        for nombre, in sqlite_db.execute_sql("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'obra'").fetchall():
+            sqlite_db.execute_sql(f'DROP TRIGGER {nombre}')
+
+    @classmethod
+    @perfil_obras.etapa('derivadas')
+    def _reanudar_triggers_obra(cls, ultimo_id):
+        # Calcula de una vez lo que los triggers hubieran hecho por cada obra de id mayor que ultimo_id y los vuelve a crear
+        cls.reconstruir_resumenes()
+        for sentencia in (modelo_orm.sql_cargar_indice_espacial(ultimo_id), modelo_orm.sql_cargar_indice_texto(ultimo_id), modelo_orm.sql_cargar_historial(ultimo_id), modelo_orm.sql_incrementar_version()):
+            sqlite_db.execute_sql(sentencia)
+        for sentencia in modelo_orm.sql_triggers_obra():
+            sqlite_db.execute_sql(sentencia)
+
+    @classmethod
+    def cargar_datos_masivo(cls, df=None):
+        if df is None:
+            df = cls.limpiar_datos()
+        inicio = time.perf_counter()
+
+        # Todo el proceso se hace dentro de una unica transaccion para evitar un commit por cada fila
+        with sqlite_db.atomic():
+            existentes, ultimo_id = modelo_orm.Obra.select(fn.COUNT(modelo_orm.Obra.id), fn.MAX(modelo_orm.Obra.id)).tuples().get()
+            sin_triggers = len(df) >= max(FILAS_CARGA_SIN_TRIGGERS, existentes)
+            if sin_triggers:
+                cls._suspender_triggers_obra()
+            mapas = cls._cargar_dimensiones(df)
+            insertadas = cls._insertar_obras(cls._filas_obra(df, mapas))
+            if sin_triggers:
+                cls._reanudar_triggers_obra(ultimo_id or 0)
+
+        segundos = time.perf_counter() - inicio
+        filas_por_segundo = len(df) / segundos if segundos > 0 else 0
+
+        print(f'Se procesaron {len(df)} filas ({insertadas} obras nuevas) en {segundos:.2f} segundos: {filas_por_segundo:.0f} filas/s')
+
+        return {'filas': len(df), 'insertadas': insertadas, 'segundos': segundos, 'filas_por_segundo': filas_por_segundo}
+
+    @classmethod
+    @perfil_obras.etapa('sincronizacion')
+    def sincronizar_datos(cls, df=None):
+        if df is None:
+            df = cls.limpiar_datos()
+        inicio = time.perf_counter()
+        df = df.assign(hash_contenido=cls._hash_filas(df).values)
+
+        # Estado actual de las obras cargadas desde el dataset: id del dataset -> (id de la obra, hash)
+        Obra = modelo_orm.Obra
+        # Solo se leen las obras del rango de ids del DataFrame, asi sincronizar un bloque no recorre toda la tabla
+        existentes = {id_dataset: (id, hash_contenido) for id, id_dataset, hash_contenido in Obra.select(Obra.id, Obra.id_dataset, Obra.hash_contenido).where(Obra.id_dataset.between(int(df['id'].min()), int(df['id'].max()))).tuples()} if len(df) else {}
+
+        es_nueva = ~df['id'].isin(existentes.keys())
+        hash_actual = df['id'].map(lambda id_dataset: existentes.get(id_dataset, (None, None))[1])
+        es_modificada = ~es_nueva & (df['hash_contenido'] != hash_actual)
+
+        nuevas = df[es_nueva]
+        modificadas = df[es_modificada]
+        sin_cambios = len(df) - len(nuevas) - len(modificadas)
+        insertadas = 0
+
+        # Obras ya cargadas con el nombre de alguna fila nueva: nombre -> (id de la obra, id del dataset). Los nombres van en un unico
+        # parametro JSON, asi la consulta no depende del limite de variables de SQLite
+        nombres = nuevas['nombre'].dropna().tolist()
+        tomados = {nombre: (id, id_dataset) for nombre, id, id_dataset in Obra.select(Obra.nombre, Obra.id, Obra.id_dataset).where(Obra.nombre.in_(SQL('(SELECT value FROM json_each(?))', [json.dumps(nombres)]))).tuples()} if nombres else {}
+
+        # Las filas nuevas cuyo nombre ya lo tiene otra obra del dataset no se insertan; se descartan antes de escribir para que no
+        # se vuelvan a intentar (con su transaccion) en cada sincronizacion
+        es_repetida = nuevas['nombre'].map(lambda nombre: tomados.get(nombre, (None, None))[1] is not None).astype(bool)
+        repetidas = int(es_repetida.sum())
+        nuevas = nuevas[~es_repetida]
+
+        # Si nada cambio no se vuelve a escribir en la base
+        if len(nuevas) or len(modificadas):
+            with sqlite_db.atomic():
+                mapas = cls._cargar_dimensiones(pd.concat([nuevas, modificadas]))
+
+                # Las obras cargadas antes de que existiera la columna id_dataset se identifican por su nombre
+                anteriores = {nombre: id for nombre, (id, id_dataset) in tomados.items() if id_dataset is None}
+                adoptadas = nuevas[nuevas['nombre'].isin(anteriores.keys())]
+                nuevas = nuevas[~nuevas['nombre'].isin(anteriores.keys())]
+
+                # Las filas que aun asi chocan con el nombre de otra obra tampoco se insertan
+                insertadas = cls._insertar_obras(cls._filas_obra(nuevas, mapas))
+                repetidas += len(nuevas) - insertadas
+
+                actualizar = [(existentes[registro['id']][0], registro) for registro in modificadas.to_dict('records')]
+                actualizar += [(anteriores[registro['nombre']], registro) for registro in adoptadas.to_dict('records')]
+
+                with perfil_obras.etapa('obras'):
+                    for id_obra, registro in actualizar:
+                        Obra.update({
+                            Obra.etapa: mapas['etapa'][modelo_orm.Etapa.estado.db_value(registro['etapa'])],
+                            Obra.porcentaje_avance: registro['porcentaje_avance'],
+                            Obra.plazo_meses: registro['plazo_meses'],
+                            Obra.mano_obra: registro['mano_obra'],
+                            Obra.latitud: registro['lat'],
+                            Obra.longitud: registro['lng'],
+                            Obra.direccion: registro['direccion'],
+                            Obra.entorno: registro['entorno'],
+                            Obra.descripcion: registro['descripcion'],
+                            Obra.id_dataset: registro['id'],
+                            Obra.hash_contenido: registro['hash_contenido'],
+                        }).where(Obra.id == id_obra).execute()
+
+                modificadas = pd.concat([modificadas, adoptadas])
+
+        segundos = time.perf_counter() - inicio
+        print(f'Sincronizacion terminada en {segundos:.2f} segundos: {insertadas} obras nuevas, {len(modificadas)} actualizadas, {sin_cambios} sin cambios y {repetidas} con nombre repetido')
+
+        return {'nuevas': insertadas, 'actualizadas': len(modificadas), 'sin_cambios': sin_cambios, 'repetidas': repetidas, 'segundos': segundos}
+
+    @classmethod
+    def sincronizar_en_bloques(cls, tamanio_bloque=TAMANIO_BLOQUE, cache=True):
+        # Con cache=False cada bloque limpio se sincroniza apenas se lee, sin tener el dataset completo en memoria;
+        # con la cache el dataset limpio se lee de ella si el CSV no cambio (y si cambio se limpia completo y se guarda)
+        inicio = time.perf_counter()
+        totales = {'nuevas': 0, 'actualizadas': 0, 'sin_cambios': 0, 'repetidas': 0}
+        informe = {}
+
+        if cache:
+            bloques, totales['cache'] = cls.limpiar_datos_con_cache(tamanio_bloque, informe)
+        else:
+            bloques, totales['cache'] = cls.limpiar_datos_en_bloques(tamanio_bloque, informe), False
+        bloques = iter(bloques)
+        # La lectura y limpieza se mide aparte de la sincronizacion, aunque sin cache se vayan alternando bloque a bloque
+        totales['limpieza'] = time.perf_counter() - inicio
+        totales['sincronizacion'] = 0
 
         while True:
-            respuesta = input('Desea incrementar la mano de obra? (SI/NO): ')
-            if respuesta == 'SI':
-                modelo_orm.Obra.incrementar_mano_obra()
-                break
-            elif respuesta == 'NO':
+            medicion = time.perf_counter()
+            bloque = next(bloques, None)
+            totales['limpieza'] += time.perf_counter() - medicion
+            if bloque is None:
                 break
+
+            medicion = time.perf_counter()
+            resultado = cls.sincronizar_datos(bloque)
+            totales['sincronizacion'] += time.perf_counter() - medicion
+            for clave in ('nuevas', 'actualizadas', 'sin_cambios', 'repetidas'):
+                totales[clave] += resultado[clave]
+
+        cls._tomar_foto_si_corresponde()
+        totales['segundos'] = time.perf_counter() - inicio
+        cls._mostrar_informe_limpieza(informe)
+        print(f"Dataset sincronizado en {totales['segundos']:.2f} segundos: {totales['nuevas']} obras nuevas, {totales['actualizadas']} actualizadas, {totales['sin_cambios']} sin cambios y {totales['repetidas']} con nombre repetido")
+
+        return totales
+
+    @classmethod
+    def _limpiar_archivo(cls, archivo, tamanio_bloque=TAMANIO_BLOQUE):
+        # Tarea de cada proceso de la ingesta en paralelo: lee y limpia un archivo y devuelve sus bloques limpios, el informe de limpieza y el tiempo usado
+        inicio = time.perf_counter()
+        informe = {}
+        bloques = list(cls.limpiar_datos_en_bloques(tamanio_bloque, informe, archivo))
+        return bloques, informe, time.perf_counter() - inicio
+
+    @classmethod
+    def ingerir_archivos(cls, archivos, procesos=None, tamanio_bloque=TAMANIO_BLOQUE):
+        # Ingesta de varios exports con el formato del observatorio (versiones anteriores del dataset, otros municipios).
+        # Los archivos se leen y limpian en paralelo en 'procesos' procesos (por defecto uno por nucleo) y este proceso es el unico que escribe:
+        # SQLite admite un solo escritor a la vez. Se sincronizan en el orden recibido, asi de varias versiones del mismo dataset queda la ultima
+        procesos = procesos or os.cpu_count()
+        inicio = time.perf_counter()
+        totales = {'nuevas': 0, 'actualizadas': 0, 'sin_cambios': 0, 'repetidas': 0}
+        tiempos = {'limpieza': 0.0, 'espera': 0.0, 'escritura': 0.0}
+        informe = {}
+
+        with ProcessPoolExecutor(max_workers=procesos) as ejecutor, modelo_orm.sesion():
+            por_encolar = deque(archivos)
+            en_curso = deque()
+
+            for numero in range(1, len(archivos) + 1):
+                # Como maximo se limpian por adelantado el doble de archivos que procesos, para que la memoria no crezca si el escritor es mas lento
+                while por_encolar and len(en_curso) < 2 * procesos:
+                    archivo = por_encolar.popleft()
+                    en_curso.append((archivo, ejecutor.submit(cls._limpiar_archivo, archivo, tamanio_bloque)))
+
+                archivo, tarea = en_curso.popleft()
+                espera = time.perf_counter()
+                bloques, informe_archivo, limpieza = tarea.result()
+                tiempos['espera'] += time.perf_counter() - espera
+                tiempos['limpieza'] += limpieza
+                for regla, cantidad in informe_archivo.items():
+                    informe[regla] = informe.get(regla, 0) + cantidad
+
+                escritura = time.perf_counter()
+                for bloque in bloques:
+                    resultado = cls.sincronizar_datos(bloque)
+                    for clave in totales:
+                        totales[clave] += resultado[clave]
+                escritura = time.perf_counter() - escritura
+                tiempos['escritura'] += escritura
+
+                print(f'[{numero}/{len(archivos)}] {archivo}: {sum(len(bloque) for bloque in bloques)} filas limpias, lectura y limpieza {limpieza:.2f} s, escritura {escritura:.2f} s')
+
+        tiempos['total'] = time.perf_counter() - inicio
+        cls._mostrar_informe_limpieza(informe)
+        print(f"Ingesta de {len(archivos)} archivos con {procesos} procesos en {tiempos['total']:.2f} segundos: {totales['nuevas']} obras nuevas, {totales['actualizadas']} actualizadas, {totales['sin_cambios']} sin cambios y {totales['repetidas']} con nombre repetido")
+        # La limpieza se suma entre todos los procesos: si es mayor que el tiempo total es porque los procesos trabajaron en paralelo
+        print(f"-lectura y limpieza: {tiempos['limpieza']:.2f} s sumando todos los procesos")
+        print(f"-escritura: {tiempos['escritura']:.2f} s")
+        print(f"-escritor esperando archivos limpios: {tiempos['espera']:.2f} s")
+
+        return {**totales, **tiempos}
+
+    @classmethod
+    def nueva_obra(cls):
+        with modelo_orm.sesion():
+            modelo_orm.Obra.nuevo_proyecto()
+            modelo_orm.Obra.iniciar_contratacion()
+            modelo_orm.Obra.adjudicar_obra()
+            modelo_orm.Obra.iniciar_obra()
+            modelo_orm.Obra.actualizar_porcentaje_avance()
+
+            while True:
+                respuesta = input('Desea incrementar el plazo de meses que lleva la obra en ejecución? (SI/NO): ')
+                if respuesta == 'SI':
+                    modelo_orm.Obra.incrementar_plazo()
+                    break
+                elif respuesta == 'NO':
+                    break
+                else:
+                    print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+
+            while True:
+                respuesta = input('Desea incrementar la mano de obra? (SI/NO): ')
+                if respuesta == 'SI':
+                    modelo_orm.Obra.incrementar_mano_obra()
+                    break
+                elif respuesta == 'NO':
+                    break
+                else:
+                    print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+
+            while True:
+                respuesta = int(input('Desea:\n1. Finalizar la obra\n2. Rescindir la obra\n: '))
+                if respuesta == 1:
+                    modelo_orm.Obra.finalizar_obra()
+                    break
+                elif respuesta == 2:
+                    modelo_orm.Obra.rescindir_obra()
+                    break
+                else:
+                    print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+
+    @classmethod
+    def _valor_transicion(cls, parametro, campo, valor):
+        # Convierte el valor recibido (texto de un archivo o valor de Python) al tipo del campo; lanza ValueError con el motivo si no es valido
+        if valor is None or (isinstance(valor, float) and math.isnan(valor)) or (isinstance(valor, str) and not valor.strip()):
+            raise ValueError(f'falta el valor de {parametro}')
+        if isinstance(valor, str):
+            valor = valor.strip()
+
+        try:
+            if isinstance(campo, FloatField):
+                valor = float(valor)
+            elif isinstance(campo, IntegerField):
+                numero = float(valor)
+                if not numero.is_integer():
+                    raise ValueError
+                valor = int(numero)
+            elif isinstance(campo, DateField):
+                valor = valor if isinstance(valor, datetime.date) else datetime.date.fromisoformat(str(valor))
             else:
-                print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+                valor = str(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f'el valor de {parametro} no es valido ({valor})')
 
-        while True:
-            respuesta = int(input('Desea:\n1. Finalizar la obra\n2. Rescindir la obra\n: '))
-            if respuesta == 1:
-                modelo_orm.Obra.finalizar_obra()
-                break
-            elif respuesta == 2:
-                modelo_orm.Obra.rescindir_obra()
-                break
+        if isinstance(valor, str) and campo.max_length and len(valor) > campo.max_length:
+            raise ValueError(f'el valor de {parametro} supera los {campo.max_length} caracteres')
+        if isinstance(valor, (int, float)) and parametro in ('monto_contrato', 'plazo_meses', 'mano_obra', 'porcentaje_avance') and not 0 <= valor:
+            raise ValueError(f'el valor de {parametro} no puede ser negativo ({valor})')
+        if parametro == 'porcentaje_avance' and valor > 100:
+            raise ValueError(f'el porcentaje de avance no puede superar 100 ({valor})')
+        if parametro == 'destacada' and valor not in ('SI', 'NO'):
+            raise ValueError(f'el valor de destacada debe ser SI o NO ({valor})')
+
+        return valor
+
+    @classmethod
+    def _resolver_dimension(cls, parametro, campo_dimension, valor):
+        # Valor con otras mayusculas, sin acentos o con algun error de tipeo: se toma el valor existente mas parecido si es suficientemente
+        # parecido y no empata con otro; si no, el error sugiere los mas parecidos
+        if isinstance(campo_dimension, IntegerField):
+            raise ValueError(f'el valor ingresado ({valor}) de {parametro} no existe en la base de datos')
+        indice = modelo_orm.indice_dimension(campo_dimension)
+        encontrado = indice.resolver(valor, modelo_orm.SIMILITUD_MINIMA)
+        if encontrado is not None:
+            return encontrado[1]
+
+        sugerencias = ', '.join(sugerencia for sugerencia, _, _ in indice.buscar(valor, 3))
+        raise ValueError(f'el valor ingresado ({valor}) de {parametro} no existe en la base de datos' + (f'; ¿quiso decir {sugerencias}?' if sugerencias else ''))
+
+    @classmethod
+    def _preparar_transicion(cls, operacion, parametros, mapas):
+        # Devuelve los valores que la operacion guarda en la obra, con las claves foraneas ya resueltas con los mapas de dimension
+        valores = {}
+        for parametro, (campo, campo_dimension) in TRANSICIONES[operacion].items():
+            valor = cls._valor_transicion(parametro, campo_dimension or campo, parametros.get(parametro))
+            if campo_dimension is not None:
+                if valor not in mapas[parametro]:
+                    valor = cls._resolver_dimension(parametro, campo_dimension, valor)
+                valor = mapas[parametro][valor]
+            valores[campo] = valor
+
+        return valores
+
+    @classmethod
+    def aplicar_transiciones(cls, operacion, elementos, clave='id'):
+        # Aplica una operacion del ciclo de vida a muchas obras en una sola transaccion y sin pedir datos por consola.
+        # Cada elemento es un diccionario con los parametros de la operacion (ver TRANSICIONES) y, salvo en nuevo_proyecto, el campo 'clave' que identifica la obra.
+        # Devuelve un resultado por elemento y en el mismo orden: {'obra': identificador, 'id': id de la obra, 'ok': True/False, 'error': motivo o None}
+        if operacion not in TRANSICIONES:
+            raise ValueError(f'La operacion {operacion} no existe; las operaciones validas son: {", ".join(TRANSICIONES)}')
+        if clave not in CLAVES_OBRA:
+            raise ValueError(f'Las obras solo se pueden identificar por: {", ".join(CLAVES_OBRA)}')
+
+        Obra = modelo_orm.Obra
+        Etapa = modelo_orm.Etapa
+        campo_clave = Obra.nombre if operacion == 'nuevo_proyecto' else CLAVES_OBRA[clave]
+        clave = 'nombre' if operacion == 'nuevo_proyecto' else clave
+        inicio = time.perf_counter()
+        resultados = []
+
+        with modelo_orm.sesion(), sqlite_db.atomic():
+            # Los mapas valor -> id de las dimensiones se leen una sola vez por lote y no una vez por obra
+            mapas = {parametro: cls._mapa_dimension(campo_dimension) for parametro, (_, campo_dimension) in TRANSICIONES[operacion].items() if campo_dimension is not None}
+            if operacion in ETAPA_TRANSICION:
+                etapa, _ = Etapa.get_or_create(estado=ETAPA_TRANSICION[operacion])
+            cerradas = cls._etapas_cerradas()
+
+            # Primero se validan todos los elementos sin tocar la base
+            pendientes = []
+            for elemento in elementos:
+                resultado = {'obra': elemento.get(clave), 'id': None, 'ok': False, 'error': None}
+                resultados.append(resultado)
+                try:
+                    resultado['obra'] = cls._valor_transicion(clave, campo_clave, elemento.get(clave))
+                    pendientes.append((resultado, cls._preparar_transicion(operacion, elemento, mapas)))
+                except ValueError as e:
+                    resultado['error'] = str(e)
+
+            # Obras del lote: identificador -> [id, etapa], leidas en grupos para no superar el limite de variables de SQLite
+            obras = {}
+            for lote in chunked(list({resultado['obra'] for resultado, _ in pendientes}), 500):
+                obras.update({identificador: [id, id_etapa] for identificador, id, id_etapa in Obra.select(campo_clave, Obra.id, Obra.etapa).where(campo_clave.in_(lote)).tuples()})
+
+            if operacion == 'nuevo_proyecto':
+                filas = []
+                for resultado, valores in pendientes:
+                    if resultado['obra'] in obras:
+                        resultado['error'] = f'ya existe una obra con el nombre {resultado["obra"]}'
+                        continue
+                    obras[resultado['obra']] = [None, etapa.id]
+                    filas.append({**valores, Obra.etapa: etapa.id})
+                    resultado['ok'] = True
+
+                cls._insertar_filas(Obra, filas)
+                creadas = {}
+                for lote in chunked([resultado['obra'] for resultado, _ in pendientes if resultado['ok']], 500):
+                    creadas.update(Obra.select(Obra.nombre, Obra.id).where(Obra.nombre.in_(lote)).tuples())
+                for resultado, _ in pendientes:
+                    resultado['id'] = creadas.get(resultado['obra']) if resultado['ok'] else None
             else:
-                print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
+                for resultado, valores in pendientes:
+                    obra = obras.get(resultado['obra'])
+                    if obra is None:
+                        resultado['error'] = f'no existe una obra con {clave} = {resultado["obra"]}'
+                        continue
+                    resultado['id'] = obra[0]
+                    if obra[1] in cerradas:
+                        resultado['error'] = 'la obra ya esta finalizada o rescindida'
+                        continue
+
+                    if operacion == 'incrementar_mano_obra':
+                        valores[Obra.mano_obra] = fn.COALESCE(Obra.mano_obra, 0) + valores[Obra.mano_obra]
+                    if operacion == 'finalizar_obra':
+                        valores[Obra.porcentaje_avance] = 100
+                    if operacion in ETAPA_TRANSICION:
+                        valores[Obra.etapa] = etapa.id
+                        obra[1] = etapa.id
+
+                    try:
+                        Obra.update(valores).where(Obra.id == obra[0]).execute()
+                        resultado['ok'] = True
+                    except IntegrityError as e:
+                        resultado['error'] = f'error al actualizar los datos: {e}'
 
-        sqlite_db.close()
+        cls._tomar_foto_si_corresponde()
+
+        aplicadas = sum(resultado['ok'] for resultado in resultados)
+        print(f'Operacion {operacion} aplicada a {aplicadas} de {len(resultados)} obras en {time.perf_counter() - inicio:.2f} segundos')
+        # En lotes grandes solo se muestran los primeros rechazos; el detalle completo queda en los resultados devueltos
+        rechazados = [resultado for resultado in resultados if not resultado['ok']]
+        for resultado in rechazados[:ERRORES_MOSTRADOS]:
+            print(f"-{resultado['obra']}: {resultado['error']}")
+        if len(rechazados) > ERRORES_MOSTRADOS:
+            print(f'-... y otras {len(rechazados) - ERRORES_MOSTRADOS} obras rechazadas')
+
+        return resultados
 
     @classmethod
-    def obtener_indicadores(cls):
-        db = cls.conectar_db()
+    def aplicar_transiciones_desde_archivo(cls, operacion, archivo, clave='id_dataset'):
+        # Aplica la operacion a cada fila de un CSV separado por ';' con una columna por parametro y otra con la clave de la obra,
+        # por ejemplo el avance que informan los contratistas: id_dataset;porcentaje_avance
+        df = pd.read_csv(archivo, sep=';', dtype=str, keep_default_na=False)
+        return cls.aplicar_transiciones(operacion, df.to_dict('records'), clave)
 
-        print('\nAreas responsables:')
-        for area in modelo_orm.AreaResponsable.select():
-            print(area)
+    @classmethod
+    def _distancia(cls, lat1, lng1, lat2, lng2):
+        # Distancia en metros entre dos puntos (formula del semiverseno)
+        lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        return 2 * RADIO_TIERRA * math.asin(math.sqrt(a))
 
-        ##############################################
-        print('\nTipos de obra:')
-        for tipo_obra in modelo_orm.TipoObra.select():
-            print(tipo_obra)
+    @classmethod
+    def _consulta_rectangulo(cls, lat_min, lng_min, lat_max, lng_max, indice=True):
+        Obra = modelo_orm.Obra
+        Ubicacion = modelo_orm.UbicacionObra
+        consulta = Obra.select(Obra.id, Obra.nombre, Obra.direccion, Obra.latitud, Obra.longitud).where(Obra.latitud.between(lat_min, lat_max), Obra.longitud.between(lng_min, lng_max))
+        if not indice:
+            return consulta
 
-        ##############################################
-        print('\nCantidad de obras por etapa')
-        for etapa in modelo_orm.Etapa.select():
-            cantidad_obras = modelo_orm.Obra.select().where(modelo_orm.Obra.etapa == etapa).count()
-            print(f"{etapa.estado}: {cantidad_obras} obras")
+        # El R*Tree guarda los limites como float de 32 bits redondeados hacia afuera: devuelve candidatos y el filtro exacto se hace con las coordenadas de la obra
+        return consulta.join(Ubicacion, on=(Ubicacion.id == Obra.id)).where(Ubicacion.max_lat >= lat_min, Ubicacion.min_lat <= lat_max, Ubicacion.max_lng >= lng_min, Ubicacion.min_lng <= lng_max)
 
-        ##############################################
-        print('\nCantidad de obras y monto total de inversión por tipo de obra:')
-        for tipo_obra in modelo_orm.TipoObra.select():
-            monto_total = modelo_orm.Obra.select(fn.SUM(modelo_orm.Obra.monto_contrato)).where(modelo_orm.Obra.tipo_obra == tipo_obra).scalar()
-            cantidad_obras = modelo_orm.Obra.select().where(modelo_orm.Obra.tipo_obra == tipo_obra).count()
-            print(f"-{tipo_obra.tipo}: {cantidad_obras} obras, Monto total de inversión: {monto_total}")
-        
-        ##############################################
-        print('\nListado de todos los barrios pertenecientes a las comunas 1, 2 y 3:')
-        barrios_list = []
-        for barrio in modelo_orm.Barrio.select():
-            if modelo_orm.Comuna.get_by_id(barrio.comuna_id).numero <= 3:
-                print(barrio.nombre)
-        #print(barrios_list)
-        
-        ##############################################
-        print('\nCantidad de obras finalizadas y su y monto total de inversión en la comuna 1:')
-        obras_finalizadas_comuna1 = modelo_orm.Obra.select().where((modelo_orm.Obra.etapa == modelo_orm.Etapa.get(modelo_orm.Etapa.estado == 'Finalizada')) & (modelo_orm.Obra.comuna == modelo_orm.Comuna.get(modelo_orm.Comuna.numero == 1))).count()
-        
-        monto_total = modelo_orm.Obra.select(fn.SUM(modelo_orm.Obra.monto_contrato)).where((modelo_orm.Obra.etapa == modelo_orm.Etapa.get(modelo_orm.Etapa.estado == 'Finalizada')) & (modelo_orm.Obra.comuna == modelo_orm.Comuna.get(modelo_orm.Comuna.numero == 1))).scalar()
-        
-        print(f'Obras finalizadas en la comuna 1: {obras_finalizadas_comuna1}')
-        print(f"Monto total de inversión en obras finalizadas de la comuna 1: {monto_total}")
+    @classmethod
+    def obras_en_rectangulo(cls, lat_min, lng_min, lat_max, lng_max, indice=True):
+        # Obras cuyas coordenadas estan dentro del rectangulo; con indice=False se recorre la tabla obra completa (se usa para comparar tiempos)
+        with modelo_orm.sesion():
+            return list(cls._consulta_rectangulo(lat_min, lng_min, lat_max, lng_max, indice).order_by(modelo_orm.Obra.id).dicts())
+
+    @classmethod
+    def obras_en_radio(cls, lat, lng, metros, indice=True):
+        # Obras a no mas de 'metros' del punto, de la mas cercana a la mas lejana y con su distancia en la clave 'distancia'
+        # Primero se buscan las del rectangulo que contiene al circulo y despues se descartan las de las esquinas
+        grados_lat = math.degrees(metros / RADIO_TIERRA)
+        grados_lng = grados_lat / max(math.cos(math.radians(lat)), 1e-6)
+        obras = []
+
+        with modelo_orm.sesion():
+            for obra in cls._consulta_rectangulo(lat - grados_lat, lng - grados_lng, lat + grados_lat, lng + grados_lng, indice).dicts():
+                obra['distancia'] = cls._distancia(lat, lng, obra['latitud'], obra['longitud'])
+                if obra['distancia'] <= metros:
+                    obras.append(obra)
+
+        return sorted(obras, key=lambda obra: (obra['distancia'], obra['id']))
+
+    @classmethod
+    def obras_cercanas(cls, lat, lng, cantidad=10, indice=True):
+        # Las 'cantidad' obras mas cercanas al punto. Con el indice se busca en radios cada vez mas grandes: en cuanto un radio contiene
+        # suficientes obras, las mas cercanas de ese circulo son las mas cercanas de todas
+        Obra = modelo_orm.Obra
+        with modelo_orm.sesion():
+            if not indice:
+                obras = list(Obra.select(Obra.id, Obra.nombre, Obra.direccion, Obra.latitud, Obra.longitud).where(Obra.latitud.is_null(False), Obra.longitud.is_null(False)).dicts())
+                for obra in obras:
+                    obra['distancia'] = cls._distancia(lat, lng, obra['latitud'], obra['longitud'])
+                return sorted(obras, key=lambda obra: (obra['distancia'], obra['id']))[:cantidad]
+
+            metros = RADIO_INICIAL_CERCANAS
+            while True:
+                obras = cls.obras_en_radio(lat, lng, metros)
+                # Ningun punto esta a mas de media vuelta de la Tierra: con ese radio ya se encontraron todas las obras
+                if len(obras) >= cantidad or metros >= math.pi * RADIO_TIERRA:
+                    return obras[:cantidad]
+                metros *= 2
+
+    @classmethod
+    def tomar_foto(cls):
+        with modelo_orm.sesion(), sqlite_db.atomic():
+            sqlite_db.execute_sql(modelo_orm.sql_tomar_foto())
+        print('Se guardo una foto del estado de las obras en el historial')
+
+    @classmethod
+    def _tomar_foto_si_corresponde(cls):
+        # Nueva foto cuando desde la ultima se acumularon EVENTOS_POR_FOTO eventos; se llama despues de cada carga o lote de operaciones
+        EventoObra, FotoObra = modelo_orm.EventoObra, modelo_orm.FotoObra
+        with modelo_orm.sesion():
+            eventos = EventoObra.select().where(EventoObra.fecha >= fn.COALESCE(FotoObra.select(fn.MAX(FotoObra.fecha)), ''))
+            if eventos.limit(EVENTOS_POR_FOTO).count() >= EVENTOS_POR_FOTO:
+                cls.tomar_foto()
+
+    @classmethod
+    def etapa_cerrada(cls, estado):
+        return estado is not None and estado.strip().casefold() in ETAPAS_CERRADAS
+
+    @classmethod
+    def _etapas_cerradas(cls):
+        # Ids de las etapas cerradas; la tabla etapa tiene pocas filas y se filtra en Python con la misma normalizacion
+        return {id for id, estado in modelo_orm.Etapa.select(modelo_orm.Etapa.id, modelo_orm.Etapa.estado).tuples() if cls.etapa_cerrada(estado)}
+
+    @classmethod
+    def _restar_meses(cls, fecha, meses):
+        anio, mes = divmod(fecha.year * 12 + fecha.month - 1 - meses, 12)
+        return fecha.replace(year=anio, month=mes + 1, day=min(fecha.day, calendar.monthrange(anio, mes + 1)[1]))
+
+    @classmethod
+    def _estado_en(cls, fecha):
+        # Estado de cada obra en la fecha: id de la obra -> (etapa, porcentaje de avance, plazo, mano de obra). Se parte de la ultima foto
+        # anterior a la fecha y se aplican solo los eventos posteriores a esa foto; como cada evento tiene el estado completo, alcanza con el ultimo de cada obra.
+        # Las obras que se crearon despues de la fecha, o antes de que existiera el historial y de su primera foto, no aparecen
+        EventoObra, FotoObra = modelo_orm.EventoObra, modelo_orm.FotoObra
+        # La fecha de la foto se usa como subconsulta y no se lee: asi se compara con el mismo formato con el que la guardo SQLite
+        foto = FotoObra.select(fn.MAX(FotoObra.fecha)).where(FotoObra.fecha <= fecha)
+        consulta = FotoObra.select(FotoObra.obra, FotoObra.etapa, FotoObra.porcentaje_avance, FotoObra.plazo_meses, FotoObra.mano_obra).where(FotoObra.fecha == foto)
+        estado = {obra: valores for obra, *valores in consulta.tuples()}
+
+        # Un evento con la misma fecha que la foto puede ser anterior o posterior a ella: volver a aplicarlo no cambia el resultado
+        eventos = (EventoObra
+            .select(EventoObra.obra, EventoObra.etapa, EventoObra.porcentaje_avance, EventoObra.plazo_meses, EventoObra.mano_obra)
+            .where(EventoObra.fecha >= fn.COALESCE(foto, ''), EventoObra.fecha <= fecha))
+        for obra, *valores in eventos.order_by(EventoObra.fecha, EventoObra.id).tuples():
+            estado[obra] = valores
+
+        return estado
+
+    @classmethod
+    def _describir_estado(cls, estado):
+        # Pasa el estado de _estado_en a una lista de diccionarios ordenada por id, con el nombre de cada obra y de su etapa
+        Obra = modelo_orm.Obra
+        etapas = dict(modelo_orm.Etapa.select(modelo_orm.Etapa.id, modelo_orm.Etapa.estado).tuples())
+        nombres = {}
+        for lote in chunked(list(estado), 500):
+            nombres.update(Obra.select(Obra.id, Obra.nombre).where(Obra.id.in_(lote)).tuples())
+
+        return [{'id': obra, 'nombre': nombres.get(obra), 'etapa': etapas.get(etapa), 'porcentaje_avance': avance, 'plazo_meses': plazo, 'mano_obra': mano_obra}
+                for obra, (etapa, avance, plazo, mano_obra) in sorted(estado.items())]
+
+    @classmethod
+    def obras_en_fecha(cls, fecha):
+        # Etapa, avance, plazo y mano de obra de cada obra en la fecha indicada, segun el historial
+        with modelo_orm.sesion():
+            return cls._describir_estado(cls._estado_en(fecha))
+
+    @classmethod
+    def obras_estancadas(cls, meses, fecha=None):
+        # Obras sin finalizar ni rescindir cuyo porcentaje de avance no cambio en los 'meses' anteriores a la fecha (por defecto, ahora):
+        # el estado al comienzo del periodo sale de las fotos y solo se recorren los eventos del periodo
+        EventoObra = modelo_orm.EventoObra
+        fecha = fecha or datetime.datetime.now()
+        desde = cls._restar_meses(fecha, meses)
+
+        with modelo_orm.sesion():
+            estado = cls._estado_en(desde)
+            iniciales = {obra: valores[1] for obra, valores in estado.items()}
+            avanzaron = set()
+            eventos = EventoObra.select(EventoObra.obra, EventoObra.etapa, EventoObra.porcentaje_avance, EventoObra.plazo_meses, EventoObra.mano_obra).where(EventoObra.fecha > desde, EventoObra.fecha <= fecha)
+            for obra, *valores in eventos.order_by(EventoObra.fecha, EventoObra.id).tuples():
+                estado[obra] = valores
+                if obra not in iniciales or valores[1] != iniciales[obra]:
+                    avanzaron.add(obra)
+
+            cerradas = cls._etapas_cerradas()
+            return cls._describir_estado({obra: valores for obra, valores in estado.items()
+                                          if obra in iniciales and obra not in avanzaron and valores[0] not in cerradas and (valores[1] or 0) < 100})
+
+    @classmethod
+    def mostrar_obras_estancadas(cls, meses, fecha=None):
+        obras = cls.obras_estancadas(meses, fecha)
+        print(f'Obras sin avance en los ultimos {meses} meses: {len(obras)}')
+        for obra in obras[:ERRORES_MOSTRADOS]:
+            print(f"-{obra['id']}. {obra['nombre']} ({obra['etapa']}, {obra['porcentaje_avance']}% de avance)")
+        if len(obras) > ERRORES_MOSTRADOS:
+            print(f'-... y otras {len(obras) - ERRORES_MOSTRADOS} obras')
+
+        return obras
+
+    @classmethod
+    def mostrar_obras_en_fecha(cls, fecha):
+        obras = cls.obras_en_fecha(fecha)
+        print(f'Estado de las obras al {fecha}: {len(obras)} obras')
+        por_etapa = {}
+        for obra in obras:
+            por_etapa[obra['etapa']] = por_etapa.get(obra['etapa'], 0) + 1
+        for etapa, cantidad in sorted(por_etapa.items(), key=lambda item: -item[1]):
+            print(f'-{etapa}: {cantidad} obras')
+
+        return obras
+
+    @classmethod
+    def _consulta_texto(cls, palabras, operador='AND'):
+        # Consulta FTS5 en la que cada palabra va entre comillas (asi ningun caracter del texto se interpreta como sintaxis) y como prefijo
+        return f' {operador} '.join(f'"{palabra}"*' for palabra in palabras)
+
+    @classmethod
+    def _consulta_busqueda(cls, consulta, etapa=None, comuna=None):
+        # Obras que coinciden con la consulta FTS5 con su puntaje (bm25: cuanto mas negativo, mas relevante) y el fragmento del texto donde aparece,
+        # filtradas por etapa y comuna en la misma consulta
+        Obra, TextoObra = modelo_orm.Obra, modelo_orm.TextoObra
+        puntaje = fn.bm25(SQL('obra_texto'), *PESOS_BUSQUEDA)
+        fragmento = fn.snippet(SQL('obra_texto'), -1, *MARCAS_FRAGMENTO, '...', PALABRAS_FRAGMENTO)
+        condiciones = [SQL('obra_texto MATCH ?', [consulta])]
+        if etapa is not None:
+            condiciones.append(modelo_orm.Etapa.estado == etapa)
+        if comuna is not None:
+            condiciones.append(modelo_orm.Comuna.numero == comuna)
+
+        return (TextoObra
+            .select(Obra.id, Obra.nombre, modelo_orm.Etapa.estado.alias('etapa'), modelo_orm.Comuna.numero.alias('comuna'), TextoObra.barrio, puntaje.alias('puntaje'), fragmento.alias('fragmento'))
+            .join(Obra, on=(Obra.id == TextoObra.rowid))
+            .join(modelo_orm.Etapa).switch(Obra)
+            .join(modelo_orm.Comuna)
+            .where(*condiciones)
+            .order_by(puntaje, Obra.id))
+
+    @classmethod
+    def buscar_obras(cls, texto, etapa=None, comuna=None, cantidad=RESULTADOS_BUSQUEDA):
+        # Obras cuyo nombre, descripcion, entorno, direccion o barrio tienen todas las palabras del texto (o palabras que empiezan con ellas),
+        # de la mas relevante a la menos. Si ninguna las tiene todas se devuelven las que tienen alguna
+        palabras = re.findall(r'\w+', texto)
+        if not palabras:
+            return []
+
+        with modelo_orm.sesion():
+            for operador in ('AND', 'OR'):
+                obras = list(cls._consulta_busqueda(cls._consulta_texto(palabras, operador), etapa, comuna).limit(cantidad).dicts())
+                if obras or len(palabras) == 1:
+                    return obras
+
+        return obras
+
+    @classmethod
+    def mostrar_busqueda(cls, texto, etapa=None, comuna=None, cantidad=RESULTADOS_BUSQUEDA):
+        inicio = time.perf_counter()
+        obras = cls.buscar_obras(texto, etapa, comuna, cantidad)
+        print(f'{len(obras)} obras encontradas para "{texto}" en {(time.perf_counter() - inicio) * 1000:.1f} ms:')
+        for obra in obras:
+            print(f"-{obra['id']}. {obra['nombre']} ({obra['etapa']}, comuna {obra['comuna']}, {obra['barrio']})")
+            print(f"  {obra['fragmento']}")
+
+        return obras
+
+    @classmethod
+    def _columnas_exportacion(cls):
+        # Nombre de cada columna exportada y campo del que sale: el id de la obra y despues las columnas del dataset, con los valores de las dimensiones
+        campos = dict(COLUMNAS_OBRA)
+        campos.update({columna: campo for columna, campo, _ in DIMENSIONES})
+        return [('id_obra', modelo_orm.Obra.id)] + [(columna, campos[columna]) for columna in COLUMNAS_DATASET]
+
+    @classmethod
+    def _consulta_obras(cls):
+        # Una sola consulta con las columnas de la obra y los valores de sus dimensiones, en lugar de una consulta por clave foranea y por obra como Obra.__str__
+        Obra = modelo_orm.Obra
+        consulta = Obra.select(*[campo.alias(nombre) for nombre, campo in cls._columnas_exportacion()])
+        for _, campo, campo_obra in DIMENSIONES:
+            consulta = consulta.switch(Obra).join(campo.model, JOIN.LEFT_OUTER if campo_obra.null else JOIN.INNER, on=(campo_obra == campo.model.id))
+
+        return consulta
+
+    @classmethod
+    def iterar_obras(cls, *condiciones, tamanio_pagina=PAGINA_EXPORTACION, desde_id=0):
+        # Devuelve las obras como tuplas (en el orden de _columnas_exportacion) de a paginas ordenadas por id. Cada pagina pide las obras con id mayor
+        # al ultimo de la anterior: sin OFFSET cada consulta empieza directo en la clave primaria, la memoria no depende de la cantidad de obras
+        # y no queda una lectura abierta durante todo el recorrido
+        Obra = modelo_orm.Obra
+        consulta = cls._consulta_obras()
+        if condiciones:
+            consulta = consulta.where(*condiciones)
+
+        with modelo_orm.sesion():
+            while True:
+                pagina = list(consulta.where(Obra.id > desde_id).order_by(Obra.id).limit(tamanio_pagina).tuples())
+                yield from pagina
+                if len(pagina) < tamanio_pagina:
+                    return
+                desde_id = pagina[-1][0]
+
+    @classmethod
+    def exportar_obras(cls, destino, *condiciones, formato=None, tamanio_pagina=PAGINA_EXPORTACION):
+        # Escribe las obras en un CSV separado por ';' o en JSON Lines (una obra por linea); sin formato se deduce de la extension del archivo
+        formato = formato or os.path.splitext(destino)[1].lstrip('.').lower()
+        if formato not in FORMATOS_EXPORTACION:
+            raise ValueError(f'El formato {formato} no existe; los formatos validos son: {", ".join(FORMATOS_EXPORTACION)}')
+        inicio = time.perf_counter()
+        columnas = [nombre for nombre, _ in cls._columnas_exportacion()]
+        cantidad = 0
+
+        with open(destino, 'w', encoding='utf-8', newline='') as archivo:
+            if formato == 'csv':
+                escritor = csv.writer(archivo, delimiter=';')
+                escritor.writerow(columnas)
+            for fila in cls.iterar_obras(*condiciones, tamanio_pagina=tamanio_pagina):
+                if formato == 'csv':
+                    escritor.writerow(fila)
+                else:
+                    archivo.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=str) + '\n')
+                cantidad += 1
+
+        print(f'Se exportaron {cantidad} obras a {destino} en {time.perf_counter() - inicio:.2f} segundos')
+        return cantidad
+
+    @classmethod
+    def reconstruir_resumenes(cls):
+        # Recalcula desde cero las tablas de resumen a partir de la tabla obra
+        with sqlite_db.atomic():
+            for modelo in modelo_orm.MODELOS_RESUMEN:
+                columnas, _ = modelo_orm._claves_resumen(modelo)
+                modelo.delete().execute()
+                sqlite_db.execute_sql(f'INSERT INTO {modelo._meta.table_name} ({", ".join(columnas + list(modelo_orm.MEDIDAS_RESUMEN))}) {modelo_orm.sql_agregar_resumen(modelo)}')
+
+        print('Se reconstruyeron las tablas de resumen')
+
+    @classmethod
+    def verificar_resumenes(cls):
+        # Compara cada tabla de resumen con el mismo resumen calculado desde la tabla obra y devuelve las diferencias
+        diferencias = []
+
+        for modelo in modelo_orm.MODELOS_RESUMEN:
+            columnas, _ = modelo_orm._claves_resumen(modelo)
+            tabla = modelo._meta.table_name
+            cantidad_claves = len(columnas)
+            esperado = {fila[:cantidad_claves]: fila[cantidad_claves:] for fila in sqlite_db.execute_sql(modelo_orm.sql_agregar_resumen(modelo))}
+            guardado = {fila[:cantidad_claves]: fila[cantidad_claves:] for fila in sqlite_db.execute_sql(f'SELECT {", ".join(columnas + list(modelo_orm.MEDIDAS_RESUMEN))} FROM {tabla} WHERE cantidad != 0')}
 
-        ##############################################
-        print('\nCantidad de obras finalizadas en un plazo menor o igual a 24 meses:')
-        obras_finalizadas_plazo = modelo_orm.Obra.select().where(modelo_orm.Obra.plazo_meses <= 24).count()
-        print(obras_finalizadas_plazo)
+            for clave in esperado.keys() | guardado.keys():
+                valores_esperados = esperado.get(clave, (0,) * len(modelo_orm.MEDIDAS_RESUMEN))
+                valores_guardados = guardado.get(clave, (0,) * len(modelo_orm.MEDIDAS_RESUMEN))
+                # Los montos se acumulan de a una fila, por lo que pueden diferir en el redondeo de la suma completa
+                if not all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6) for a, b in zip(valores_esperados, valores_guardados)):
+                    diferencias.append((tabla, clave, valores_guardados, valores_esperados))
 
-        ##############################################
-        print('\nPorcentaje de obras finalizadas:')
-        total_obras = modelo_orm.Obra.select().count()
-        obras_finalizadas = modelo_orm.Obra.select().where(modelo_orm.Obra.etapa == modelo_orm.Etapa.get(modelo_orm.Etapa.estado == 'Finalizada')).count()
-        porcentaje_obras_finalizadas = (obras_finalizadas / total_obras) * 100 
-        print('{:.2f}'.format(porcentaje_obras_finalizadas),"%")
+        if diferencias:
+            print(f'Las tablas de resumen tienen {len(diferencias)} diferencias con la tabla obra:')
+            for tabla, clave, valores_guardados, valores_esperados in diferencias:
+                print(f'-{tabla} {clave}: guardado {valores_guardados}, esperado {valores_esperados}')
+        else:
+            print('Las tablas de resumen coinciden con la tabla obra')
+
+        return diferencias
+
+    @classmethod
+    def _consultas_indicadores(cls, materializado=False):
+        # Consultas agrupadas con las que se calculan los indicadores, una cantidad fija sin importar cuantas etapas, tipos o barrios existan
+        if materializado:
+            return cls._consultas_resumen()
+
+        Obra = modelo_orm.Obra
+        Etapa = modelo_orm.Etapa
+        TipoObra = modelo_orm.TipoObra
+        Comuna = modelo_orm.Comuna
+        Barrio = modelo_orm.Barrio
+
+        return {
+            'areas_responsables': modelo_orm.AreaResponsable
+                .select(modelo_orm.AreaResponsable.area)
+                .order_by(modelo_orm.AreaResponsable.id),
+            'obras_por_etapa': Etapa
+                .select(Etapa.estado, fn.COUNT(Obra.id))
+                .join(Obra, JOIN.LEFT_OUTER, on=(Obra.etapa == Etapa.id))
+                .group_by(Etapa.id)
+                .order_by(Etapa.id),
+            'obras_por_tipo': TipoObra
+                .select(TipoObra.tipo, fn.COUNT(Obra.id), fn.SUM(Obra.monto_contrato))
+                .join(Obra, JOIN.LEFT_OUTER, on=(Obra.tipo_obra == TipoObra.id))
+                .group_by(TipoObra.id)
+                .order_by(TipoObra.id),
+            'barrios_comunas_1_a_3': Barrio
+                .select(Barrio.nombre)
+                .join(Comuna, on=(Barrio.comuna == Comuna.id))
+                .where(Comuna.numero <= 3)
+                .order_by(Barrio.id),
+            'finalizadas_comuna_1': Obra
+                .select(fn.COUNT(Obra.id), fn.SUM(Obra.monto_contrato))
+                .join(Etapa, on=(Obra.etapa == Etapa.id))
+                .switch(Obra)
+                .join(Comuna, on=(Obra.comuna == Comuna.id))
+                .where((Etapa.estado == 'Finalizada') & (Comuna.numero == 1)),
+            'totales': Obra
+                .select(fn.COUNT(Obra.id), fn.SUM(Case(None, [(Obra.plazo_meses <= 24, 1)], 0)), fn.SUM(Obra.mano_obra), fn.SUM(Obra.monto_contrato)),
+        }
+
+    @classmethod
+    def _consultas_resumen(cls):
+        # Las mismas consultas leyendo las tablas de resumen: el costo depende de la cantidad de grupos y no de la cantidad de obras
+        Etapa = modelo_orm.Etapa
+        TipoObra = modelo_orm.TipoObra
+        Comuna = modelo_orm.Comuna
+        ResumenEtapa = modelo_orm.ResumenEtapa
+        ResumenTipoObra = modelo_orm.ResumenTipoObra
+        ResumenEtapaComuna = modelo_orm.ResumenEtapaComuna
+        ResumenGeneral = modelo_orm.ResumenGeneral
+        consultas = cls._consultas_indicadores()
+
+        # SUM devuelve NULL cuando no hay valores, igual que en la consulta sobre la tabla obra
+        def suma(cantidad, total):
+            return Case(None, [(cantidad > 0, total)], None)
+
+        consultas.update({
+            'obras_por_etapa': Etapa
+                .select(Etapa.estado, fn.COALESCE(ResumenEtapa.cantidad, 0))
+                .join(ResumenEtapa, JOIN.LEFT_OUTER, on=(ResumenEtapa.etapa == Etapa.id))
+                .order_by(Etapa.id),
+            'obras_por_tipo': TipoObra
+                .select(TipoObra.tipo, fn.COALESCE(ResumenTipoObra.cantidad, 0), suma(ResumenTipoObra.cantidad_montos, ResumenTipoObra.monto_total))
+                .join(ResumenTipoObra, JOIN.LEFT_OUTER, on=(ResumenTipoObra.tipo_obra == TipoObra.id))
+                .order_by(TipoObra.id),
+            'finalizadas_comuna_1': ResumenEtapaComuna
+                .select(fn.COALESCE(fn.SUM(ResumenEtapaComuna.cantidad), 0), fn.SUM(suma(ResumenEtapaComuna.cantidad_montos, ResumenEtapaComuna.monto_total)))
+                .join(Etapa, on=(ResumenEtapaComuna.etapa == Etapa.id))
+                .switch(ResumenEtapaComuna)
+                .join(Comuna, on=(ResumenEtapaComuna.comuna == Comuna.id))
+                .where((Etapa.estado == 'Finalizada') & (Comuna.numero == 1)),
+            'totales': ResumenGeneral
+                .select(ResumenGeneral.cantidad, ResumenGeneral.plazo_24_meses, suma(ResumenGeneral.cantidad_mano_obra, ResumenGeneral.mano_obra_total), suma(ResumenGeneral.cantidad_montos, ResumenGeneral.monto_total))
+                .where(ResumenGeneral.clave == 1),
+        })
+
+        return consultas
+
+    @classmethod
+    @perfil_obras.etapa('indicadores')
+    def calcular_indicadores(cls, materializado=True):
+        # Por defecto se leen las tablas de resumen; con materializado=False se recalcula todo sobre la tabla obra
+        consultas = cls._consultas_indicadores(materializado)
 
-        ##############################################
-        print('\nCantidad total de mano de obra empleada:')
-        cantidad_total = modelo_orm.Obra.select(fn.SUM(modelo_orm.Obra.mano_obra)).scalar()
-        print(cantidad_total)
+        areas = [area for (area,) in consultas['areas_responsables'].tuples()]
+        obras_por_etapa = dict(consultas['obras_por_etapa'].tuples())
+        obras_por_tipo = {tipo: {'cantidad': cantidad, 'monto_total': monto_total} for tipo, cantidad, monto_total in consultas['obras_por_tipo'].tuples()}
+        barrios = [nombre for (nombre,) in consultas['barrios_comunas_1_a_3'].tuples()]
+        finalizadas_comuna1, monto_finalizadas_comuna1 = consultas['finalizadas_comuna_1'].tuples().get()
+        total_obras, plazo_24_meses, mano_obra_total, monto_total = consultas['totales'].tuples().get()
 
-        ##############################################
-        print('\nMonto total de inversión:')
-        monto_total_inversion = modelo_orm.Obra.select(fn.SUM(modelo_orm.Obra.monto_contrato)).scalar()
-        print(f"El monto total de inversion es de: {monto_total_inversion}")
+        finalizadas = obras_por_etapa.get('Finalizada', 0)
+
+        return {
+            'areas_responsables': areas,
+            'tipos_obra': list(obras_por_tipo),
+            'obras_por_etapa': obras_por_etapa,
+            'obras_por_tipo': obras_por_tipo,
+            'barrios_comunas_1_a_3': barrios,
+            'finalizadas_comuna_1': {'cantidad': finalizadas_comuna1, 'monto_total': monto_finalizadas_comuna1},
+            'finalizadas_plazo_24_meses': plazo_24_meses or 0,
+            'total_obras': total_obras,
+            'porcentaje_finalizadas': (finalizadas / total_obras) * 100 if total_obras else 0,
+            'mano_obra_total': mano_obra_total,
+            'monto_total_inversion': monto_total,
+        }
+
+    @classmethod
+    def cargar_en_memoria(cls):
+        # Carga la tabla obra en arreglos de NumPy: cada clave foranea como codigo entero (-1 si es nula) y cada medida como float con NaN para los nulos.
+        # Con los datos cargados una sola vez, calcular_indicadores_en_memoria responde sin volver a consultar la base
+        Obra = modelo_orm.Obra
+        datos = {'dimensiones': {}}
+
+        with modelo_orm.sesion():
+            for columna, campo in DIMENSIONES_MEMORIA.items():
+                modelo = campo.model
+                filas = list(modelo.select(modelo.id, campo).order_by(modelo.id).tuples())
+                datos['dimensiones'][columna] = {'ids': np.array([id for id, _ in filas], dtype='int64'), 'valores': [valor for _, valor in filas]}
+            datos['comuna_de_barrio'] = np.array([comuna for comuna, in modelo_orm.Barrio.select(modelo_orm.Barrio.comuna).order_by(modelo_orm.Barrio.id).tuples()], dtype='int64')
+
+            columnas = list(DIMENSIONES_MEMORIA) + list(MEDIDAS_MEMORIA)
+            sql, params = Obra.select(*[getattr(Obra, columna) for columna in columnas]).sql()
+            # NumPy convierte los NULL en NaN al armar el arreglo de floats
+            filas = np.array(sqlite_db.execute_sql(sql, params).fetchall(), dtype='float64').reshape(-1, len(columnas))
+            df = dict(zip(columnas, filas.T))
+
+        for columna, dimension in datos['dimensiones'].items():
+            ids = df[columna]
+            codigos = np.searchsorted(dimension['ids'], np.nan_to_num(ids, nan=-1).astype('int64'))
+            encontrado = ~np.isnan(ids) & (codigos < len(dimension['ids']))
+            encontrado[encontrado] = dimension['ids'][codigos[encontrado]] == ids[encontrado]
+            datos[columna] = np.where(encontrado, codigos, -1)
+        # Los barrios guardan el id de su comuna: se pasa al codigo de la comuna igual que en la tabla obra
+        datos['comuna_de_barrio'] = np.searchsorted(datos['dimensiones']['comuna']['ids'], datos['comuna_de_barrio'])
+
+        for columna in MEDIDAS_MEMORIA:
+            datos[columna] = np.ascontiguousarray(df[columna])
+
+        return datos
+
+    @classmethod
+    def _suma_sql(cls, valores, entero=False):
+        # Igual que SUM de SQLite: NULL si no hay valores y, en una columna INTEGER, entero si todos los valores lo son
+        valores = valores[~np.isnan(valores)]
+        if not len(valores):
+            return None
+        total = float(np.add.reduce(valores))
+        return int(total) if entero and np.all(valores == np.floor(valores)) else total
+
+    @classmethod
+    @perfil_obras.etapa('indicadores_en_memoria')
+    def calcular_indicadores_en_memoria(cls, datos=None):
+        # Los mismos indicadores que calcular_indicadores, con conteos y sumas vectorizadas (bincount) sobre los arreglos de cargar_en_memoria
+        if datos is None:
+            datos = cls.cargar_en_memoria()
+        dimensiones = datos['dimensiones']
+        monto = datos['monto_contrato']
+        con_monto = ~np.isnan(monto)
 
-        sqlite_db.close()
+        cantidad_etapa = np.bincount(datos['etapa'][datos['etapa'] >= 0], minlength=len(dimensiones['etapa']['ids']))
+
+        tipos = dimensiones['tipo_obra']
+        con_tipo = datos['tipo_obra'] >= 0
+        cantidad_tipo = np.bincount(datos['tipo_obra'][con_tipo], minlength=len(tipos['ids']))
+        montos_tipo = np.bincount(datos['tipo_obra'][con_tipo & con_monto], minlength=len(tipos['ids']))
+        suma_tipo = np.bincount(datos['tipo_obra'][con_tipo & con_monto], weights=monto[con_tipo & con_monto], minlength=len(tipos['ids']))
+
+        numeros_comuna = np.array(dimensiones['comuna']['valores'])
+        comuna_barrio = numeros_comuna[datos['comuna_de_barrio']] if len(numeros_comuna) else np.array([])
+        barrios = [nombre for nombre, numero in zip(dimensiones['barrio']['valores'], comuna_barrio) if numero <= 3]
+
+        etapas = dimensiones['etapa']['valores']
+        comunas = dimensiones['comuna']['valores']
+        finalizadas_comuna1 = np.zeros(len(monto), dtype=bool)
+        if 'Finalizada' in etapas and 1 in comunas:
+            finalizadas_comuna1 = (datos['etapa'] == etapas.index('Finalizada')) & (datos['comuna'] == comunas.index(1))
+
+        total_obras = len(monto)
+        obras_por_etapa = {estado: int(cantidad) for estado, cantidad in zip(etapas, cantidad_etapa)}
+        obras_por_tipo = {tipo: {'cantidad': int(cantidad), 'monto_total': float(suma) if montos else None} for tipo, cantidad, montos, suma in zip(tipos['valores'], cantidad_tipo, montos_tipo, suma_tipo)}
+        finalizadas = obras_por_etapa.get('Finalizada', 0)
+
+        return {
+            'areas_responsables': list(dimensiones['area_responsable']['valores']),
+            'tipos_obra': list(obras_por_tipo),
+            'obras_por_etapa': obras_por_etapa,
+            'obras_por_tipo': obras_por_tipo,
+            'barrios_comunas_1_a_3': barrios,
+            'finalizadas_comuna_1': {'cantidad': int(finalizadas_comuna1.sum()), 'monto_total': cls._suma_sql(monto[finalizadas_comuna1])},
+            'finalizadas_plazo_24_meses': int((datos['plazo_meses'] <= 24).sum()),
+            'total_obras': total_obras,
+            'porcentaje_finalizadas': (finalizadas / total_obras) * 100 if total_obras else 0,
+            'mano_obra_total': cls._suma_sql(datos['mano_obra'], entero=True),
+            'monto_total_inversion': cls._suma_sql(monto),
+        }
+
+    @classmethod
+    def _diferencias_indicadores(cls, esperado, obtenido, prefijo=''):
+        # Compara dos resultados de indicadores: los conteos y listados deben ser iguales y los montos pueden diferir solo por el orden de las sumas
+        if isinstance(esperado, dict) and isinstance(obtenido, dict):
+            if list(esperado) != list(obtenido):
+                return [f'{prefijo}: claves distintas']
+            return [diferencia for clave in esperado for diferencia in cls._diferencias_indicadores(esperado[clave], obtenido[clave], f'{prefijo}.{clave}' if prefijo else clave)]
+        if isinstance(esperado, float) and isinstance(obtenido, float):
+            return [] if math.isclose(esperado, obtenido, rel_tol=1e-9) else [f'{prefijo}: {esperado} != {obtenido}']
+        if esperado != obtenido or type(esperado) is not type(obtenido):
+            return [f'{prefijo}: {esperado!r} != {obtenido!r}']
+        return []
+
+    @classmethod
+    def verificar_indicadores_en_memoria(cls, datos=None):
+        # Compara los indicadores del modo en memoria con los calculados por SQL sobre la tabla obra
+        with modelo_orm.sesion():
+            esperado = cls.calcular_indicadores(materializado=False)
+        diferencias = cls._diferencias_indicadores(esperado, cls.calcular_indicadores_en_memoria(datos))
+
+        if diferencias:
+            print('Los indicadores calculados en memoria no coinciden con los de la base:')
+            for diferencia in diferencias:
+                print(f'-{diferencia}')
+        else:
+            print('Los indicadores calculados en memoria coinciden con los de la base')
+
+        return diferencias
+
+    @classmethod
+    def explicar_consultas(cls):
+        # Muestra el plan de ejecucion de cada consulta de los indicadores y del ciclo de vida de una obra, y señala los recorridos completos de tablas
+        consultas = {f'indicadores.{nombre}': consulta for nombre, consulta in cls._consultas_indicadores().items()}
+        consultas.update({f'resumen.{nombre}': consulta for nombre, consulta in cls._consultas_resumen().items()})
+        consultas.update({f'ciclo_vida.{nombre}': consulta for nombre, consulta in modelo_orm.Obra.consultas_ciclo_vida().items()})
+        consultas['espacial.rectangulo'] = cls._consulta_rectangulo(-34.62, -58.45, -34.6, -58.43)
+        consultas['texto.busqueda'] = cls._consulta_busqueda(cls._consulta_texto(['escuela', 'primaria']), comuna=12).limit(RESULTADOS_BUSQUEDA)
+        consultas['exportacion.pagina'] = cls._consulta_obras().where(modelo_orm.Obra.id > 0).order_by(modelo_orm.Obra.id).limit(PAGINA_EXPORTACION)
+        recorridos = {}
+
+        for nombre, consulta in consultas.items():
+            sql, params = consulta.sql()
+            plan = sqlite_db.execute_sql(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            # Peewee usa alias (t1, t2, ...) para las tablas, se reemplazan por su nombre para que el plan sea legible
+            alias = dict((a, tabla) for tabla, a in re.findall(r'"(\w+)" AS "(t\d+)"', sql))
+
+            print(f'\n{nombre}:')
+            for fila in plan:
+                detalle = re.sub(r'\bt\d+\b', lambda m: alias.get(m.group(0), m.group(0)), fila[-1])
+                # "SCAN tabla" sin "USING ... INDEX" significa que se recorre la tabla completa
+                if detalle.startswith('SCAN') and 'INDEX' not in detalle:
+                    recorridos.setdefault(nombre, []).append(detalle)
+                    print(f'  {detalle}  <-- RECORRIDO COMPLETO')
+                else:
+                    print(f'  {detalle}')
+
+        print(f'\nConsultas con recorridos completos de tablas: {len(recorridos)} de {len(consultas)}')
+        for nombre, detalles in recorridos.items():
+            print(f'-{nombre}: {", ".join(detalles)}')
+
+        return recorridos
+
+    @classmethod
+    def _cargar_atrasos(cls, fecha):
+        # Una fila por obra con los ids de la etapa y de los grupos, el avance, el plazo, el monto y los dias transcurridos desde el inicio, previstos
+        # entre el inicio y el fin inicial y vencidos desde el fin inicial hasta la fecha. SQLite pasa cada fecha a dia juliano una sola vez y las
+        # diferencias se calculan sobre los arreglos; NumPy convierte los NULL en NaN
+        Obra = modelo_orm.Obra
+        columnas = {
+            'id': Obra.id,
+            'etapa': Obra.etapa,
+            **{grupo: campo for grupo, (campo, _) in GRUPOS_ATRASOS.items()},
+            'porcentaje_avance': Obra.porcentaje_avance,
+            'plazo_meses': Obra.plazo_meses,
+            'monto_contrato': Obra.monto_contrato,
+            'inicio': fn.julianday(Obra.fecha_inicio),
+            'fin_inicial': fn.julianday(Obra.fecha_fin_inicial),
+        }
+        sql, params = Obra.select(*columnas.values()).sql()
+        filas = np.array(sqlite_db.execute_sql(sql, params).fetchall(), dtype='float64').reshape(-1, len(columnas))
+        datos = dict(zip(columnas, filas.T))
+
+        dia = sqlite_db.execute_sql('SELECT julianday(?)', (fecha.isoformat(),)).fetchone()[0]
+        datos['dias_transcurridos'] = dia - datos['inicio']
+        datos['dias_previstos'] = datos['fin_inicial'] - datos['inicio']
+        datos['dias_vencidos'] = dia - datos['fin_inicial']
+        return datos
+
+    @classmethod
+    def _rangos(cls, valores):
+        # Posicion de cada valor en el orden de todos los valores (los NaN al final); se calcula una vez por medida y sirve para todos los grupos
+        rangos = np.empty(len(valores), dtype='int64')
+        rangos[np.argsort(valores, kind='stable')] = np.arange(len(valores))
+        return rangos
+
+    @classmethod
+    def _percentiles_por_grupo(cls, codigos, valores, rangos, grupos):
+        # Cantidad de valores y percentiles por rango mas cercano de cada grupo con un solo ordenamiento: ordenadas las filas por grupo y valor
+        # (una clave entera grupo * filas + rango del valor), el percentil p de un grupo con n valores es su fila ceil(p * n / 100).
+        # Los grupos sin valores quedan con NaN
+        validos = (codigos >= 0) & ~np.isnan(valores)
+        codigos, valores = codigos[validos], valores[validos]
+        valores = valores[np.argsort(codigos * len(rangos) + rangos[validos])]
+        cantidades = np.bincount(codigos, minlength=grupos)
+        inicios = np.cumsum(cantidades) - cantidades
+
+        resultado = {'cantidad': cantidades}
+        for percentil in PERCENTILES_ATRASOS:
+            posiciones = np.minimum(inicios + np.maximum(-(-percentil * cantidades // 100) - 1, 0), max(len(valores) - 1, 0))
+            resultado[f'p{percentil}'] = np.where(cantidades > 0, valores[posiciones] if len(valores) else np.nan, np.nan)
+        return resultado
+
+    @classmethod
+    def _resumir_atrasos(cls, codigos, obras, rangos, grupos):
+        # Por grupo: obras, obras vencidas con su monto y los percentiles del desvio del avance, los meses vencidos y los meses de prorroga
+        con_grupo = codigos >= 0
+        vencidas = con_grupo & (obras['meses_vencidos'] > 0)
+        resumen = {
+            'obras': np.bincount(codigos[con_grupo], minlength=grupos),
+            'vencidas': np.bincount(codigos[vencidas], minlength=grupos),
+            'monto_vencido': np.bincount(codigos[vencidas], weights=np.nan_to_num(obras['monto_contrato'][vencidas]), minlength=grupos),
+        }
+        for medida in ('desvio_avance', 'meses_vencidos', 'meses_prorroga'):
+            resumen[medida] = cls._percentiles_por_grupo(codigos, obras[medida], rangos[medida], grupos)
+        return resumen
+
+    @classmethod
+    def _describir_resumen(cls, resumen, posicion):
+        # Fila 'posicion' del resumen como diccionario con numeros de Python (None en lugar de NaN), listo para mostrar o pasar a JSON
+        numero = lambda valor: None if np.isnan(valor) else round(float(valor), 2)
+        fila = {'obras': int(resumen['obras'][posicion]), 'vencidas': int(resumen['vencidas'][posicion]), 'monto_vencido': float(resumen['monto_vencido'][posicion])}
+        for medida in ('desvio_avance', 'meses_vencidos', 'meses_prorroga'):
+            percentiles = resumen[medida]
+            fila[medida] = {'cantidad': int(percentiles['cantidad'][posicion]), **{f'p{percentil}': numero(percentiles[f'p{percentil}'][posicion]) for percentil in PERCENTILES_ATRASOS}}
+        return fila
+
+    @classmethod
+    @perfil_obras.etapa('atrasos')
+    def calcular_atrasos(cls, fecha=None):
+        # Atrasos de las obras a la fecha (por defecto, hoy), en una sola lectura de la tabla obra y con operaciones vectorizadas de NumPy:
+        # -por obra, el avance esperado si la obra avanzara parejo entre el inicio y el fin inicial, el desvio del avance real respecto de ese,
+        #  los meses vencidos desde el fin inicial de las obras sin terminar (NaN en las finalizadas o rescindidas) y los meses de prorroga del
+        #  plazo actual sobre el previsto entre las fechas iniciales
+        # -en total y por comuna, tipo de obra y empresa, las obras vencidas, su monto y los percentiles de esas medidas
+        # El resultado se guarda y se reutiliza hasta que cambia la version de la tabla obra o la fecha
+        fecha = fecha or datetime.date.today()
+        clave = (sqlite_db.database, fecha)
+
+        with modelo_orm.sesion(), sqlite_db.atomic():
+            version = modelo_orm.version_obra()
+            with _bloqueo_atrasos:
+                guardado = _cache_atrasos.get(clave)
+                if guardado is not None and guardado[0] == version:
+                    _cache_atrasos.move_to_end(clave)
+                    return guardado[1]
+
+            datos = cls._cargar_atrasos(fecha)
+            cerradas = list(cls._etapas_cerradas())
+
+        avance = datos['porcentaje_avance']
+        previstos = datos['dias_previstos'] / DIAS_POR_MES
+        # Sin las fechas iniciales, la duracion prevista es el plazo en meses
+        duracion = np.where(previstos > 0, previstos, np.where(datos['plazo_meses'] > 0, datos['plazo_meses'], np.nan))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            esperado = np.clip(100 * (datos['dias_transcurridos'] / DIAS_POR_MES) / duracion, 0, 100)
+        abiertas = ~np.isin(datos['etapa'], cerradas) & ~(avance >= 100)
+
+        obras = {
+            'id': datos['id'].astype('int64'),
+            'porcentaje_avance': avance,
+            'avance_esperado': esperado,
+            'desvio_avance': avance - esperado,
+            'meses_vencidos': np.where(abiertas, np.maximum(datos['dias_vencidos'] / DIAS_POR_MES, 0), np.nan),
+            'meses_prorroga': datos['plazo_meses'] - previstos,
+            'monto_contrato': datos['monto_contrato'],
+        }
+
+        rangos = {medida: cls._rangos(obras[medida]) for medida in ('desvio_avance', 'meses_vencidos', 'meses_prorroga')}
+        resultado = {'fecha': fecha.isoformat(), 'obras': obras, 'total': cls._describir_resumen(cls._resumir_atrasos(np.zeros(len(avance), dtype='int64'), obras, rangos, 1), 0)}
+        for grupo, (_, campo) in GRUPOS_ATRASOS.items():
+            codigos = np.nan_to_num(datos[grupo], nan=-1).astype('int64')
+            resumen = cls._resumir_atrasos(codigos, obras, rangos, int(codigos.max(initial=-1)) + 1)
+            filas = []
+            for id in np.flatnonzero(resumen['obras']):
+                valor = getattr(modelo_orm.dimension_por_id(campo.model, int(id)), campo.name)
+                filas.append({grupo: valor, **cls._describir_resumen(resumen, id)})
+            resultado[grupo] = sorted(filas, key=lambda fila: (-fila['vencidas'], -fila['monto_vencido']))
+
+        with _bloqueo_atrasos:
+            _cache_atrasos[clave] = (version, resultado)
+            _cache_atrasos.move_to_end(clave)
+            while len(_cache_atrasos) > ATRASOS_EN_CACHE:
+                _cache_atrasos.popitem(last=False)
+        return resultado
+
+    @classmethod
+    def mostrar_atrasos(cls, fecha=None):
+        inicio = time.perf_counter()
+        atrasos = cls.calcular_atrasos(fecha)
+        segundos = time.perf_counter() - inicio
+        percentiles = lambda datos: ', '.join(f"p{percentil} {datos[f'p{percentil}']}" for percentil in PERCENTILES_ATRASOS)
+        total = atrasos['total']
+
+        print(f"Atrasos de las obras al {atrasos['fecha']} (calculados en {segundos * 1000:.1f} ms):")
+        print(f"-{total['vencidas']} obras sin terminar pasaron su fecha de fin inicial, por un monto de {total['monto_vencido']:.2f}")
+        print(f"-meses vencidos: {percentiles(total['meses_vencidos'])}")
+        print(f"-desvio del avance real respecto del esperado (puntos): {percentiles(total['desvio_avance'])}")
+        print(f"-meses de prorroga del plazo: {percentiles(total['meses_prorroga'])}")
+
+        for grupo in GRUPOS_ATRASOS:
+            print(f'\nPor {grupo.replace("_", " ")} (con mas obras vencidas):')
+            for fila in atrasos[grupo][:ATRASOS_MOSTRADOS]:
+                print(f"-{fila[grupo]}: {fila['vencidas']} de {fila['obras']} obras vencidas, monto {fila['monto_vencido']:.2f}, meses vencidos {percentiles(fila['meses_vencidos'])}, desvio del avance {percentiles(fila['desvio_avance'])}")
+
+        # Las obras mas vencidas: un solo ordenamiento sobre los arreglos y una consulta por los nombres
+        obras = atrasos['obras']
+        vencidas = np.flatnonzero(obras['meses_vencidos'] > 0)
+        mayores = vencidas[np.argsort(-obras['meses_vencidos'][vencidas], kind='stable')[:ATRASOS_MOSTRADOS]]
+        with modelo_orm.sesion():
+            nombres = dict(modelo_orm.Obra.select(modelo_orm.Obra.id, modelo_orm.Obra.nombre).where(modelo_orm.Obra.id.in_(obras['id'][mayores].tolist())).tuples())
+        print('\nObras mas vencidas:')
+        for posicion in mayores:
+            id = int(obras['id'][posicion])
+            print(f"-{id}. {nombres.get(id)}: {obras['meses_vencidos'][posicion]:.1f} meses vencida, {obras['porcentaje_avance'][posicion]:.0f}% de avance (esperado {obras['avance_esperado'][posicion]:.0f}%)")
+
+        return atrasos
+
+    @classmethod
+    def obtener_indicadores(cls, en_memoria=False):
+        with modelo_orm.sesion():
+            indicadores = cls.calcular_indicadores_en_memoria() if en_memoria else cls.calcular_indicadores()
+
+            print('\nAreas responsables:')
+            for area in indicadores['areas_responsables']:
+                print(area)
+
+            ##############################################
+            print('\nTipos de obra:')
+            for tipo_obra in indicadores['tipos_obra']:
+                print(tipo_obra)
+
+            ##############################################
+            print('\nCantidad de obras por etapa')
+            for estado, cantidad_obras in indicadores['obras_por_etapa'].items():
+                print(f"{estado}: {cantidad_obras} obras")
+
+            ##############################################
+            print('\nCantidad de obras y monto total de inversión por tipo de obra:')
+            for tipo_obra, totales in indicadores['obras_por_tipo'].items():
+                print(f"-{tipo_obra}: {totales['cantidad']} obras, Monto total de inversión: {totales['monto_total']}")
+
+            ##############################################
+            print('\nListado de todos los barrios pertenecientes a las comunas 1, 2 y 3:')
+            for barrio in indicadores['barrios_comunas_1_a_3']:
+                print(barrio)
+
+            ##############################################
+            print('\nCantidad de obras finalizadas y su y monto total de inversión en la comuna 1:')
+            print(f"Obras finalizadas en la comuna 1: {indicadores['finalizadas_comuna_1']['cantidad']}")
+            print(f"Monto total de inversión en obras finalizadas de la comuna 1: {indicadores['finalizadas_comuna_1']['monto_total']}")
+
+            ##############################################
+            print('\nCantidad de obras finalizadas en un plazo menor o igual a 24 meses:')
+            print(indicadores['finalizadas_plazo_24_meses'])
+
+            ##############################################
+            print('\nPorcentaje de obras finalizadas:')
+            print('{:.2f}'.format(indicadores['porcentaje_finalizadas']),"%")
+
+            ##############################################
+            print('\nCantidad total de mano de obra empleada:')
+            print(indicadores['mano_obra_total'])
+
+            ##############################################
+            print('\nMonto total de inversión:')
+            print(f"El monto total de inversion es de: {indicadores['monto_total_inversion']}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gestión de obras urbanas de la Ciudad de Buenos Aires')
+    parser.add_argument('--explicar', action='store_true', help='muestra el plan de ejecución de las consultas y señala los recorridos completos de tablas')
+    parser.add_argument('--verificar-resumenes', action='store_true', help='compara las tablas de resumen de los indicadores con la tabla obra')
+    parser.add_argument('--reconstruir-resumenes', action='store_true', help='recalcula las tablas de resumen de los indicadores desde la tabla obra')
+    parser.add_argument('--en-memoria', action='store_true', help='calcula los indicadores con NumPy sobre la tabla obra cargada en memoria en lugar de consultar la base')
+    parser.add_argument('--verificar-en-memoria', action='store_true', help='compara los indicadores calculados en memoria con los calculados por la base')
+    parser.add_argument('--exportar', metavar='ARCHIVO', help='exporta todas las obras con los valores de sus dimensiones a un archivo CSV o JSON Lines')
+    parser.add_argument('--formato', choices=FORMATOS_EXPORTACION, help='formato de la exportación (por defecto, el de la extensión del archivo)')
+    parser.add_argument('--sin-cache', action='store_true', help='vuelve a leer y limpiar el CSV aunque no haya cambiado desde el último inicio')
+    parser.add_argument('--tiempos', action='store_true', help='muestra cuánto tarda cada etapa del inicio')
+    parser.add_argument('--ingerir', nargs='+', metavar='ARCHIVO', help='lee, limpia y sincroniza en paralelo varios archivos con el formato del observatorio, en el orden indicado')
+    parser.add_argument('--procesos', type=int, help='cantidad de procesos que limpian archivos en paralelo (por defecto, uno por núcleo)')
+    parser.add_argument('--transicion', choices=TRANSICIONES.keys(), help='aplica una operación del ciclo de vida a todas las obras del archivo indicado con --archivo')
+    parser.add_argument('--archivo', help='archivo CSV separado por ";" con la clave de cada obra y los parámetros de la operación')
+    parser.add_argument('--clave', choices=CLAVES_OBRA.keys(), default='id_dataset', help='columna del archivo que identifica a cada obra')
+    parser.add_argument('--perfil', nargs='?', const='-', metavar='ARCHIVO.json', help='mide cada consulta SQL y cada etapa de la carga y los indicadores, y muestra el informe al terminar (o lo guarda en el archivo JSON indicado)')
+    parser.add_argument('--estado-en', metavar='FECHA', type=datetime.datetime.fromisoformat, help='muestra cuántas obras había en cada etapa en la fecha indicada (AAAA-MM-DD), según el historial')
+    parser.add_argument('--estancadas', metavar='MESES', type=int, help='lista las obras sin terminar cuyo avance no cambió en los últimos MESES meses')
+    parser.add_argument('--atrasos', nargs='?', const=datetime.date.today(), metavar='FECHA', type=datetime.date.fromisoformat, help='muestra los atrasos de las obras a la fecha indicada (AAAA-MM-DD, por defecto hoy) en total y por comuna, tipo de obra y empresa')
+    parser.add_argument('--tomar-foto', action='store_true', help='guarda una foto del estado actual de todas las obras en el historial')
+    parser.add_argument('--buscar', metavar='TEXTO', help='busca obras por las palabras de su nombre, descripción, entorno, dirección o barrio')
+    parser.add_argument('--etapa', help='con --buscar, solo las obras en esta etapa')
+    parser.add_argument('--comuna', type=int, help='con --buscar, solo las obras de esta comuna')
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+    if args.perfil:
+        perfil_obras.activar(args.perfil)
+
+    # Una sola conexion para todo el proceso: los metodos de GestionarObra la reutilizan en lugar de abrir y cerrar la suya
+    GestionarObra().conectar_db()
     GestionarObra().mapear_orm()
+
+    if args.explicar:
+        GestionarObra().explicar_consultas()
+        exit()
+
+    if args.estado_en:
+        GestionarObra().mostrar_obras_en_fecha(args.estado_en)
+        exit()
+
+    if args.estancadas is not None:
+        GestionarObra().mostrar_obras_estancadas(args.estancadas)
+        exit()
+
+    if args.atrasos:
+        GestionarObra().mostrar_atrasos(args.atrasos)
+        exit()
+
+    if args.tomar_foto:
+        GestionarObra().tomar_foto()
+        exit()
+
+    if args.buscar:
+        GestionarObra().mostrar_busqueda(args.buscar, args.etapa, args.comuna)
+        exit()
+
+    if args.exportar:
+        GestionarObra().exportar_obras(args.exportar, formato=args.formato)
+        exit()
+
+    if args.ingerir:
+        GestionarObra().ingerir_archivos(args.ingerir, args.procesos)
+        exit()
+
+    if args.transicion:
+        if not args.archivo:
+            parser.error('--transicion requiere --archivo')
+        GestionarObra().aplicar_transiciones_desde_archivo(args.transicion, args.archivo, args.clave)
+        exit()
+
+    if args.verificar_en_memoria:
+        GestionarObra().verificar_indicadores_en_memoria()
+        exit()
+
+    if args.reconstruir_resumenes:
+        GestionarObra().reconstruir_resumenes()
+    if args.verificar_resumenes:
+        GestionarObra().verificar_resumenes()
+    if args.reconstruir_resumenes or args.verificar_resumenes:
+        exit()
+
     #GestionarObra().limpiar_datos()
-    GestionarObra().cargar_datos()
-    GestionarObra().conectar_db()
+    esquema = time.perf_counter() - inicio
+    sincronizacion = GestionarObra().sincronizar_en_bloques(cache=not args.sin_cache)
+
+    if args.tiempos:
+        print(f"\nInicio {'con' if sincronizacion['cache'] else 'sin'} cache en {time.perf_counter() - inicio:.2f} segundos:")
+        print(f'-conexion y esquema: {esquema:.2f} s')
+        print(f"-lectura y limpieza del dataset: {sincronizacion['limpieza']:.2f} s")
+        print(f"-sincronizacion con la base: {sincronizacion['sincronizacion']:.2f} s")
     
     while True:
         respuesta = input('\nDesea crear una nueva instancia de obra? (SI/NO): ')
@@ -272,4 +2129,5 @@ if __name__ == '__main__':
             print('La respuesta no es valida.\nIngresar la respuesta nuevamente')
     
     print('\nAquí estan los datos solicitados:')
-    GestionarObra().obtener_indicadores()
\ No newline at end of file
+    GestionarObra().obtener_indicadores(args.en_memoria)
+    sqlite_db.close()
\ No newline at end of file
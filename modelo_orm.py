@@ -1,12 +1,154 @@
 from peewee import *
-
-sqlite_db = SqliteDatabase('./obras_urbanas.db', pragmas={'journal_mode': 'wal'})
+from peewee import ForeignKeyAccessor
+import bisect
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+import datetime
+import heapq
+from itertools import chain
+import re
+import sys
+import threading
+import unicodedata
+
+# Pragmas que se aplican a cada conexion nueva; se pueden ajustar con configurar_db
+PRAGMAS = {
+    'journal_mode': 'wal',
+    # Con WAL, 'normal' solo sincroniza en los checkpoints y sigue siendo seguro ante caidas del proceso
+    'synchronous': 'normal',
+    # Valores negativos son KiB: 64 MB de cache de paginas
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# Peewee guarda la conexion en una variable local de cada hilo, asi los lectores concurrentes usan conexiones separadas
+sqlite_db = SqliteDatabase('./obras_urbanas.db', pragmas=PRAGMAS)
+
+def configurar_db(ruta=None, solo_lectura=False, **pragmas):
+    # Cambia la ruta de la base y/o los pragmas de las conexiones que se abran a partir de ahora.
+    # Con solo_lectura las conexiones se abren en modo 'ro': la base ya tiene que estar en modo WAL y los lectores no bloquean a quien escribe
+    PRAGMAS.update(pragmas)
+    if not sqlite_db.is_closed():
+        sqlite_db.close()
+    ruta = ruta or sqlite_db.database
+
+    if solo_lectura:
+        lectura = {pragma: valor for pragma, valor in PRAGMAS.items() if pragma not in ('journal_mode', 'synchronous')}
+        sqlite_db.init(f'file:{ruta}?mode=ro', pragmas={**lectura, 'query_only': 1}, uri=True)
+    else:
+        sqlite_db.init(ruta, pragmas=PRAGMAS)
+    # Las caches de dimensiones son de la base anterior
+    invalidar_dimensiones()
+
+@contextmanager
+def sesion():
+    # Reutiliza la conexion del hilo si ya esta abierta; solo la cierra al salir si la abrio esta sesion
+    abrio = sqlite_db.connect(reuse_if_open=True)
+    try:
+        yield sqlite_db
+    finally:
+        if abrio:
+            sqlite_db.close()
 
 class BaseModel(Model):
     class Meta:
         database = sqlite_db
 
-class Etapa(BaseModel):
+# Cache de las tablas de dimension compartida por todo el proceso: cada tabla se lee completa la primera vez que se usa y despues los valores
+# se buscan en memoria, por id o por valor. Si un valor no esta (otro proceso lo inserto despues de la carga) se lee de la base y se agrega.
+# Las instancias son compartidas y de solo lectura; los textos se internan, asi cada valor repetido ocupa memoria una sola vez
+_cache_dimensiones = {}
+aciertos_dimensiones = Counter()
+fallos_dimensiones = Counter()
+_bloqueo_dimensiones = threading.Lock()
+
+def _campo_valor(modelo):
+    # Campo con el valor de la dimension: el primero que no es la clave primaria ni una clave foranea
+    return next(campo for campo in modelo._meta.sorted_fields if not campo.primary_key and not isinstance(campo, ForeignKeyField))
+
+def _internar(instancia):
+    for nombre, valor in instancia.__data__.items():
+        if isinstance(valor, str):
+            instancia.__data__[nombre] = sys.intern(valor)
+    return instancia
+
+def _tabla_dimension(modelo):
+    # Mapas id -> instancia y valor guardado en la base -> instancia de la tabla, cargados la primera vez que se piden
+    tabla = _cache_dimensiones.get(modelo)
+    if tabla is None:
+        with _bloqueo_dimensiones:
+            tabla = _cache_dimensiones.get(modelo)
+            if tabla is None:
+                fallos_dimensiones[modelo._meta.table_name] += 1
+                campo = _campo_valor(modelo)
+                instancias = [_internar(instancia) for instancia in modelo.select()]
+                tabla = _cache_dimensiones[modelo] = ({instancia.id: instancia for instancia in instancias}, {campo.db_value(getattr(instancia, campo.name)): instancia for instancia in instancias})
+    return tabla
+
+def _agregar_dimension(modelo, instancia):
+    por_id, por_valor = _tabla_dimension(modelo)
+    _internar(instancia)
+    campo = _campo_valor(modelo)
+    valor = campo.db_value(getattr(instancia, campo.name))
+    # Los dos mapas se actualizan juntos con el bloqueo, asi otro hilo nunca ve la instancia en uno solo de ellos
+    with _bloqueo_dimensiones:
+        por_id[instancia.id] = instancia
+        por_valor[valor] = instancia
+    return instancia
+
+def dimension_por_id(modelo, id):
+    # Como modelo.get_by_id(id) pero sin consultar la base si la tabla ya esta en la cache
+    instancia = _tabla_dimension(modelo)[0].get(id)
+    if instancia is not None:
+        aciertos_dimensiones[modelo._meta.table_name] += 1
+        return instancia
+    fallos_dimensiones[modelo._meta.table_name] += 1
+    return _agregar_dimension(modelo, modelo.get_by_id(id))
+
+def dimension(campo, valor):
+    # Como campo.model.get(campo == valor) con el campo del valor de una tabla de dimension; lanza DoesNotExist si el valor no existe.
+    # Los valores se comparan convertidos como se guardan en la base (un NaN de pandas en un CharField es 'nan', igual que en la consulta)
+    modelo = campo.model
+    instancia = _tabla_dimension(modelo)[1].get(campo.db_value(valor))
+    if instancia is not None:
+        aciertos_dimensiones[modelo._meta.table_name] += 1
+        return instancia
+    fallos_dimensiones[modelo._meta.table_name] += 1
+    return _agregar_dimension(modelo, modelo.get(campo == valor))
+
+def invalidar_dimensiones(modelo=None):
+    # Descarta la cache de una tabla de dimension (o de todas); la proxima busqueda la vuelve a leer completa
+    with _bloqueo_dimensiones:
+        if modelo is None:
+            _cache_dimensiones.clear()
+        else:
+            _cache_dimensiones.pop(modelo, None)
+
+def estadisticas_dimensiones():
+    # Busquedas resueltas en memoria (aciertos) y que consultaron la base (fallos, contando la carga de cada tabla) por tabla de dimension
+    tablas = sorted(aciertos_dimensiones.keys() | fallos_dimensiones.keys())
+    return {tabla: {'aciertos': aciertos_dimensiones[tabla], 'fallos': fallos_dimensiones[tabla]} for tabla in tablas}
+
+class AccesoDimension(ForeignKeyAccessor):
+    # Al leer obra.etapa, obra.barrio, etc. la instancia relacionada sale de la cache de dimensiones en lugar de una consulta por acceso
+    def get_rel_instance(self, instance):
+        valor = instance.__data__.get(self.name)
+        if valor is not None and self.name not in instance.__rel__:
+            instance.__rel__[self.name] = dimension_por_id(self.rel_model, valor)
+        return super().get_rel_instance(instance)
+
+class ClaveDimension(ForeignKeyField):
+    accessor_class = AccesoDimension
+
+class BaseDimension(BaseModel):
+    # Tabla de dimension: guardar una fila descarta la cache de su tabla
+    def save(self, *args, **kwargs):
+        filas = super().save(*args, **kwargs)
+        invalidar_dimensiones(type(self))
+        return filas
+
+class Etapa(BaseDimension):
     estado = CharField(max_length=25, unique=True)
 
     def __str__(self):
@@ -15,7 +157,7 @@ class Etapa(BaseModel):
     class Meta:
         db_table = 'etapa'
 
-class TipoObra(BaseModel):
+class TipoObra(BaseDimension):
     tipo = CharField(max_length=40, unique=True)
 
     def __str__(self):
@@ -24,7 +166,7 @@ class TipoObra(BaseModel):
     class Meta:
         db_table = 'tipo_obra'
 
-class AreaResponsable(BaseModel):
+class AreaResponsable(BaseDimension):
     area = CharField(max_length=60, unique=True)
 
     def __str__(self):
@@ -33,7 +175,7 @@ class AreaResponsable(BaseModel):
     class Meta:
         db_table = 'area_responsable'
 
-class Comuna(BaseModel):
+class Comuna(BaseDimension):
     numero = IntegerField(unique=True)
 
     def __str__(self):
@@ -42,9 +184,9 @@ class Comuna(BaseModel):
     class Meta:
         db_table = 'comuna'
 
-class Barrio(BaseModel):
+class Barrio(BaseDimension):
     nombre = CharField(max_length=25, unique=True)
-    comuna = ForeignKeyField(Comuna, backref='comuna')
+    comuna = ClaveDimension(Comuna, backref='comuna')
 
     def __str__(self):
         return f'{self.nombre}\n{self.comuna.numero}'
@@ -52,7 +194,7 @@ class Barrio(BaseModel):
     class Meta:
         db_table = 'barrio'
 
-class Empresa(BaseModel):
+class Empresa(BaseDimension):
     nombre = CharField(max_length=80, unique=True)
 
     def __str__(self):
@@ -61,7 +203,7 @@ class Empresa(BaseModel):
     class Meta:
         db_table = 'empresa'
 
-class TipoContratacion(BaseModel):
+class TipoContratacion(BaseDimension):
     tipo = CharField(max_length=40, unique=True)
 
     def __str__(self):
@@ -70,7 +212,7 @@ class TipoContratacion(BaseModel):
     class Meta:
         db_table = 'tipo_contratacion'
 
-class FuenteFinanciamiento(BaseModel):
+class FuenteFinanciamiento(BaseDimension):
     fuente = CharField(max_length=30, unique=True, null=True)
 
     def __str__(self):
@@ -90,23 +232,56 @@ class Obra(BaseModel):
     mano_obra = IntegerField(null=True)
     destacada = CharField(max_length=2, null=True)
     nro_expediente = CharField(max_length=50, null=True)
-
-    etapa = ForeignKeyField(Etapa, backref='etapa')
-    tipo_obra = ForeignKeyField(TipoObra, backref='tipo_obra')
-    area_responsable = ForeignKeyField(AreaResponsable, backref='area_responsable')
-    comuna = ForeignKeyField(Comuna, backref='comuna')
-    barrio = ForeignKeyField(Barrio, backref='barrio', null=True)
-    empresa = ForeignKeyField(Empresa, backref='empresa', null=True)
-    tipo_contratacion = ForeignKeyField(TipoContratacion, backref='tipo_contratacion', null=True)
-    fuente_financiamiento = ForeignKeyField(FuenteFinanciamiento, backref='fuente_financiamiento', null=True)
+    # Identificador de la obra en el dataset y hash de las columnas que se sincronizan en cada recarga
+    id_dataset = IntegerField(null=True, unique=True)
+    hash_contenido = CharField(max_length=16, null=True)
+    # Ubicacion de la obra; el indice espacial obra_ubicacion se mantiene con triggers a partir de estas columnas
+    latitud = FloatField(null=True)
+    longitud = FloatField(null=True)
+    direccion = CharField(max_length=200, null=True)
+    # Textos de la obra; junto con el nombre, la direccion y el barrio se indexan en la busqueda de texto obra_texto
+    entorno = CharField(max_length=100, null=True)
+    descripcion = TextField(null=True)
+
+    etapa = ClaveDimension(Etapa, backref='etapa')
+    tipo_obra = ClaveDimension(TipoObra, backref='tipo_obra')
+    area_responsable = ClaveDimension(AreaResponsable, backref='area_responsable')
+    comuna = ClaveDimension(Comuna, backref='comuna')
+    barrio = ClaveDimension(Barrio, backref='barrio', null=True)
+    empresa = ClaveDimension(Empresa, backref='empresa', null=True)
+    tipo_contratacion = ClaveDimension(TipoContratacion, backref='tipo_contratacion', null=True)
+    fuente_financiamiento = ClaveDimension(FuenteFinanciamiento, backref='fuente_financiamiento', null=True)
 
     def __str__(self):
         return f'{self.nombre}\n{self.etapa.estado}\n{self.tipo_obra.tipo}\n{self.area_responsable.area}\n{self.monto_contrato}\n{self.comuna.numero}\n{self.barrio.nombre}\n{self.fecha_inicio}\n{self.fecha_fin_inicial}\n{self.plazo_meses}\n{self.porcentaje_avance}\n{self.empresa.nombre}\n{self.tipo_contratacion.tipo}\n{self.nro_contratacion}\n{self.mano_obra}\n{self.destacada}\n{self.nro_expediente}\n{self.monto_contrato}\n{self.fuente_financiamiento.fuente}'
         
     class Meta:
         db_table = 'obra'
+        # Indices para los filtros de los indicadores y del ciclo de vida (los de las claves foraneas los crea peewee)
+        indexes = (
+            (('etapa', 'comuna'), False),
+            (('tipo_obra', 'monto_contrato'), False),
+            (('plazo_meses',), False),
+        )
 
     # Metodos de clase
+    def consultas_ciclo_vida():
+        # Consultas que ejecutan los metodos del ciclo de vida de una obra, para poder revisar su plan de ejecucion
+        proyecto = Etapa.select(Etapa.id).where(Etapa.estado == 'Proyecto')
+
+        return {
+            'etapa': Etapa.select().where(Etapa.estado == 'Proyecto').limit(1),
+            'obra_en_proyecto': Obra.select().where(Obra.etapa == proyecto).limit(1),
+            'tipo_obra': TipoObra.select().where(TipoObra.tipo == '').limit(1),
+            'area_responsable': AreaResponsable.select().where(AreaResponsable.area == '').limit(1),
+            'barrio': Barrio.select().where(Barrio.nombre == '').limit(1),
+            'comuna': Comuna.select().where(Comuna.numero == 0).limit(1),
+            'tipo_contratacion': TipoContratacion.select().where(TipoContratacion.tipo == '').limit(1),
+            'empresa': Empresa.select().where(Empresa.nombre == '').limit(1),
+            'fuente_financiamiento': FuenteFinanciamiento.select().where(FuenteFinanciamiento.fuente == '').limit(1),
+            'guardar_obra': Obra.update(porcentaje_avance=0).where(Obra.id == 0),
+        }
+
     def nuevo_proyecto():
         try:
             etapa, _ = Etapa.get_or_create(estado="Proyecto")
@@ -115,38 +290,17 @@ class Obra(BaseModel):
 
         nombreProyecto = input('Ingresar el nombre de obra que se va realizar: ')
         
-        while True:
-            tipo_obra = input('Ingresar el tipo de obra que se va realizar: ')
-
-            try:
-                tipoObra = TipoObra.get(TipoObra.tipo == tipo_obra)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({tipo_obra}) no existe en la base de datos\nPor favor ingrese un valor existente')
-
-        while True:
-            area_responsable = input('Ingresar el area responsable de la obra: ')
+        tipoObra = pedir_valor(TipoObra.tipo, 'Ingresar el tipo de obra que se va realizar: ')
 
-            try:
-                areaResponsable = AreaResponsable.get(AreaResponsable.area == area_responsable)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({area_responsable}) no existe en la base de datos\nPor favor ingrese un valor existente')
-
-        while True:
-            barrio = input('Ingresar el barrio en el que se realizará la obra: ')
+        areaResponsable = pedir_valor(AreaResponsable.area, 'Ingresar el area responsable de la obra: ')
 
-            try:
-                bar = Barrio.get(Barrio.nombre == barrio)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({barrio}) no existe en la base de datos\nPor favor ingrese un valor existente')
+        bar = pedir_valor(Barrio.nombre, 'Ingresar el barrio en el que se realizará la obra: ')
 
         while True:
             comuna = int(input('Ingresar la comuna en la que se realizará la obra: '))
 
             try:
-                com = Comuna.get(Comuna.numero == comuna)
+                com = dimension(Comuna.numero, comuna)
                 break
             except DoesNotExist as e:
                 print(f'El valor ingresado ({comuna}) no existe en la base de datos\nPor favor ingrese un valor existente')
@@ -178,16 +332,9 @@ class Obra(BaseModel):
             print(f'No se pudo cargar el pryecto: {e}')
         
     def iniciar_contratacion():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
-
-        while True:
-            tipo_contratacion = input('Ingresar el tipo de contratación: ')
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
-            try:
-                tipoContratacion = TipoContratacion.get(TipoContratacion.tipo == tipo_contratacion)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({tipo_contratacion}) no existe en la base de datos\nPor favor ingrese un valor existente')
+        tipoContratacion = pedir_valor(TipoContratacion.tipo, 'Ingresar el tipo de contratación: ')
 
         nro_contratacion = input('Ingresar el número de contratación: ')
         monto_contrato = float(input('Ingresar el monto del contrato: '))
@@ -197,22 +344,15 @@ class Obra(BaseModel):
         proyecto.monto_contrato = monto_contrato
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
         
     def adjudicar_obra():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
-
-        while True:
-            empresa = input('Ingresar el nombre de la empresa: ')
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
-            try:
-                emp = Empresa.get(Empresa.nombre == empresa)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({empresa}) no existe en la base de datos\nPor favor ingrese un valor existente')
+        emp = pedir_valor(Empresa.nombre, 'Ingresar el nombre de la empresa: ')
 
         nro_expediente = input('Ingresar el número de expediente: ')
 
@@ -220,13 +360,13 @@ class Obra(BaseModel):
         proyecto.nro_expediente = nro_expediente
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
 
     def iniciar_obra():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         while True:
             destacada = input('Indicar si la obra se categoriza como destacada (SI/NO): ')
@@ -238,14 +378,7 @@ class Obra(BaseModel):
         fecha_inicio = input('Indicar la fecha en la que se iniciará la obra: ')
         fecha_fin_inicial = input('Indicar la fecha en la que se estima finalizar la obra: ')
 
-        while True:
-            fuente_financiamiento = input('Ingresar la fuiente de financiamiento: ')
-
-            try:
-                fuente = FuenteFinanciamiento.get(FuenteFinanciamiento.fuente == fuente_financiamiento)
-                break
-            except DoesNotExist as e:
-                print(f'El valor ingresado ({fuente_financiamiento}) no existe en la base de datos\nPor favor ingrese un valor existente')
+        fuente = pedir_valor(FuenteFinanciamiento.fuente, 'Ingresar la fuiente de financiamiento: ')
 
         mano_obra = int(input('Indicar la cantidad de mano de obra: '))
 
@@ -256,66 +389,66 @@ class Obra(BaseModel):
         proyecto.mano_obra = mano_obra
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
 
 
     def actualizar_porcentaje_avance():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         nuevo_avance = int(input('Indicar el porcentaje de avance de la obra: '))
 
         proyecto.porcentaje_avance = nuevo_avance
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
 
 
     def incrementar_plazo():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         plazo_meses = int(input('Indicar la cantidad de meses que lleva la obra en ejecución: '))
 
         proyecto.plazo_meses = plazo_meses
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
 
 
     def incrementar_mano_obra():
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         nueva_mano_obra = int(input('Ingresar cuanta mano de obra se incorporará: '))
 
         proyecto.mano_obra += nueva_mano_obra
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
 
 
     def finalizar_obra():
         
-        etapa = Etapa.get(Etapa.estado == "Finalizada")
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        etapa = dimension(Etapa.estado, "Finalizada")
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         proyecto.porcentaje_avance = 100
         proyecto.etapa = etapa
         
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
+        except DatabaseError as e:
             print(f"Error al actualizar los datos {e}")
         
         
@@ -323,12 +456,428 @@ class Obra(BaseModel):
 
         etapa, _ = Etapa.get_or_create(estado="Rescindida")
 
-        proyecto = Obra.get(Obra.etapa == Etapa.get(Etapa.estado == 'Proyecto'))
+        proyecto = Obra.get(Obra.etapa == dimension(Etapa.estado, 'Proyecto'))
 
         proyecto.etapa = etapa
 
         try:
-            proyecto.save() 
+            guardar_obra(proyecto)
             print("Se ha guardado con éxito")
-        except IntegrityError as e:
-            print(f"Error al actualizar los datos {e}")
\ No newline at end of file
+        except DatabaseError as e:
+            print(f"Error al actualizar los datos {e}")
+
+def guardar_obra(obra, campos=None):
+    # Reemplazo de obra.save() para una obra existente: escribe solo los campos modificados (o los indicados) en la conexion de quien llama,
+    # dentro de su transaccion si tiene una abierta, y devuelve las filas actualizadas
+    campos = campos or obra.dirty_fields
+    if not campos:
+        return 0
+    # save quita de los campos modificados los que guardo
+    return obra.save(only=campos)
+
+# Lectura liviana de la tabla obra para reportes y exportaciones: cada fila es una tupla con nombre (sin __dict__, solo los punteros a los
+# valores) armada directamente de la tupla del cursor, en lugar de una instancia de Obra con su __data__, __rel__ y el seguimiento de cambios.
+# Las columnas son las de la tabla (las claves foraneas con su id: etapa_id, barrio_id, ...) y cada dimension se lee por su nombre (registro.etapa)
+# desde la cache compartida de dimensiones
+class RegistroObra(namedtuple('RegistroObra', [campo.column_name for campo in Obra._meta.sorted_fields])):
+    __slots__ = ()
+
+def _propiedad_dimension(campo):
+    def valor(registro):
+        id = getattr(registro, campo.column_name)
+        return None if id is None else dimension_por_id(campo.rel_model, id)
+    return property(valor)
+
+for campo in Obra._meta.sorted_fields:
+    if isinstance(campo, ForeignKeyField):
+        setattr(RegistroObra, campo.name, _propiedad_dimension(campo))
+
+def registros_obra(*condiciones):
+    # Recorre las obras (filtradas por las condiciones) como RegistroObra, leyendo las filas directo del cursor. La afinidad de las columnas
+    # ya devuelve int, float y str como los python_value de peewee, que en .tuples() se aplican a cada columna de cada fila y son la mayor
+    # parte del tiempo del recorrido: solo se convierten las fechas, que SQLite guarda como texto. La memoria depende solo de lo que retenga
+    # quien recorre, el cursor no acumula las filas ya leidas
+    campos = Obra._meta.sorted_fields
+    fechas = [(posicion, campo.python_value) for posicion, campo in enumerate(campos) if isinstance(campo, (DateField, DateTimeField))]
+    consulta = Obra.select(*campos)
+    if condiciones:
+        consulta = consulta.where(*condiciones)
+
+    crear = RegistroObra._make
+    for fila in sqlite_db.execute_sql(*consulta.sql()):
+        if fechas:
+            fila = list(fila)
+            for posicion, convertir in fechas:
+                fila[posicion] = convertir(fila[posicion])
+        yield crear(fila)
+
+# Tablas de resumen de los indicadores: los triggers sobre la tabla obra las mantienen actualizadas en cada alta, modificacion o baja
+class ResumenBase(BaseModel):
+    cantidad = IntegerField(default=0)
+    # Se cuentan los valores no nulos para poder devolver NULL como SUM cuando no hay ninguno
+    cantidad_montos = IntegerField(default=0)
+    monto_total = FloatField(default=0)
+    cantidad_mano_obra = IntegerField(default=0)
+    mano_obra_total = IntegerField(default=0)
+    plazo_24_meses = IntegerField(default=0)
+
+class ResumenEtapa(ResumenBase):
+    etapa = ForeignKeyField(Etapa, primary_key=True)
+
+    class Meta:
+        db_table = 'resumen_etapa'
+
+class ResumenTipoObra(ResumenBase):
+    tipo_obra = ForeignKeyField(TipoObra, primary_key=True)
+
+    class Meta:
+        db_table = 'resumen_tipo_obra'
+
+class ResumenEtapaComuna(ResumenBase):
+    etapa = ForeignKeyField(Etapa)
+    comuna = ForeignKeyField(Comuna)
+
+    class Meta:
+        db_table = 'resumen_etapa_comuna'
+        primary_key = CompositeKey('etapa', 'comuna')
+
+class ResumenGeneral(ResumenBase):
+    # Una unica fila con los totales de todas las obras
+    clave = IntegerField(primary_key=True, default=1)
+
+    class Meta:
+        db_table = 'resumen_general'
+
+MODELOS_RESUMEN = [ResumenEtapa, ResumenTipoObra, ResumenEtapaComuna, ResumenGeneral]
+MEDIDAS_RESUMEN = ('cantidad', 'cantidad_montos', 'monto_total', 'cantidad_mano_obra', 'mano_obra_total', 'plazo_24_meses')
+
+def _claves_resumen(modelo):
+    # Columnas que identifican una fila del resumen y la expresion de la tabla obra de la que salen (la fila general usa la constante 1)
+    columnas = [campo.column_name for campo in modelo._meta.get_primary_keys()]
+    return columnas, [columna if columna in Obra._meta.columns else '1' for columna in columnas]
+
+def _sql_sumar_resumen(modelo, fila, signo):
+    # Suma (o resta, con signo '-') una fila de la tabla obra (NEW u OLD) al resumen
+    columnas, origen = _claves_resumen(modelo)
+    claves = ', '.join(columnas)
+    valores = [f'{fila}.{expresion}' if expresion != '1' else '1' for expresion in origen]
+    valores += [
+        f'{signo}1',
+        f'{signo}({fila}.monto_contrato IS NOT NULL)',
+        f'{signo}COALESCE({fila}.monto_contrato, 0)',
+        f'{signo}({fila}.mano_obra IS NOT NULL)',
+        f'{signo}COALESCE({fila}.mano_obra, 0)',
+        f'{signo}COALESCE({fila}.plazo_meses <= 24, 0)',
+    ]
+    actualizar = ', '.join(f'{medida} = {medida} + excluded.{medida}' for medida in MEDIDAS_RESUMEN)
+
+    return f'INSERT INTO {modelo._meta.table_name} ({claves}, {", ".join(MEDIDAS_RESUMEN)}) VALUES ({", ".join(valores)}) ON CONFLICT ({claves}) DO UPDATE SET {actualizar};'
+
+def sql_triggers_resumen():
+    # Triggers que mantienen las tablas de resumen; el de UPDATE solo se dispara si cambia alguna columna que interviene en los indicadores
+    eventos = (
+        ('insert', 'INSERT', (('NEW', ''),)),
+        ('update', 'UPDATE OF etapa_id, tipo_obra_id, comuna_id, monto_contrato, mano_obra, plazo_meses', (('OLD', '-'), ('NEW', ''))),
+        ('delete', 'DELETE', (('OLD', '-'),)),
+    )
+    sentencias = []
+
+    for nombre, evento, filas in eventos:
+        cuerpo = ' '.join(_sql_sumar_resumen(modelo, fila, signo) for fila, signo in filas for modelo in MODELOS_RESUMEN)
+        sentencias.append(f'CREATE TRIGGER IF NOT EXISTS obra_resumen_{nombre} AFTER {evento} ON obra BEGIN {cuerpo} END')
+
+    return sentencias
+
+def sql_agregar_resumen(modelo):
+    # Consulta que calcula el resumen completo desde la tabla obra, se usa para reconstruirlo y para verificarlo
+    columnas, origen = _claves_resumen(modelo)
+    agrupar = [expresion for expresion in origen if expresion != '1']
+    medidas = 'COUNT(*), COUNT(monto_contrato), COALESCE(SUM(monto_contrato), 0), COUNT(mano_obra), COALESCE(SUM(mano_obra), 0), COALESCE(SUM(plazo_meses <= 24), 0)'
+
+    return f'SELECT {", ".join(origen)}, {medidas} FROM obra' + (f' GROUP BY {", ".join(agrupar)}' if agrupar else '')
+
+# Indice espacial de las obras con coordenadas: tabla virtual R*Tree con el rectangulo (degenerado en un punto) de cada obra.
+# No se crea con create_tables sino con sql_indice_espacial; el modelo solo se usa para consultarla
+class UbicacionObra(BaseModel):
+    id = IntegerField(primary_key=True)
+    min_lat = FloatField()
+    max_lat = FloatField()
+    min_lng = FloatField()
+    max_lng = FloatField()
+
+    class Meta:
+        db_table = 'obra_ubicacion'
+
+def sql_indice_espacial():
+    # Tabla virtual y triggers que agregan, mueven o quitan cada obra del indice cuando cambian sus coordenadas
+    punto = 'NEW.id, NEW.latitud, NEW.latitud, NEW.longitud, NEW.longitud'
+    con_coordenadas = 'NEW.latitud IS NOT NULL AND NEW.longitud IS NOT NULL'
+
+    return [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS obra_ubicacion USING rtree(id, min_lat, max_lat, min_lng, max_lng)',
+        f'CREATE TRIGGER IF NOT EXISTS obra_ubicacion_insert AFTER INSERT ON obra WHEN {con_coordenadas} BEGIN INSERT INTO obra_ubicacion VALUES ({punto}); END',
+        f'CREATE TRIGGER IF NOT EXISTS obra_ubicacion_update AFTER UPDATE OF latitud, longitud ON obra BEGIN DELETE FROM obra_ubicacion WHERE id = OLD.id; INSERT INTO obra_ubicacion SELECT {punto} WHERE {con_coordenadas}; END',
+        'CREATE TRIGGER IF NOT EXISTS obra_ubicacion_delete AFTER DELETE ON obra BEGIN DELETE FROM obra_ubicacion WHERE id = OLD.id; END',
+    ]
+
+def sql_cargar_indice_espacial(desde_id=0):
+    # Carga en el indice las obras con coordenadas (todas, o las de id mayor que desde_id), para cuando la tabla virtual se crea sobre una
+    # base que ya tenia obras o despues de una carga masiva sin triggers
+    return f'INSERT OR REPLACE INTO obra_ubicacion SELECT id, latitud, latitud, longitud, longitud FROM obra WHERE latitud IS NOT NULL AND longitud IS NOT NULL AND id > {int(desde_id)}'
+
+# Indice de texto completo de las obras: tabla virtual FTS5 con los textos de cada obra y el nombre de su barrio, sin distinguir mayusculas ni acentos.
+# Como el indice espacial, se crea con sql_indice_texto y el modelo solo se usa para consultarla; el rowid de cada fila es el id de la obra
+class TextoObra(BaseModel):
+    rowid = IntegerField(primary_key=True)
+    nombre = TextField()
+    descripcion = TextField()
+    entorno = TextField()
+    direccion = TextField()
+    barrio = TextField()
+
+    class Meta:
+        db_table = 'obra_texto'
+
+def sql_indice_texto():
+    # Tabla virtual y triggers que vuelven a indexar cada obra cuando cambia alguno de sus textos o su barrio
+    textos = 'NEW.id, NEW.nombre, NEW.descripcion, NEW.entorno, NEW.direccion, (SELECT nombre FROM barrio WHERE id = NEW.barrio_id)'
+    insertar = f'INSERT INTO obra_texto (rowid, nombre, descripcion, entorno, direccion, barrio) VALUES ({textos});'
+
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS obra_texto USING fts5(nombre, descripcion, entorno, direccion, barrio, tokenize = 'unicode61 remove_diacritics 2')",
+        f'CREATE TRIGGER IF NOT EXISTS obra_texto_insert AFTER INSERT ON obra BEGIN {insertar} END',
+        f'CREATE TRIGGER IF NOT EXISTS obra_texto_update AFTER UPDATE OF nombre, descripcion, entorno, direccion, barrio_id ON obra BEGIN DELETE FROM obra_texto WHERE rowid = OLD.id; {insertar} END',
+        'CREATE TRIGGER IF NOT EXISTS obra_texto_delete AFTER DELETE ON obra BEGIN DELETE FROM obra_texto WHERE rowid = OLD.id; END',
+    ]
+
+def sql_cargar_indice_texto(desde_id=0):
+    # Indexa todas las obras (o las de id mayor que desde_id), para cuando la tabla virtual se crea sobre una base que ya tenia obras
+    # o despues de una carga masiva sin triggers
+    return ('INSERT INTO obra_texto (rowid, nombre, descripcion, entorno, direccion, barrio) '
+            'SELECT obra.id, obra.nombre, obra.descripcion, obra.entorno, obra.direccion, barrio.nombre FROM obra LEFT JOIN barrio ON barrio.id = obra.barrio_id '
+            f'WHERE obra.id > {int(desde_id)}')
+
+# Formato de las fechas del historial, con microsegundos siempre presentes: los triggers y los parametros de las consultas escriben las fechas
+# igual, asi se comparan bien como texto (sqlite3 omite los microsegundos de un datetime cuando son cero)
+FORMATO_FECHA_HISTORIAL = '%Y-%m-%d %H:%M:%S.%f'
+
+class FechaHistorial(DateTimeField):
+    def db_value(self, value):
+        if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        if isinstance(value, datetime.datetime):
+            return value.strftime(FORMATO_FECHA_HISTORIAL)
+        return super().db_value(value)
+
+# Historial de las obras: cada alta y cada cambio de etapa, avance, plazo o mano de obra agrega un evento con el estado completo de la obra.
+# Los eventos los escriben triggers dentro de la misma transaccion que el cambio (una carga o un lote de operaciones se escribe de una vez) y nunca se modifican
+class EventoObra(BaseModel):
+    # Los indices compuestos ya cubren las busquedas por obra, no hace falta el de la clave foranea
+    obra = ForeignKeyField(Obra, backref='eventos', index=False)
+    fecha = FechaHistorial()
+    etapa = ForeignKeyField(Etapa, index=False)
+    porcentaje_avance = IntegerField(null=True)
+    plazo_meses = FloatField(null=True)
+    mano_obra = IntegerField(null=True)
+
+    class Meta:
+        db_table = 'evento_obra'
+        indexes = (
+            (('obra', 'fecha'), False),
+            (('fecha',), False),
+        )
+
+# Fotos periodicas del estado de todas las obras: el estado en una fecha se arma con la ultima foto anterior y solo los eventos posteriores a ella
+class FotoObra(BaseModel):
+    fecha = FechaHistorial()
+    obra = ForeignKeyField(Obra, index=False)
+    etapa = ForeignKeyField(Etapa, index=False)
+    porcentaje_avance = IntegerField(null=True)
+    plazo_meses = FloatField(null=True)
+    mano_obra = IntegerField(null=True)
+
+    class Meta:
+        db_table = 'foto_obra'
+        primary_key = CompositeKey('fecha', 'obra')
+
+MODELOS_HISTORIAL = [EventoObra, FotoObra]
+
+# Fecha y hora actual en FORMATO_FECHA_HISTORIAL: SQLite da solo milisegundos (%f es SS.SSS), se completan con ceros los microsegundos
+FECHA_ACTUAL = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000'"
+
+def sql_triggers_historial():
+    # Un evento al crear cada obra y otro cada vez que cambia alguno de los campos del historial
+    insertar = f'INSERT INTO evento_obra (obra_id, fecha, etapa_id, porcentaje_avance, plazo_meses, mano_obra) VALUES (NEW.id, {FECHA_ACTUAL}, NEW.etapa_id, NEW.porcentaje_avance, NEW.plazo_meses, NEW.mano_obra);'
+    cambio = ' OR '.join(f'OLD.{campo} IS NOT NEW.{campo}' for campo in ('etapa_id', 'porcentaje_avance', 'plazo_meses', 'mano_obra'))
+
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS obra_historial_insert AFTER INSERT ON obra BEGIN {insertar} END',
+        f'CREATE TRIGGER IF NOT EXISTS obra_historial_update AFTER UPDATE OF etapa_id, porcentaje_avance, plazo_meses, mano_obra ON obra WHEN {cambio} BEGIN {insertar} END',
+    ]
+
+def sql_cargar_historial(desde_id=0):
+    # El evento de alta de cada obra de id mayor que desde_id, el mismo que escribe obra_historial_insert, para despues de una carga masiva sin triggers
+    return f'INSERT INTO evento_obra (obra_id, fecha, etapa_id, porcentaje_avance, plazo_meses, mano_obra) SELECT id, {FECHA_ACTUAL}, etapa_id, porcentaje_avance, plazo_meses, mano_obra FROM obra WHERE id > {int(desde_id)}'
+
+def sql_migrar_fechas_historial(modelo):
+    # Las fechas que guardaron los triggers anteriores tienen milisegundos (23 caracteres): se completan al formato actual
+    return f"UPDATE {modelo._meta.table_name} SET fecha = fecha || '000' WHERE length(fecha) = 23"
+
+def sql_tomar_foto():
+    # Todas las filas de una foto tienen la misma fecha: SQLite evalua 'now' una sola vez por sentencia
+    return f'INSERT INTO foto_obra (fecha, obra_id, etapa_id, porcentaje_avance, plazo_meses, mano_obra) SELECT {FECHA_ACTUAL}, id, etapa_id, porcentaje_avance, plazo_meses, mano_obra FROM obra'
+
+# Contador de cambios de la tabla obra: los triggers lo incrementan en cada alta, baja o modificacion de las columnas que usan los analisis
+# de atrasos, asi un resultado calculado se reutiliza mientras el contador no cambie, sin importar desde que conexion o proceso se escribio
+class VersionObra(BaseModel):
+    clave = IntegerField(primary_key=True, default=1)
+    version = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'version_obra'
+
+COLUMNAS_VERSION = ('etapa_id', 'tipo_obra_id', 'comuna_id', 'empresa_id', 'fecha_inicio', 'fecha_fin_inicial', 'plazo_meses', 'porcentaje_avance', 'monto_contrato')
+
+def sql_triggers_version():
+    incrementar = f'{sql_incrementar_version()};'
+
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS obra_version_insert AFTER INSERT ON obra BEGIN {incrementar} END',
+        f'CREATE TRIGGER IF NOT EXISTS obra_version_update AFTER UPDATE OF {", ".join(COLUMNAS_VERSION)} ON obra BEGIN {incrementar} END',
+        f'CREATE TRIGGER IF NOT EXISTS obra_version_delete AFTER DELETE ON obra BEGIN {incrementar} END',
+    ]
+
+def sql_incrementar_version():
+    return 'INSERT INTO version_obra (clave, version) VALUES (1, 1) ON CONFLICT (clave) DO UPDATE SET version = version + 1'
+
+def sql_triggers_obra():
+    # Todos los triggers de la tabla obra, con las tablas virtuales de los indices que mantienen
+    return sql_triggers_resumen() + sql_indice_espacial() + sql_indice_texto() + sql_triggers_historial() + sql_triggers_version()
+
+def version_obra():
+    return VersionObra.select(VersionObra.version).scalar() or 0
+
+# Busqueda aproximada de valores de las tablas de dimension: sin distinguir mayusculas ni acentos, por prefijo y por trigramas
+# Puntaje minimo para aceptar una sugerencia sin preguntar (en las cargas en lote), para ofrecerla y cantidad de sugerencias que se ofrecen
+SIMILITUD_MINIMA = 0.5
+SIMILITUD_SUGERENCIA = 0.2
+CANTIDAD_SUGERENCIAS = 5
+
+def normalizar_texto(texto):
+    # "Hidráulica E  Infraestructura" -> "hidraulica e infraestructura"
+    texto = unicodedata.normalize('NFKD', str(texto)).casefold()
+    return ' '.join(re.findall(r'[a-z0-9]+', ''.join(c for c in texto if not unicodedata.combining(c))))
+
+def trigramas(texto):
+    # Trigramas de cada palabra con dos espacios al principio y uno al final, asi las palabras cortas y los comienzos pesan mas
+    return {f'  {palabra} '[i:i + 3] for palabra in texto.split() for i in range(len(palabra) + 1)}
+
+class IndiceDimension:
+    # Indice en memoria de los valores de un campo de una tabla de dimension. Se arma con las filas de la cache de dimensiones, sin
+    # consultar la base, y sigue valido mientras la cache de la tabla no cambie
+    def __init__(self, campo):
+        self.campo = campo
+        self.tabla = _tabla_dimension(campo.model)[0]
+        with _bloqueo_dimensiones:
+            instancias = sorted(self.tabla.values(), key=lambda instancia: instancia.id)
+        self.cantidad = len(instancias)
+        filas = [(instancia.id, instancia.__data__.get(campo.name)) for instancia in instancias]
+        filas = [(id, valor) for id, valor in filas if valor is not None]
+        self.ids = [id for id, _ in filas]
+        self.valores = [valor for _, valor in filas]
+        self.normalizados = [normalizar_texto(valor) for valor in self.valores]
+
+        # Valor tal cual -> posiciones (y en exactos, valor normalizado -> posiciones), para resolver las coincidencias exactas sin recorrer la lista
+        self.posiciones = {}
+        for posicion, valor in enumerate(self.valores):
+            self.posiciones.setdefault(valor, []).append(posicion)
+        self.exactos = {}
+        self.trigramas = {}
+        self.cantidad_trigramas = []
+        for posicion, normalizado in enumerate(self.normalizados):
+            self.exactos.setdefault(normalizado, []).append(posicion)
+            propios = trigramas(normalizado)
+            self.cantidad_trigramas.append(len(propios))
+            for trigrama in propios:
+                self.trigramas.setdefault(trigrama, []).append(posicion)
+        # Valor completo y cada una de sus palabras, ordenados para buscar los que empiezan con el texto con bisect
+        self.prefijos = sorted({(palabra, posicion) for posicion, normalizado in enumerate(self.normalizados) for palabra in [normalizado] + normalizado.split()})
+
+    def buscar(self, texto, cantidad=CANTIDAD_SUGERENCIAS, minimo=SIMILITUD_SUGERENCIA):
+        # Devuelve hasta 'cantidad' tuplas (valor, id, puntaje) con al menos 'minimo' de puntaje, de la mas parecida a la menos; puntaje 1 es una coincidencia exacta
+        consulta = normalizar_texto(texto)
+        if not consulta:
+            return []
+        puntajes = {posicion: 1.0 for posicion in self.exactos.get(consulta, [])}
+
+        # Los valores que empiezan con el texto (o tienen una palabra que empieza con el) valen mas cuanto mas del valor cubre el texto
+        desde = bisect.bisect_left(self.prefijos, (consulta,))
+        for palabra, posicion in self.prefijos[desde:]:
+            if not palabra.startswith(consulta):
+                break
+            puntajes[posicion] = max(puntajes.get(posicion, 0), 0.5 + 0.49 * len(consulta) / len(self.normalizados[posicion]))
+
+        # Similitud de Jaccard entre los trigramas del texto y los de cada valor que comparte alguno
+        propios = trigramas(consulta)
+        compartidos = Counter(chain.from_iterable(self.trigramas.get(trigrama, ()) for trigrama in propios))
+        for posicion, cantidad_compartidos in compartidos.items():
+            similitud = cantidad_compartidos / (len(propios) + self.cantidad_trigramas[posicion] - cantidad_compartidos)
+            if similitud > puntajes.get(posicion, 0):
+                puntajes[posicion] = similitud
+
+        mejores = heapq.nlargest(cantidad, ((posicion, puntaje) for posicion, puntaje in puntajes.items() if puntaje >= minimo), key=lambda item: (item[1], -item[0]))
+        return [(self.valores[posicion], self.ids[posicion], puntaje) for posicion, puntaje in mejores]
+
+    def resolver(self, texto, minimo=None):
+        # Devuelve el (id, valor) que corresponde al texto, o None si no hay uno solo. Sin minimo solo se aceptan coincidencias exactas
+        # sin distinguir mayusculas ni acentos; con minimo tambien la sugerencia mas parecida si alcanza ese puntaje y no empata con otra
+        texto = str(texto).strip()
+        candidatos = self.posiciones.get(texto, ())
+        if len(candidatos) == 1:
+            return self.ids[candidatos[0]], texto
+
+        sugerencias = self.buscar(texto, 2)
+        if not sugerencias:
+            return None
+        valor, id, puntaje = sugerencias[0]
+        empate = len(sugerencias) > 1 and sugerencias[1][2] == puntaje
+        if empate or puntaje < (1.0 if minimo is None else minimo):
+            return None
+        return id, valor
+
+    def vigente(self):
+        # La cache de la tabla se descarta (invalidar_dimensiones) cuando se guardan o cargan filas, y crece cuando una busqueda
+        # lee de la base un valor que no tenia: en los dos casos hay que volver a armar el indice
+        tabla = _cache_dimensiones.get(self.campo.model)
+        return tabla is not None and tabla[0] is self.tabla and len(self.tabla) == self.cantidad
+
+_indices_dimension = {}
+
+def indice_dimension(campo):
+    # Indice del campo, armado la primera vez que se usa y de nuevo solo si la cache de su tabla cambio
+    indice = _indices_dimension.get(campo)
+    if indice is None or not indice.vigente():
+        indice = _indices_dimension[campo] = IndiceDimension(campo)
+    return indice
+
+def pedir_valor(campo, mensaje):
+    # Pide por consola un valor de una tabla de dimension. Se acepta escrito con otras mayusculas o sin acentos; si no existe
+    # se ofrecen los valores mas parecidos para elegir uno por su numero
+    while True:
+        texto = input(mensaje)
+        indice = indice_dimension(campo)
+        encontrado = indice.resolver(texto)
+        if encontrado is not None:
+            return dimension_por_id(campo.model, encontrado[0])
+
+        sugerencias = indice.buscar(texto)
+        if not sugerencias:
+            print(f'El valor ingresado ({texto}) no existe en la base de datos\nPor favor ingrese un valor existente')
+            continue
+
+        print(f'El valor ingresado ({texto}) no existe en la base de datos. Valores parecidos:')
+        for numero, (valor, _, _) in enumerate(sugerencias, 1):
+            print(f'{numero}. {valor}')
+        eleccion = input('Ingresar el número del valor correcto o Enter para escribirlo de nuevo: ').strip()
+        if eleccion.isdigit() and 1 <= int(eleccion) <= len(sugerencias):
+            return dimension_por_id(campo.model, sugerencias[int(eleccion) - 1][1])
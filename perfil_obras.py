@@ -0,0 +1,144 @@
+import atexit
+from contextlib import contextmanager
+import json
+import os
+import re
+import threading
+import time
+from modelo_orm import estadisticas_dimensiones, sqlite_db
+
+# Variable de entorno que activa el perfilado al importar el modulo: con un archivo .json el informe se guarda ahi al terminar,
+# con cualquier otro valor se muestra por pantalla
+VARIABLE_PERFIL = 'OBRAS_PERFIL'
+
+# Percentiles de las latencias que se informan para cada consulta y etapa
+PERCENTILES = (50, 95, 99)
+# Consultas que se muestran en el informe por pantalla, de la que mas tiempo tomo en total a la que menos
+CONSULTAS_MOSTRADAS = 15
+
+# Filas de un INSERT de varias filas: el informe agrupa las sentencias que solo difieren en la cantidad de filas del lote
+FILAS_INSERT = re.compile(r'(\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+')
+
+class Perfil:
+    # Tiempos registrados mientras el perfilado esta activo: sentencia SQL -> duraciones y etapa -> duraciones, en segundos.
+    # Las etapas anidadas tambien se cuentan en la que las contiene
+    def __init__(self, destino=None):
+        self.destino = destino
+        self.inicio = time.perf_counter()
+        self.consultas = {}
+        self.etapas = {}
+        # El servicio HTTP consulta desde varios hilos a la vez
+        self.bloqueo = threading.Lock()
+
+    def registrar(self, registro, clave, segundos):
+        with self.bloqueo:
+            registro.setdefault(clave, []).append(segundos)
+
+    def informe(self):
+        consultas = {}
+        for sql, duraciones in list(self.consultas.items()):
+            consultas.setdefault(FILAS_INSERT.sub(r'\1, ...', sql), []).extend(duraciones)
+
+        return {
+            'segundos': time.perf_counter() - self.inicio,
+            'etapas': {etapa: _estadisticas(duraciones) for etapa, duraciones in list(self.etapas.items())},
+            'dimensiones': estadisticas_dimensiones(),
+            'consultas': sorted(({'sql': sql, **_estadisticas(duraciones)} for sql, duraciones in consultas.items()), key=lambda consulta: -consulta['total']),
+        }
+
+    def mostrar(self, informe):
+        columnas = ' '.join(f'{f"p{percentil}":>9}' for percentil in PERCENTILES)
+        print(f"\nPerfil de la ejecucion ({informe['segundos']:.2f} s en total):")
+
+        print(f"{'etapa':<24}{'veces':>8}{'total':>10} {columnas}")
+        for etapa, datos in informe['etapas'].items():
+            print(f"{etapa:<24}{datos['cantidad']:>8}{datos['total']:>9.3f}s {_columnas_percentiles(datos)}")
+
+        if informe['dimensiones']:
+            print(f"\n{'cache de dimensiones':<24}{'aciertos':>10}{'fallos':>8}")
+            for tabla, datos in informe['dimensiones'].items():
+                print(f"{tabla:<24}{datos['aciertos']:>10}{datos['fallos']:>8}")
+
+        consultas = informe['consultas']
+        total = sum(consulta['total'] for consulta in consultas)
+        print(f"\n{sum(consulta['cantidad'] for consulta in consultas)} consultas SQL de {len(consultas)} sentencias distintas, {total:.3f} s en total:")
+        print(f"{'veces':>8}{'total':>10} {columnas}  sentencia")
+        for consulta in consultas[:CONSULTAS_MOSTRADAS]:
+            sql = consulta['sql'] if len(consulta['sql']) <= 100 else consulta['sql'][:97] + '...'
+            print(f"{consulta['cantidad']:>8}{consulta['total']:>9.3f}s {_columnas_percentiles(consulta)}  {sql}")
+
+    def terminar(self):
+        informe = self.informe()
+        if self.destino and self.destino.endswith('.json'):
+            with open(self.destino, 'w', encoding='utf-8') as f:
+                json.dump(informe, f, ensure_ascii=False, indent=2)
+            print(f'Perfil de la ejecucion guardado en {self.destino}')
+        else:
+            self.mostrar(informe)
+
+def _estadisticas(duraciones):
+    ordenadas = sorted(duraciones)
+    # Percentil por rango mas cercano: el valor que deja por debajo al menos ese porcentaje de las mediciones
+    percentiles = {f'p{percentil}': ordenadas[max(0, -(-percentil * len(ordenadas) // 100) - 1)] for percentil in PERCENTILES}
+    return {'cantidad': len(ordenadas), 'total': sum(ordenadas), **percentiles}
+
+def _columnas_percentiles(datos):
+    return ' '.join(f"{datos[f'p{percentil}'] * 1000:>7.2f}ms" for percentil in PERCENTILES)
+
+# Perfil en curso; mientras es None el perfilado no agrega nada a las consultas y las etapas solo comprueban esta variable
+_perfil = None
+
+def activo():
+    return _perfil is not None
+
+def activar(destino=None):
+    # Empieza a medir cada consulta que pasa por sqlite_db y cada etapa; el informe se muestra o se guarda al terminar el proceso
+    global _perfil
+    if _perfil is not None:
+        return _perfil
+    _perfil = Perfil(destino)
+
+    # Todas las consultas de peewee (y las sentencias crudas) pasan por execute_sql: se reemplaza solo en esta instancia de la base
+    # (los executemany se miden con consulta).
+    # El tiempo medido es el de ejecutar la sentencia hasta obtener la primera fila; el resto de las filas se leen despues al recorrer el cursor
+    ejecutar = sqlite_db.execute_sql
+    def execute_sql(sql, params=None):
+        inicio = time.perf_counter()
+        try:
+            return ejecutar(sql, params)
+        finally:
+            _perfil.registrar(_perfil.consultas, sql, time.perf_counter() - inicio)
+    sqlite_db.execute_sql = execute_sql
+
+    atexit.register(_perfil.terminar)
+    return _perfil
+
+@contextmanager
+def etapa(nombre):
+    # Mide el bloque (o la funcion, usado como decorador) como una etapa del proceso. Sin el perfilado activo no mide nada
+    if _perfil is None:
+        yield
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _perfil.registrar(_perfil.etapas, nombre, time.perf_counter() - inicio)
+
+@contextmanager
+def consulta(sql):
+    # Mide una sentencia que no pasa por execute_sql (los executemany de la carga masiva usan el cursor directamente); se informa junto
+    # con las demas consultas, una medicion por llamada
+    if _perfil is None:
+        yield
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _perfil.registrar(_perfil.consultas, sql, time.perf_counter() - inicio)
+
+if os.environ.get(VARIABLE_PERFIL):
+    activar(os.environ[VARIABLE_PERFIL])
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+from peewee import *
+import modelo_orm
+from gestionar_obras import GestionarObra, RESULTADOS_BUSQUEDA, sqlite_db
+
+# Conexiones de solo lectura que atienden las consultas en paralelo (una por hilo)
+CONEXIONES_LECTURA = 4
+
+# Respuestas que se guardan en la cache y segundos que dura cada una si la base no cambia antes
+CAPACIDAD_CACHE = 256
+TTL_CACHE = 60
+
+# Tamaño de pagina del listado de obras
+POR_PAGINA = 50
+POR_PAGINA_MAXIMO = 500
+
+ESTADOS_HTTP = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# Filtro del listado de obras -> campo de la tabla de dimension con el que se compara el valor
+FILTROS_OBRAS = {
+    'etapa': modelo_orm.Etapa.estado,
+    'tipo': modelo_orm.TipoObra.tipo,
+    'comuna': modelo_orm.Comuna.numero,
+    'barrio': modelo_orm.Barrio.nombre,
+    'empresa': modelo_orm.Empresa.nombre,
+}
+
+class ErrorConsulta(Exception):
+    # Parametros invalidos en la URL; se responde con el estado indicado
+    def __init__(self, mensaje, estado=400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+class CacheRespuestas:
+    # Cache LRU de respuestas con vencimiento. Cada respuesta guarda la version de la base con la que se calculo: cuando la base cambia
+    # (una carga, una sincronizacion o una operacion del ciclo de vida, desde cualquier proceso) se descarta toda la cache
+    def __init__(self, capacidad=CAPACIDAD_CACHE, ttl=TTL_CACHE):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.respuestas = OrderedDict()
+        self.version = None
+
+    def obtener(self, clave, version):
+        if version != self.version:
+            self.respuestas.clear()
+            self.version = version
+
+        respuesta = self.respuestas.get(clave)
+        if respuesta is None or respuesta[0] < time.monotonic():
+            self.respuestas.pop(clave, None)
+            return None
+
+        self.respuestas.move_to_end(clave)
+        return respuesta[1]
+
+    def guardar(self, clave, version, cuerpo):
+        if version != self.version:
+            return
+        self.respuestas[clave] = (time.monotonic() + self.ttl, cuerpo)
+        self.respuestas.move_to_end(clave)
+        while len(self.respuestas) > self.capacidad:
+            self.respuestas.popitem(last=False)
+
+def version_base():
+    # PRAGMA data_version cambia cada vez que otra conexion confirma una escritura; esta conexion (la del hilo del servidor) nunca escribe
+    return sqlite_db.execute_sql('PRAGMA data_version').fetchone()[0]
+
+def _parametro(parametros, nombre, tipo=str, defecto=None):
+    valores = parametros.get(nombre)
+    if not valores:
+        return defecto
+    try:
+        return tipo(valores[-1])
+    except ValueError:
+        raise ErrorConsulta(f'El parametro {nombre} no es valido: {valores[-1]}')
+
+def consultar_indicadores(parametros):
+    return GestionarObra.calcular_indicadores()
+
+def consultar_obras(parametros):
+    # Listado paginado de obras filtrado por los valores de sus dimensiones, ordenado por id
+    Obra = modelo_orm.Obra
+    pagina = _parametro(parametros, 'pagina', int, 1)
+    por_pagina = _parametro(parametros, 'por_pagina', int, POR_PAGINA)
+    if pagina < 1 or not 1 <= por_pagina <= POR_PAGINA_MAXIMO:
+        raise ErrorConsulta(f'pagina debe ser mayor que 0 y por_pagina estar entre 1 y {POR_PAGINA_MAXIMO}')
+
+    filtros = []
+    for nombre, campo in FILTROS_OBRAS.items():
+        valor = _parametro(parametros, nombre, int if campo is modelo_orm.Comuna.numero else str)
+        if valor is not None:
+            filtros.append(campo == valor)
+
+    consulta = (Obra
+        .select(Obra.id, Obra.nombre, modelo_orm.Etapa.estado.alias('etapa'), modelo_orm.TipoObra.tipo.alias('tipo'), modelo_orm.Comuna.numero.alias('comuna'),
+                modelo_orm.Barrio.nombre.alias('barrio'), modelo_orm.Empresa.nombre.alias('empresa'), Obra.monto_contrato, Obra.porcentaje_avance,
+                Obra.fecha_inicio, Obra.fecha_fin_inicial, Obra.latitud, Obra.longitud, Obra.direccion)
+        .join(modelo_orm.Etapa).switch(Obra)
+        .join(modelo_orm.TipoObra).switch(Obra)
+        .join(modelo_orm.Comuna).switch(Obra)
+        .join(modelo_orm.Barrio, JOIN.LEFT_OUTER).switch(Obra)
+        .join(modelo_orm.Empresa, JOIN.LEFT_OUTER))
+    if filtros:
+        consulta = consulta.where(*filtros)
+
+    return {
+        'total': consulta.count(),
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+        'obras': list(consulta.order_by(Obra.id).paginate(pagina, por_pagina).dicts()),
+    }
+
+def consultar_busqueda(parametros):
+    # Busqueda de texto en las obras, filtrable por etapa y comuna, con el puntaje y el fragmento resaltado de cada obra
+    texto = _parametro(parametros, 'q')
+    if not texto:
+        raise ErrorConsulta('Falta el parametro q con el texto a buscar')
+    cantidad = _parametro(parametros, 'cantidad', int, RESULTADOS_BUSQUEDA)
+    if not 1 <= cantidad <= POR_PAGINA_MAXIMO:
+        raise ErrorConsulta(f'cantidad debe estar entre 1 y {POR_PAGINA_MAXIMO}')
+
+    return {'obras': GestionarObra.buscar_obras(texto, _parametro(parametros, 'etapa'), _parametro(parametros, 'comuna', int), cantidad)}
+
+def consultar_atrasos(parametros):
+    # Atrasos en total y por comuna, tipo de obra y empresa a la fecha indicada (por defecto, hoy), sin los arreglos con los valores de cada obra
+    atrasos = GestionarObra.calcular_atrasos(_parametro(parametros, 'fecha', datetime.date.fromisoformat))
+    return {clave: valor for clave, valor in atrasos.items() if clave != 'obras'}
+
+# Ruta -> funcion que arma la respuesta a partir de los parametros de la URL
+RUTAS = {
+    '/indicadores': consultar_indicadores,
+    '/obras': consultar_obras,
+    '/buscar': consultar_busqueda,
+    '/atrasos': consultar_atrasos,
+}
+
+class ServicioObras:
+    def __init__(self, conexiones=CONEXIONES_LECTURA, capacidad=CAPACIDAD_CACHE, ttl=TTL_CACHE):
+        self.cache = CacheRespuestas(capacidad, ttl)
+        # Peewee abre una conexion por hilo: los hilos de este ejecutor son el pool de conexiones de lectura
+        self.ejecutor = ThreadPoolExecutor(max_workers=conexiones, thread_name_prefix='lectura')
+
+    def _ejecutar(self, funcion, parametros):
+        sqlite_db.connect(reuse_if_open=True)
+        return json.dumps(funcion(parametros), ensure_ascii=False, default=str).encode('utf-8')
+
+    async def responder(self, metodo, destino):
+        # Devuelve el estado HTTP, el cuerpo JSON de la respuesta y si salio de la cache
+        if metodo != 'GET':
+            return 405, {'error': 'Solo se admiten consultas GET'}, False
+        url = urlsplit(destino)
+        funcion = RUTAS.get(url.path.rstrip('/') or '/')
+        if funcion is None:
+            return 404, {'error': f'No existe la ruta {url.path}', 'rutas': list(RUTAS)}, False
+
+        parametros = parse_qs(url.query)
+        clave = (url.path, tuple(sorted((nombre, tuple(valores)) for nombre, valores in parametros.items())))
+        version = version_base()
+        cuerpo = self.cache.obtener(clave, version)
+        if cuerpo is not None:
+            return 200, cuerpo, True
+
+        try:
+            cuerpo = await asyncio.get_running_loop().run_in_executor(self.ejecutor, self._ejecutar, funcion, parametros)
+        except ErrorConsulta as e:
+            return e.estado, {'error': str(e)}, False
+        self.cache.guardar(clave, version, cuerpo)
+
+        return 200, cuerpo, False
+
+    async def atender(self, lector, escritor):
+        # HTTP/1.1 minimo: una consulta GET por vez en cada conexion, que se mantiene abierta salvo que el cliente pida cerrarla
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, destino, _ = linea.decode('latin1').split(' ', 2)
+                except ValueError:
+                    break
+
+                cerrar = False
+                while True:
+                    encabezado = await lector.readline()
+                    if encabezado in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = encabezado.decode('latin1').partition(':')
+                    if nombre.strip().lower() == 'connection' and valor.strip().lower() == 'close':
+                        cerrar = True
+
+                try:
+                    estado, cuerpo, en_cache = await self.responder(metodo, destino)
+                except Exception as e:
+                    estado, cuerpo, en_cache = 500, {'error': f'Error al consultar la base: {e}'}, False
+                if not isinstance(cuerpo, bytes):
+                    cuerpo = json.dumps(cuerpo, ensure_ascii=False).encode('utf-8')
+
+                encabezados = [
+                    f'HTTP/1.1 {estado} {ESTADOS_HTTP.get(estado, "")}',
+                    'Content-Type: application/json; charset=utf-8',
+                    f'Content-Length: {len(cuerpo)}',
+                    f'X-Cache: {"HIT" if en_cache else "MISS"}',
+                    f'Connection: {"close" if cerrar else "keep-alive"}',
+                ]
+                escritor.write(('\r\n'.join(encabezados) + '\r\n\r\n').encode('latin1') + cuerpo)
+                await escritor.drain()
+                if cerrar:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            escritor.close()
+
+    async def iniciar(self, host, puerto):
+        servidor = await asyncio.start_server(self.atender, host, puerto)
+        print(f'Servicio de consultas de obras escuchando en http://{host}:{puerto} (rutas: {", ".join(RUTAS)})')
+        async with servidor:
+            await servidor.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servicio HTTP de solo lectura con los indicadores y el listado de obras urbanas')
+    parser.add_argument('--base', default='./obras_urbanas.db', help='ruta de la base SQLite (tiene que estar en modo WAL)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8000)
+    parser.add_argument('--conexiones', type=int, default=CONEXIONES_LECTURA, help='cantidad de conexiones de lectura')
+    parser.add_argument('--ttl', type=int, default=TTL_CACHE, help='segundos que se guarda cada respuesta en la cache')
+    args = parser.parse_args()
+
+    modelo_orm.configurar_db(args.base, solo_lectura=True)
+    sqlite_db.connect()
+    try:
+        asyncio.run(ServicioObras(args.conexiones, ttl=args.ttl).iniciar(args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sqlite_db.close()